@@ -3,3 +3,4 @@
 from . import models
 from . import wizards
 from . import reports
+from .hooks import pre_init_hook, uninstall_hook
@@ -122,17 +122,32 @@
     ],
     'data': [
         'security/ir.model.access.csv',
+        'security/ir_rules.xml',
         'wizards/create_purchase_wizard_views.xml',
         'wizards/link_purchase_wizard_views.xml',  # 🆕 Nueva vista
         'views/sale_order_views.xml',
         'views/purchase_order_views.xml',
         'views/account_move_views.xml',
+        'views/purchase_creation_job_views.xml',
+        'views/res_company_views.xml',
+        'views/purchase_sale_link_review_views.xml',
         'reports/sale_liquidation_report.xml',
+        'reports/sale_case_profitability_report_views.xml',
+        'reports/purchase_backlog_report_views.xml',
+        'data/ir_cron_data.xml',
+        'data/ir_actions_server_data.xml',
     ],
+    'assets': {
+        'web.assets_backend': [
+            'sale_purchase_link_extended/static/src/components/**/*',
+        ],
+    },
     'demo': [],
     'images': [],
     'installable': True,
     'application': False,
     'auto_install': False,
+    'pre_init_hook': 'pre_init_hook',
     'post_init_hook': None,
+    'uninstall_hook': 'uninstall_hook',
 }
\ No newline at end of file
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from .models.account_move import (
+    MOVE_BACKFILL_LAST_ID_PARAM,
+    MOVE_BACKFILL_UNTIL_ID_PARAM,
+    MOVE_RECOMPUTE_ON_INSTALL_PARAM,
+)
+
+
+def pre_init_hook(env):
+    """
+    Crea por adelantado las columnas de montos congelados en moneda de venta.
+
+    Así la instalación no las calcula sobre todo el histórico de compras y
+    facturas en una sola transacción; se llenan después por lotes con el cron
+    "Liquidación: Congelar Montos en Moneda de Venta" (la acción del mismo
+    nombre lo pone en marcha).
+    """
+    for table in ('purchase_order', 'account_move'):
+        env.cr.execute(f"""
+            ALTER TABLE {table}
+                ADD COLUMN IF NOT EXISTS x_sale_currency_id int4,
+                ADD COLUMN IF NOT EXISTS x_amount_sale_currency numeric
+        """)
+
+    _defer_move_source_fields(env)
+
+
+def _defer_move_source_fields(env):
+    """
+    Crea vacías las columnas de origen y vehículo de account.move.
+
+    Odoo solo calcula al instalar los campos almacenados cuya columna crea él,
+    así que se evita recalcular todo el histórico de facturas en una sola
+    transacción. Las facturas existentes se llenan por bloques con el cron
+    "Facturas: Completar Origen y Vehículo", hasta el último id actual.
+
+    Para calcularlas durante la instalación (bases pequeñas), crear antes el
+    parámetro del sistema MOVE_RECOMPUTE_ON_INSTALL_PARAM
+    (sale_purchase_link_extended.move_recompute_on_install) = 1.
+    """
+    params = env['ir.config_parameter'].sudo()
+    if params.get_param(MOVE_RECOMPUTE_ON_INSTALL_PARAM, '0') not in ('0', 'False', 'false'):
+        return
+    env.cr.execute("""
+        ALTER TABLE account_move
+            ADD COLUMN IF NOT EXISTS x_sale_order_id int4,
+            ADD COLUMN IF NOT EXISTS x_purchase_order_id int4,
+            ADD COLUMN IF NOT EXISTS x_placa varchar,
+            ADD COLUMN IF NOT EXISTS x_marca varchar,
+            ADD COLUMN IF NOT EXISTS x_anio varchar,
+            ADD COLUMN IF NOT EXISTS x_vin varchar
+    """)
+    env.cr.execute("SELECT COALESCE(MAX(id), 0) FROM account_move")
+    params.set_param(MOVE_BACKFILL_UNTIL_ID_PARAM, env.cr.fetchone()[0])
+    params.set_param(MOVE_BACKFILL_LAST_ID_PARAM, 0)
+
+
+def uninstall_hook(env):
+    """
+    Elimina la vista materializada del análisis de rentabilidad.
+
+    Al desinstalar, Odoo solo borra las tablas y vistas normales de los
+    modelos; una vista materializada quedaría huérfana en la base.
+    """
+    env.cr.execute("DROP MATERIALIZED VIEW IF EXISTS sale_case_profitability_report CASCADE")
@@ -3,3 +3,8 @@
 from . import sale_order
 from . import purchase_order
 from . import account_move
+from . import res_currency
+from . import res_company
+from . import res_partner
+from . import purchase_creation_job
+from . import purchase_sale_link_review
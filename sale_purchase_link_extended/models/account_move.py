@@ -1,5 +1,21 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Backfill por bloques de origen y vehículo en facturas (ver hooks.pre_init_hook)
+MOVE_SOURCE_FIELDS = ['x_sale_order_id', 'x_purchase_order_id']
+MOVE_VEHICLE_FIELDS = ['x_placa', 'x_marca', 'x_anio', 'x_vin']
+MOVE_BACKFILL_LAST_ID_PARAM = 'sale_purchase_link_extended.move_backfill_last_id'
+MOVE_BACKFILL_UNTIL_ID_PARAM = 'sale_purchase_link_extended.move_backfill_until_id'
+MOVE_BACKFILL_CHUNK_SIZE_PARAM = 'sale_purchase_link_extended.move_backfill_chunk_size'
+MOVE_BACKFILL_CHUNKS_PER_RUN_PARAM = 'sale_purchase_link_extended.move_backfill_chunks_per_run'
+MOVE_RECOMPUTE_ON_INSTALL_PARAM = 'sale_purchase_link_extended.move_recompute_on_install'
+MOVE_BACKFILL_DEFAULTS = {
+    MOVE_BACKFILL_CHUNK_SIZE_PARAM: 1000,
+    MOVE_BACKFILL_CHUNKS_PER_RUN_PARAM: 50,
+}
 
 class AccountMove(models.Model):
     _inherit = 'account.move'
@@ -27,6 +43,30 @@ class AccountMove(models.Model):
         help='Compra vinculada. Se busca automáticamente por líneas de factura o documento origen.'
     )
 
+    # ==============================================================================================
+    #                                  MONTO CONGELADO EN MONEDA DE LA VENTA
+    # ==============================================================================================
+    # Se calcula al publicar la factura con el tipo de cambio histórico y queda guardado:
+    # la liquidación de la venta lo suma directamente, sin buscar tasas.
+
+    x_sale_currency_id = fields.Many2one(
+        'res.currency',
+        string='Moneda de Liquidación',
+        compute='_compute_amount_sale_currency',
+        store=True,
+        copy=False,
+        help='Moneda de la venta origen en la que se congeló el total de la factura'
+    )
+
+    x_amount_sale_currency = fields.Monetary(
+        string='Total en Moneda de Venta',
+        currency_field='x_sale_currency_id',
+        compute='_compute_amount_sale_currency',
+        store=True,
+        copy=False,
+        help='Total de la factura publicada convertido a la moneda de la venta a la fecha de factura'
+    )
+
     # ==============================================================================================
     #                                  CAMPOS DE VEHÍCULO (COMPUTADOS Y EDITABLES)
     # ==============================================================================================
@@ -75,7 +115,19 @@ class AccountMove(models.Model):
         VALIDACIÓN DE ORIGEN:
         Busca profundamente cuál es el documento padre (Venta o Compra).
         Prioriza la vinculación real de líneas (más exacta) sobre el texto de 'invoice_origin'.
+        
+        🎯 En lote: las líneas se precargan para todo el recordset y los
+        orígenes de texto se resuelven con una sola búsqueda `name IN` por modelo.
         """
+        # Precarga en bloque de las líneas vinculadas y sus órdenes
+        self.invoice_line_ids.sale_line_ids.order_id
+        self.invoice_line_ids.purchase_line_id.order_id
+
+        origins_by_move = {move: self._split_invoice_origin(move.invoice_origin) for move in self}
+        all_origins = {origin for origins in origins_by_move.values() for origin in origins}
+        sales_by_name = self._get_orders_by_name('sale.order', all_origins)
+        purchases_by_name = self._get_orders_by_name('purchase.order', all_origins)
+
         for move in self:
             sale_order = False
             purchase_order = False
@@ -92,16 +144,34 @@ class AccountMove(models.Model):
                     break  # Ya encontramos ambos, dejar de buscar
 
             # 2. Fallback: Búsqueda por nombre de origen (Text Matching)
-            # Para facturas muy antiguas migradas sin líneas vinculadas
-            if not sale_order and move.invoice_origin:
-                sale_order = self.env['sale.order'].search([('name', '=', move.invoice_origin)], limit=1)
-            
-            if not purchase_order and move.invoice_origin:
-                purchase_order = self.env['purchase.order'].search([('name', '=', move.invoice_origin)], limit=1)
+            # Para facturas muy antiguas migradas sin líneas vinculadas.
+            # Con varios orígenes ("S00012, S00015") gana el primero que exista.
+            for origin in origins_by_move[move]:
+                sale_order = sale_order or sales_by_name.get(origin, False)
+                purchase_order = purchase_order or purchases_by_name.get(origin, False)
 
             move.x_sale_order_id = sale_order
             move.x_purchase_order_id = purchase_order
 
+    @api.model
+    def _split_invoice_origin(self, invoice_origin):
+        """Referencias de un invoice_origin: el texto completo y, si trae comas, cada parte"""
+        if not invoice_origin:
+            return []
+        origins = [invoice_origin.strip()]
+        if ',' in invoice_origin:
+            origins += [part.strip() for part in invoice_origin.split(',') if part.strip()]
+        return list(dict.fromkeys(origins))
+
+    @api.model
+    def _get_orders_by_name(self, model_name, names):
+        """{nombre: orden} con una sola búsqueda; ante nombres repetidos se queda la primera, como search(limit=1)"""
+        orders_by_name = {}
+        if names:
+            for order in self.env[model_name].search([('name', 'in', list(names))]):
+                orders_by_name.setdefault(order.name, order)
+        return orders_by_name
+
     @api.depends('x_sale_order_id', 'x_purchase_order_id')
     def _compute_vehicle_fields(self):
         """
@@ -129,6 +199,177 @@ class AccountMove(models.Model):
                 move.x_anio = move.x_anio
                 move.x_vin = move.x_vin
 
+    @api.depends('state', 'move_type', 'amount_total', 'currency_id', 'invoice_date', 'date',
+                 'x_sale_order_id.currency_id', 'x_sale_order_id.company_id')
+    def _compute_amount_sale_currency(self):
+        """
+        MONTO CONGELADO:
+        Solo para facturas y notas de crédito de cliente publicadas con venta origen.
+        Se recalcula únicamente si cambia el estado, el monto, la moneda o la fecha.
+        """
+        for move in self:
+            sale = move.x_sale_order_id
+            if sale and move.state == 'posted' and move.move_type in ('out_invoice', 'out_refund'):
+                move.x_sale_currency_id = sale.currency_id
+                move.x_amount_sale_currency = sale._convert_to_sale_currency(
+                    move.amount_total,
+                    move.currency_id,
+                    move.invoice_date or move.date
+                )
+            else:
+                move.x_sale_currency_id = False
+                move.x_amount_sale_currency = 0.0
+
+    @api.model
+    def _backfill_sale_currency_amounts(self, last_id, until_id, batch_size=1000, max_batches=None):
+        """
+        BACKFILL:
+        Llena el monto congelado de facturas publicadas existentes (ids de last_id a until_id),
+        por lotes ordenados por id, recalculados con add_to_compute y con commit por lote.
+        Mientras tanto se liquidan con conversión al vuelo. Lo llama el cron de ventas
+        (sale.order._cron_backfill_sale_currency_amounts).
+        Devuelve (último id procesado, facturas procesadas).
+        """
+        amount_fields = [self._fields['x_sale_currency_id'], self._fields['x_amount_sale_currency']]
+        total = 0
+        batches = 0
+        while last_id < until_id and (not max_batches or batches < max_batches):
+            moves = self.search([
+                ('id', '>', last_id),
+                ('id', '<=', until_id),
+                ('x_sale_order_id', '!=', False),
+                ('state', '=', 'posted'),
+                ('move_type', 'in', ['out_invoice', 'out_refund']),
+                ('x_sale_currency_id', '=', False),
+            ], order='id', limit=batch_size)
+            last_id = moves[-1].id if moves else until_id
+            if moves:
+                for field in amount_fields:
+                    self.env.add_to_compute(field, moves)
+                self.env.flush_all()
+            total += len(moves)
+            batches += 1
+            _logger.info('Montos congelados en moneda de venta: %s facturas, hasta id %s de %s', total, last_id, until_id)
+            if not self.env.registry.in_test_mode():
+                self.env.cr.commit()
+            self.env.invalidate_all()
+        return last_id, total
+
+    # ==============================================================================================
+    #                                  BACKFILL DE ORIGEN Y VEHÍCULO (POR BLOQUES)
+    # ==============================================================================================
+    # Al instalar, pre_init_hook crea estas columnas vacías para que Odoo no las recalcule sobre
+    # todo el histórico en una sola transacción; se llenan aquí, por bloques y con commit por
+    # bloque. Las facturas nuevas se calculan normalmente, por eso solo se recorre hasta el id
+    # que había al instalar (MOVE_BACKFILL_UNTIL_ID_PARAM). Solo facturas: los asientos no tienen
+    # líneas de factura ni venta/compra origen.
+
+    @api.model
+    def _get_move_backfill_param(self, key):
+        value = self.env['ir.config_parameter'].sudo().get_param(key, MOVE_BACKFILL_DEFAULTS.get(key, 0))
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return MOVE_BACKFILL_DEFAULTS.get(key, 0)
+
+    @api.model
+    def _restart_source_backfill(self):
+        """Vuelve a recorrer todas las facturas actuales: solo reinicia los parámetros y dispara el cron"""
+        params = self.env['ir.config_parameter'].sudo()
+        self.flush_model()
+        self.env.cr.execute("SELECT COALESCE(MAX(id), 0) FROM account_move")
+        params.set_param(MOVE_BACKFILL_UNTIL_ID_PARAM, self.env.cr.fetchone()[0])
+        params.set_param(MOVE_BACKFILL_LAST_ID_PARAM, 0)
+        self.env.ref('sale_purchase_link_extended.ir_cron_backfill_move_source_fields').sudo()._trigger()
+
+    @api.model
+    def _backfill_source_and_vehicle_fields(self, chunk_size=None, max_chunks=None):
+        """
+        🎯 Recalcula origen (venta/compra) y completa los datos de vehículo vacíos
+
+        Bloques ordenados por id, commit por bloque y el último id procesado en
+        MOVE_BACKFILL_LAST_ID_PARAM: si se corta, continúa donde quedó. Se puede
+        llamar desde el cron o un shell:
+            env['account.move']._backfill_source_and_vehicle_fields(chunk_size=5000)
+        
+        Solo se recalculan x_sale_order_id / x_purchase_order_id; placa, marca,
+        año y VIN se copian del origen únicamente donde están vacíos, para no
+        pisar las correcciones manuales. Después conviene correr "Congelar
+        Montos en Moneda de Venta", que depende de la venta origen.
+        
+        Devuelve la cantidad de facturas procesadas en esta llamada.
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        chunk_size = max(chunk_size or self._get_move_backfill_param(MOVE_BACKFILL_CHUNK_SIZE_PARAM), 1)
+        until_id = self._get_move_backfill_param(MOVE_BACKFILL_UNTIL_ID_PARAM)
+        last_id = self._get_move_backfill_param(MOVE_BACKFILL_LAST_ID_PARAM)
+        source_fields = [self._fields[fname] for fname in MOVE_SOURCE_FIELDS]
+        
+        total = 0
+        chunks = 0
+        while last_id < until_id and (not max_chunks or chunks < max_chunks):
+            moves = self.search([
+                ('id', '>', last_id),
+                ('id', '<=', until_id),
+                ('move_type', 'in', self.get_invoice_types()),
+            ], order='id', limit=chunk_size)
+            # Sin más facturas: el backfill queda completo
+            last_id = moves[-1].id if moves else until_id
+            if moves:
+                for field in source_fields:
+                    self.env.add_to_compute(field, moves)
+                self.env.flush_all()
+                moves._fill_empty_vehicle_fields()
+            params.set_param(MOVE_BACKFILL_LAST_ID_PARAM, last_id)
+            total += len(moves)
+            chunks += 1
+            _logger.info(
+                'Backfill de origen y vehículo en facturas: %s facturas, hasta id %s de %s',
+                total, last_id, until_id
+            )
+            if not self.env.registry.in_test_mode():
+                self.env.cr.commit()
+            self.env.invalidate_all()
+        return total
+
+    def _fill_empty_vehicle_fields(self):
+        """
+        Copia placa/marca/año/VIN de la venta (o compra) origen solo a los campos
+        vacíos, en una sola consulta y sin tracking (ni mensajes en el chatter)
+        """
+        if not self:
+            return
+        assignments = ', '.join(
+            f"{fname} = COALESCE(NULLIF(am.{fname}, ''), src.{fname})" for fname in MOVE_VEHICLE_FIELDS
+        )
+        empty = ' OR '.join(f"COALESCE(am.{fname}, '') = ''" for fname in MOVE_VEHICLE_FIELDS)
+        self.env.cr.execute(f"""
+            UPDATE account_move am
+               SET {assignments}
+              FROM (
+                    SELECT m.id,
+                           COALESCE(so.id, po.id) AS source_id,
+                           CASE WHEN so.id IS NOT NULL THEN so.x_placa ELSE po.x_placa END AS x_placa,
+                           CASE WHEN so.id IS NOT NULL THEN so.x_marca ELSE po.x_marca END AS x_marca,
+                           CASE WHEN so.id IS NOT NULL THEN so.x_anio ELSE po.x_anio END AS x_anio,
+                           CASE WHEN so.id IS NOT NULL THEN so.x_vin ELSE po.x_vin END AS x_vin
+                      FROM account_move m
+                 LEFT JOIN sale_order so ON so.id = m.x_sale_order_id
+                 LEFT JOIN purchase_order po ON po.id = m.x_purchase_order_id
+                     WHERE m.id IN %s
+                   ) src
+             WHERE src.id = am.id
+               AND src.source_id IS NOT NULL
+               AND ({empty})
+        """, [tuple(self.ids)])
+        self.invalidate_recordset(MOVE_VEHICLE_FIELDS)
+
+    @api.model
+    def _cron_backfill_source_and_vehicle_fields(self):
+        """Procesa unos cuantos bloques por ejecución; no hace nada cuando el backfill terminó"""
+        max_chunks = max(self._get_move_backfill_param(MOVE_BACKFILL_CHUNKS_PER_RUN_PARAM), 1)
+        return self._backfill_source_and_vehicle_fields(max_chunks=max_chunks)
+
     # ==============================================================================================
     #                                  VALIDACIONES DE FORMATO
     # ==============================================================================================
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+# Segundos que el cron puede dedicar a la cola por ejecución (luego se vuelve a disparar)
+JOBS_TIME_LIMIT_PARAM = 'sale_purchase_link_extended.purchase_jobs_time_limit'
+DEFAULT_JOBS_TIME_LIMIT = 240
+
+
+class SalePurchaseCreationJob(models.Model):
+    _name = 'sale.purchase.creation.job'
+    _description = 'Trabajo de Creación de Compras'
+    _order = 'id desc'
+
+    name = fields.Char(string='Referencia', compute='_compute_name')
+    sale_order_ids = fields.Many2many('sale.order', string='Órdenes de Venta', readonly=True)
+    user_id = fields.Many2one('res.users', string='Solicitado por', default=lambda self: self.env.user, readonly=True)
+    company_id = fields.Many2one('res.company', string='Compañía', default=lambda self: self.env.company, readonly=True)
+    state = fields.Selection([
+        ('pending', 'En Cola'),
+        ('running', 'En Proceso'),
+        ('done', 'Terminado'),
+        ('failed', 'Con Errores'),
+    ], string='Estado', default='pending', readonly=True, index=True)
+
+    # Opciones del wizard al momento de encolar
+    group_by_vendor = fields.Boolean(string='Agrupar por Proveedor', readonly=True)
+    x_purchase_only_missing = fields.Boolean(string='Comprar solo cantidades faltantes', readonly=True)
+    x_merge_into_draft = fields.Boolean(string='Agregar a borradores existentes', readonly=True)
+
+    chunk_ids = fields.One2many('sale.purchase.creation.job.chunk', 'job_id', string='Bloques', readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+    chunk_count = fields.Integer(string='Bloques', compute='_compute_progress')
+    chunk_done_count = fields.Integer(string='Bloques Terminados', compute='_compute_progress')
+    progress = fields.Float(string='Avance (%)', compute='_compute_progress')
+    purchase_order_ids = fields.Many2many(
+        'purchase.order', string='Órdenes de Compra', compute='_compute_purchase_order_ids'
+    )
+
+    @api.depends('sale_order_ids')
+    def _compute_name(self):
+        for job in self:
+            job.name = ', '.join(job.sale_order_ids.mapped('name')) or _('Trabajo #%s', job.id)
+
+    @api.depends('chunk_ids.state')
+    def _compute_progress(self):
+        for job in self:
+            done = len(job.chunk_ids.filtered(lambda c: c.state == 'done'))
+            job.chunk_count = len(job.chunk_ids)
+            job.chunk_done_count = done
+            job.progress = 100.0 * done / len(job.chunk_ids) if job.chunk_ids else 0.0
+
+    @api.depends('chunk_ids.purchase_order_ids')
+    def _compute_purchase_order_ids(self):
+        for job in self:
+            job.purchase_order_ids = job.chunk_ids.purchase_order_ids
+
+    # ========== PROCESAMIENTO ==========
+    def _trigger_processing(self):
+        """Pide al cron que procese la cola lo antes posible"""
+        self.env.ref('sale_purchase_link_extended.ir_cron_process_purchase_creation_jobs').sudo()._trigger()
+
+    def _get_wizard(self):
+        """
+        Wizard con las opciones del trabajo, ejecutado como el usuario que lo solicitó
+
+        Sin vista previa: el trabajo agrupa solo las líneas de cada bloque.
+        """
+        self.ensure_one()
+        Wizard = self.env['create.purchase.wizard'].with_user(self.user_id).with_company(self.company_id)
+        return Wizard.with_context(skip_purchase_preview=True).create({
+            'sale_order_ids': [(6, 0, self.sale_order_ids.ids)],
+            'group_by_vendor': self.group_by_vendor,
+            'x_purchase_only_missing': self.x_purchase_only_missing,
+            'x_merge_into_draft': self.x_merge_into_draft,
+        })
+
+    def _plan_chunks(self):
+        """
+        🎯 Divide el trabajo en un bloque por proveedor
+
+        Solo guarda qué líneas de venta van a cada proveedor; las cantidades
+        se recalculan al procesar cada bloque.
+        """
+        self.ensure_one()
+        wizard = self._get_wizard()
+        generic_vendor = wizard._get_or_create_generic_vendor()
+        lines_by_vendor = wizard._group_lines_by_vendor(self.sale_order_ids.order_line, generic_vendor)
+        self.write({
+            'state': 'running',
+            'chunk_ids': [
+                (0, 0, {
+                    'vendor_id': lines_data[0]['vendor'].id,
+                    'sale_line_ids': [(6, 0, [line_data['line'].id for line_data in lines_data])],
+                })
+                for lines_data in lines_by_vendor.values()
+            ],
+        })
+
+    def _process(self, deadline=None):
+        """
+        Planifica (si hace falta) y procesa los bloques pendientes, con commit por bloque
+
+        Si se alcanza `deadline` (time.monotonic()) el trabajo queda 'running'
+        y continúa en la siguiente ejecución. Devuelve True si terminó.
+        """
+        self.ensure_one()
+        if self.state == 'pending':
+            if not self._run_step(self._plan_chunks):
+                return True
+            self._commit_progress()
+        for chunk in self.chunk_ids.filtered(lambda c: c.state == 'pending'):
+            if deadline and time.monotonic() >= deadline:
+                return False
+            chunk._process()
+            self._commit_progress()
+        self._run_step(self._finalize)
+        self._commit_progress()
+        return True
+
+    def _run_step(self, step):
+        """
+        🎯 Ejecuta una etapa del trabajo (planificar, cerrar) en un savepoint
+
+        Si falla, el trabajo queda 'failed' con el error y la cola sigue con
+        los demás trabajos en lugar de revertir toda la ejecución del cron.
+        """
+        self.ensure_one()
+        try:
+            with self.env.cr.savepoint():
+                step()
+            return True
+        except Exception as e:
+            self.env.invalidate_all(flush=False)
+            _logger.exception('Error en el trabajo de creación de compras %s', self.id)
+            self.write({'state': 'failed', 'error': str(e)})
+            self._commit_progress()
+            return False
+
+    def _finalize(self):
+        """
+        Cierra el trabajo y deja constancia en las ventas
+
+        El aviso del PROVEEDOR GENERICO se publica aquí, una vez por venta,
+        con el total de todos los bloques (una venta puede abarcar varios).
+        """
+        self.ensure_one()
+        if self.chunk_ids.filtered(lambda c: c.state == 'failed'):
+            self.write({'state': 'failed', 'error': _('Hay bloques con errores.')})
+            return
+        self.write({'state': 'done', 'error': False})
+        purchase_names = ', '.join(self.purchase_order_ids.mapped('name')) or _('ninguna (sin cantidades pendientes)')
+        for sale_order in self.sale_order_ids:
+            sale_order.message_post(
+                body=_('<p><strong>✅ Compras creadas en segundo plano:</strong> %s</p>') % purchase_names
+            )
+        generic_count = {}
+        for line in self.chunk_ids.generic_sale_line_ids:
+            generic_count[line.order_id] = generic_count.get(line.order_id, 0) + 1
+        self.env['create.purchase.wizard']._post_generic_vendor_count(generic_count)
+
+    def _commit_progress(self):
+        """Confirma lo procesado para que el avance sea visible y no se repita"""
+        self.env.flush_all()
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
+
+    @api.model
+    def _cron_process_jobs(self):
+        """
+        Procesa los trabajos en cola, del más antiguo al más reciente
+
+        Con límite de tiempo por ejecución: si se agota, se vuelve a disparar
+        el cron para continuar, sin retener el worker con un trabajo enorme.
+        """
+        try:
+            time_limit = int(self.env['ir.config_parameter'].sudo().get_param(
+                JOBS_TIME_LIMIT_PARAM, DEFAULT_JOBS_TIME_LIMIT
+            ))
+        except (TypeError, ValueError):
+            time_limit = DEFAULT_JOBS_TIME_LIMIT
+        deadline = time.monotonic() + max(time_limit, 1)
+        for job in self.search([('state', 'in', ['pending', 'running'])], order='id'):
+            if time.monotonic() >= deadline or not job._process(deadline):
+                self._trigger_processing()
+                break
+
+    # ========== ACCIONES ==========
+    def action_retry(self):
+        """
+        Reintenta solo los bloques fallidos. Los bloques terminados ya tienen
+        sus compras confirmadas en base de datos y no se vuelven a crear.
+        """
+        for job in self:
+            if job.state != 'failed':
+                raise UserError(_('Solo se pueden reintentar trabajos con errores.'))
+            job.chunk_ids.filtered(lambda c: c.state == 'failed').write({'state': 'pending', 'error': False})
+            # Sin bloques: falló al planificar, se vuelve a planificar
+            job.write({'state': 'running' if job.chunk_ids else 'pending', 'error': False})
+        self._trigger_processing()
+
+    def action_view_purchase_orders(self):
+        self.ensure_one()
+        action = self.env.ref('purchase.purchase_form_action').read()[0]
+        action['domain'] = [('id', 'in', self.purchase_order_ids.ids)]
+        action['view_mode'] = 'tree,form'
+        if 'res_id' in action:
+            del action['res_id']
+        return action
+
+
+class SalePurchaseCreationJobChunk(models.Model):
+    _name = 'sale.purchase.creation.job.chunk'
+    _description = 'Bloque de Trabajo de Creación de Compras'
+    _order = 'id'
+
+    job_id = fields.Many2one('sale.purchase.creation.job', string='Trabajo', required=True, ondelete='cascade', index=True)
+    vendor_id = fields.Many2one('res.partner', string='Proveedor', readonly=True)
+    sale_line_ids = fields.Many2many('sale.order.line', string='Líneas de Venta', readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('done', 'Terminado'),
+        ('failed', 'Fallido'),
+    ], string='Estado', default='pending', readonly=True)
+    purchase_order_ids = fields.Many2many('purchase.order', string='Órdenes de Compra', readonly=True)
+    # Líneas compradas con el PROVEEDOR GENERICO (se avisa una vez por venta al cerrar el trabajo)
+    generic_sale_line_ids = fields.Many2many(
+        'sale.order.line',
+        'sale_purchase_creation_job_chunk_generic_line_rel',
+        'chunk_id',
+        'sale_line_id',
+        string='Líneas con Proveedor Genérico',
+        readonly=True,
+    )
+    error = fields.Text(string='Error', readonly=True)
+    attempts = fields.Integer(string='Intentos', readonly=True)
+
+    def _process(self):
+        """
+        🎯 Crea las compras del bloque
+
+        Las compras y el estado 'done' del bloque se guardan en el mismo
+        commit, así un bloque fallido se puede reintentar sin duplicar nada.
+        """
+        self.ensure_one()
+        job = self.job_id
+        try:
+            with self.env.cr.savepoint():
+                wizard = job._get_wizard()
+                wizard._reserve_sale_orders(self.sale_line_ids.order_id)
+                generic_vendor = wizard._get_or_create_generic_vendor()
+                lines_by_vendor = wizard._group_lines_by_vendor(self.sale_line_ids, generic_vendor)
+                purchase_orders = self.env['purchase.order']
+                if lines_by_vendor:
+                    purchase_orders = wizard._create_purchase_orders(lines_by_vendor)
+                generic_line_ids = [
+                    line_data['line'].id
+                    for lines_data in lines_by_vendor.values()
+                    for line_data in lines_data
+                    if line_data['generic']
+                ]
+                self.write({
+                    'state': 'done',
+                    'purchase_order_ids': [(6, 0, purchase_orders.ids)],
+                    'generic_sale_line_ids': [(6, 0, generic_line_ids)],
+                    'attempts': self.attempts + 1,
+                    'error': False,
+                })
+        except Exception as e:
+            self.env.invalidate_all(flush=False)
+            _logger.exception('Error creando compras del bloque %s (trabajo %s)', self.id, job.id)
+            self.write({'state': 'failed', 'attempts': self.attempts + 1, 'error': str(e)})
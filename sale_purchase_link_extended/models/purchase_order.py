@@ -1,6 +1,44 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api
+from odoo import models, fields, api, _
+from odoo.tools import sql
+from datetime import timedelta
+import logging
+import re
+
+_logger = logging.getLogger(__name__)
+
+# Vinculación automática de compras huérfanas (parámetros de sistema)
+AUTOLINK_LAST_ID_PARAM = 'sale_purchase_link_extended.autolink_last_id'
+AUTOLINK_BATCH_SIZE_PARAM = 'sale_purchase_link_extended.autolink_batch_size'
+AUTOLINK_BATCHES_PER_RUN_PARAM = 'sale_purchase_link_extended.autolink_batches_per_run'
+AUTOLINK_THRESHOLD_PARAM = 'sale_purchase_link_extended.autolink_threshold'
+AUTOLINK_REVIEW_THRESHOLD_PARAM = 'sale_purchase_link_extended.autolink_review_threshold'
+AUTOLINK_DEFAULTS = {
+    AUTOLINK_BATCH_SIZE_PARAM: 500,
+    AUTOLINK_BATCHES_PER_RUN_PARAM: 20,
+    AUTOLINK_THRESHOLD_PARAM: 80,
+    AUTOLINK_REVIEW_THRESHOLD_PARAM: 40,
+}
+# Diferencia mínima entre el mejor y el segundo candidato para no ser ambiguo
+AUTOLINK_MARGIN = 15.0
+AUTOLINK_DATE_WINDOW = 60
+# Candidatos por productos: máximo por compra, y productos en más líneas de venta
+# que esto (mano de obra, servicios genéricos) no generan candidatos
+AUTOLINK_PRODUCT_CANDIDATES = 20
+AUTOLINK_MAX_PRODUCT_SALE_LINES = 1000
+AUTOLINK_WEIGHTS = {
+    'origin': 100.0,
+    'vin': 60.0,
+    'placa': 45.0,
+    'products': 30.0,
+    'date': 10.0,
+}
+
+
+def normalize_vehicle_key(value):
+    """Placa/VIN comparables: mayúsculas y solo letras y números ('abc-123 ' -> 'ABC123')"""
+    return ''.join(char for char in (value or '').upper() if char.isalnum()) or False
 
 
 class PurchaseOrder(models.Model):
@@ -30,6 +68,10 @@ class PurchaseOrder(models.Model):
         help='Orden de venta que originó esta orden de compra. Puede editarse manualmente para vincular compras existentes.'
     )
     
+    # 🆕 Índices trigram para el filtro de referencia del wizard de vinculación (ilike)
+    name = fields.Char(index='trigram')
+    partner_ref = fields.Char(index='trigram')
+    
     x_sale_order_name = fields.Char(
         string='Número de Venta',
         related='x_sale_order_id.name',
@@ -37,6 +79,27 @@ class PurchaseOrder(models.Model):
         readonly=True
     )
 
+    # ========== 🆕 MONTO CONGELADO EN MONEDA DE LA VENTA ==========
+    # Se calcula al confirmar la compra con el tipo de cambio histórico de
+    # date_order y queda guardado: la liquidación lo suma sin buscar tasas.
+    x_sale_currency_id = fields.Many2one(
+        'res.currency',
+        string='Moneda de Liquidación',
+        compute='_compute_amount_sale_currency',
+        store=True,
+        copy=False,
+        help='Moneda de la venta asociada en la que se congeló el total de la compra'
+    )
+    
+    x_amount_sale_currency = fields.Monetary(
+        string='Total en Moneda de Venta',
+        currency_field='x_sale_currency_id',
+        compute='_compute_amount_sale_currency',
+        store=True,
+        copy=False,
+        help='Total de la compra confirmada convertido a la moneda de la venta a la fecha de la orden'
+    )
+
     # ========== CAMPOS DE VEHÍCULO ==========
     x_placa = fields.Char(
         string='Placa',
@@ -66,6 +129,101 @@ class PurchaseOrder(models.Model):
         copy=False
     )
 
+    # 🆕 Claves normalizadas e indexadas para sugerir vínculos con ventas
+    x_placa_key = fields.Char(
+        string='Placa (Clave)',
+        compute='_compute_vehicle_keys',
+        store=True,
+        index='btree_not_null'
+    )
+    
+    x_vin_key = fields.Char(
+        string='VIN (Clave)',
+        compute='_compute_vehicle_keys',
+        store=True,
+        index='btree_not_null'
+    )
+
+    @api.depends('x_placa', 'x_vin')
+    def _compute_vehicle_keys(self):
+        for po in self:
+            po.x_placa_key = normalize_vehicle_key(po.x_placa)
+            po.x_vin_key = normalize_vehicle_key(po.x_vin)
+
+    # ========== 🆕 CONGELAR MONTO AL CONFIRMAR ==========
+    @api.depends('state', 'amount_total', 'currency_id', 'date_order',
+                 'x_sale_order_id.currency_id', 'x_sale_order_id.company_id')
+    def _compute_amount_sale_currency(self):
+        """
+        🎯 Convierte el total a la moneda de la venta cuando la compra está confirmada
+        
+        Solo se recalcula si cambian estado, monto, moneda, fecha o venta asociada.
+        """
+        for po in self:
+            sale = po.x_sale_order_id
+            if sale and po.state in ['purchase', 'done']:
+                po.x_sale_currency_id = sale.currency_id
+                po.x_amount_sale_currency = sale._convert_to_sale_currency(
+                    po.amount_total,
+                    po.currency_id,
+                    po.date_order
+                )
+            else:
+                po.x_sale_currency_id = False
+                po.x_amount_sale_currency = 0.0
+    
+    @api.model
+    def _backfill_sale_currency_amounts(self, last_id, until_id, batch_size=1000, max_batches=None):
+        """
+        🎯 Llena el monto congelado de compras confirmadas existentes (ids de last_id a until_id)
+        
+        Lotes ordenados por id, recalculados con add_to_compute (sin pasar por
+        write) y con commit por lote. Las compras aún sin congelar se siguen
+        liquidando con conversión al vuelo. Lo llama el cron de ventas
+        (sale.order._cron_backfill_sale_currency_amounts).
+        
+        Devuelve (último id procesado, compras procesadas).
+        """
+        amount_fields = [self._fields['x_sale_currency_id'], self._fields['x_amount_sale_currency']]
+        total = 0
+        batches = 0
+        while last_id < until_id and (not max_batches or batches < max_batches):
+            orders = self.search([
+                ('id', '>', last_id),
+                ('id', '<=', until_id),
+                ('x_sale_order_id', '!=', False),
+                ('state', 'in', ['purchase', 'done']),
+                ('x_sale_currency_id', '=', False),
+            ], order='id', limit=batch_size)
+            # Sin más compras: el backfill queda completo
+            last_id = orders[-1].id if orders else until_id
+            if orders:
+                for field in amount_fields:
+                    self.env.add_to_compute(field, orders)
+                self.env.flush_all()
+            total += len(orders)
+            batches += 1
+            _logger.info('Montos congelados en moneda de venta: %s compras, hasta id %s de %s', total, last_id, until_id)
+            if not self.env.registry.in_test_mode():
+                self.env.cr.commit()
+            self.env.invalidate_all()
+        return last_id, total
+
+    def init(self):
+        """
+        Índices parciales sobre las compras SIN venta asociada: son las únicas
+        que busca el wizard de vinculación, ordenadas por fecha
+        """
+        super().init()
+        sql.create_index(
+            self.env.cr, 'purchase_order_unlinked_date_order_idx', self._table,
+            ['date_order DESC', 'id DESC'], where='x_sale_order_id IS NULL',
+        )
+        sql.create_index(
+            self.env.cr, 'purchase_order_unlinked_partner_date_order_idx', self._table,
+            ['partner_id', 'date_order DESC'], where='x_sale_order_id IS NULL',
+        )
+
     # ========== AUTO-CONVERSIÓN A MAYÚSCULAS ==========
     @api.onchange('x_placa', 'x_marca', 'x_anio', 'x_vin')
     def _onchange_vehicle_fields(self):
@@ -157,15 +315,9 @@ class PurchaseOrder(models.Model):
             if 'x_vin' in vals and vals['x_vin']:
                 vals['x_vin'] = vals['x_vin'].upper()
         
-        orders = super().create(vals_list)
-        
-        # Actualizar relaciones en ventas asociadas al crear
-        for po in orders:
-            if po.x_sale_order_id:
-                po.x_sale_order_id._compute_purchase_order_count()
-                po.x_sale_order_id._compute_liquidation_data()
-        
-        return orders
+        # La liquidación de la venta asociada es almacenada y se recalcula
+        # automáticamente por sus dependencias (purchase_order_ids.*)
+        return super().create(vals_list)
 
     # ========== ACCIÓN: Ver orden de venta ==========
     def action_view_sale_order(self):
@@ -184,6 +336,321 @@ class PurchaseOrder(models.Model):
             'target': 'current',
         }
 
+    # ========== 🆕 CONCILIACIÓN A NIVEL DE LÍNEA ==========
+    def _allocate_sale_lines(self, sale_order):
+        """
+        🎯 Empareja las líneas de compra sin línea de venta con las de `sale_order`
+        
+        Solo mismo producto y misma categoría de UdM; se prefieren las líneas
+        de venta con la misma UdM (la cantidad se convierte a la UdM de venta).
+        Asignación greedy: cada línea de compra va a la primera línea de venta
+        con cantidad pendiente y la descuenta; si todas están cubiertas, va a
+        la última candidata.
+        
+        Devuelve [(línea de compra, línea de venta, cantidad en UdM de venta)].
+        """
+        sale_lines_by_product = {}
+        for sale_line in sale_order.order_line.filtered('product_id'):
+            sale_lines_by_product.setdefault(sale_line.product_id, []).append(sale_line)
+        remaining = {
+            sale_line: max(sale_line.x_qty_pending_purchase, 0.0)
+            for sale_lines in sale_lines_by_product.values() for sale_line in sale_lines
+        }
+        
+        allocations = []
+        po_lines = self.filtered(lambda po: po.state != 'cancel').order_line.filtered(
+            lambda l: l.product_id and not l.x_sale_line_id and not l.display_type
+        )
+        for po_line in po_lines.sorted('id'):
+            candidates = [
+                sale_line for sale_line in sale_lines_by_product.get(po_line.product_id, [])
+                if sale_line.product_uom.category_id == po_line.product_uom.category_id
+            ]
+            if not candidates:
+                continue
+            candidates.sort(key=lambda sale_line: (sale_line.product_uom != po_line.product_uom, sale_line.id))
+            target = next((sale_line for sale_line in candidates if remaining[sale_line] > 0), candidates[-1])
+            qty = po_line.product_uom._compute_quantity(po_line.product_qty, target.product_uom)
+            remaining[target] -= qty
+            allocations.append((po_line, target, qty))
+        return allocations
+
+    @api.model
+    def _write_sale_line_allocations(self, pairs):
+        """
+        Escribe x_sale_line_id de [(línea de compra, línea de venta)] de una vez:
+        un write por línea de venta y un único flush, así las cantidades
+        compradas de la venta se recalculan una sola vez
+        """
+        PurchaseOrderLine = self.env['purchase.order.line']
+        lines_by_sale_line = {}
+        for po_line, sale_line in pairs:
+            lines_by_sale_line[sale_line] = lines_by_sale_line.get(sale_line, PurchaseOrderLine) | po_line
+        for sale_line, po_lines in lines_by_sale_line.items():
+            po_lines.write({'x_sale_line_id': sale_line.id})
+        PurchaseOrderLine.flush_model(['x_sale_line_id'])
+        return len(pairs)
+
+    def _reconcile_sale_lines(self, sale_order):
+        """Concilia las líneas de estas compras con las de `sale_order` (vínculo sin vista previa)"""
+        return self._write_sale_line_allocations([
+            (po_line, sale_line) for po_line, sale_line, qty in self._allocate_sale_lines(sale_order)
+        ])
+
+    # ========== 🆕 VINCULACIÓN AUTOMÁTICA DE COMPRAS HUÉRFANAS ==========
+    @api.model
+    def _get_orphan_domain(self):
+        """
+        Compras sin venta: ni en cabecera ni en sus líneas
+
+        Las consolidadas (líneas de varias ventas, sin cabecera) ya están
+        atribuidas línea por línea y no deben vincularse a una sola venta.
+        """
+        return [('x_sale_order_id', '=', False), '!', ('order_line.x_sale_order_id', '!=', False)]
+
+    @api.model
+    def _get_autolink_param(self, key):
+        value = self.env['ir.config_parameter'].sudo().get_param(key, AUTOLINK_DEFAULTS.get(key, 0))
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return AUTOLINK_DEFAULTS.get(key, 0)
+
+    def _match_sale_orders(self):
+        """
+        🎯 Candidatos de venta para un lote de compras sin venta, con puntaje
+
+        Todo por lote y con búsquedas indexadas:
+        - origin: ventas confirmadas citadas en el origen (sale_order.name)
+        - placa/VIN normalizados (x_placa_key / x_vin_key de sale.order)
+        - productos en común: ventas confirmadas con los mismos productos
+          dentro de ±AUTOLINK_DATE_WINDOW días (las AUTOLINK_PRODUCT_CANDIDATES
+          con más productos en común, sin los productos demasiado frecuentes),
+          y la misma proporción para los candidatos anteriores
+        
+        Devuelve {compra: [(puntaje, venta, [motivos]), ...]} de mayor a menor.
+        """
+        SaleOrder = self.env['sale.order']
+        if not self:
+            return {}
+        self.flush_recordset()
+        SaleOrder.flush_model(['name', 'state', 'date_order', 'x_placa_key', 'x_vin_key'])
+        self.env['purchase.order.line'].flush_model(['order_id', 'product_id'])
+        self.env['sale.order.line'].flush_model(['order_id', 'product_id'])
+        confirmed = [('state', 'in', ['sale', 'done'])]
+        
+        # 1. Por origen
+        origin_names = {
+            po.id: {token for token in re.split(r'[,;\s]+', po.origin or '') if token}
+            for po in self
+        }
+        all_names = set().union(*origin_names.values())
+        sales_by_name = {}
+        if all_names:
+            for sale in SaleOrder.search(confirmed + [('name', 'in', list(all_names))]):
+                sales_by_name[sale.name] = sale
+        
+        # 2. Por placa / VIN
+        placa_keys = {po.x_placa_key for po in self if po.x_placa_key}
+        vin_keys = {po.x_vin_key for po in self if po.x_vin_key}
+        sales_by_placa, sales_by_vin = {}, {}
+        if placa_keys or vin_keys:
+            for sale in SaleOrder.search(confirmed + [
+                '|', ('x_placa_key', 'in', list(placa_keys)), ('x_vin_key', 'in', list(vin_keys)),
+            ]):
+                if sale.x_placa_key in placa_keys:
+                    sales_by_placa.setdefault(sale.x_placa_key, SaleOrder)
+                    sales_by_placa[sale.x_placa_key] |= sale
+                if sale.x_vin_key in vin_keys:
+                    sales_by_vin.setdefault(sale.x_vin_key, SaleOrder)
+                    sales_by_vin[sale.x_vin_key] |= sale
+        
+        # 3. Por productos (ventas confirmadas cercanas en fecha). Los productos
+        # con más de AUTOLINK_MAX_PRODUCT_SALE_LINES líneas de venta se descartan
+        # (el OFFSET corta el conteo) y se guardan los mejores candidatos por compra.
+        overlap = {}
+        sales_by_po = {}
+        self.env.cr.execute("""
+            WITH products AS (
+                SELECT DISTINCT pol.product_id
+                  FROM purchase_order_line pol
+                 WHERE pol.order_id IN %(po_ids)s AND pol.product_id IS NOT NULL
+            ),
+            selective AS (
+                SELECT p.product_id
+                  FROM products p
+                 WHERE NOT EXISTS (
+                        SELECT 1 FROM sale_order_line sol
+                         WHERE sol.product_id = p.product_id
+                        OFFSET %(max_lines)s LIMIT 1
+                       )
+            )
+            SELECT po_id, order_id, common
+              FROM (
+                    SELECT po.id AS po_id, sol.order_id, COUNT(DISTINCT sol.product_id) AS common,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY po.id
+                               ORDER BY COUNT(DISTINCT sol.product_id) DESC, sol.order_id DESC
+                           ) AS rank
+                      FROM purchase_order po
+                      JOIN purchase_order_line pol ON pol.order_id = po.id
+                      JOIN selective s ON s.product_id = pol.product_id
+                      JOIN sale_order_line sol ON sol.product_id = pol.product_id
+                      JOIN sale_order so ON so.id = sol.order_id
+                     WHERE po.id IN %(po_ids)s
+                       AND so.state IN ('sale', 'done')
+                       AND so.date_order BETWEEN po.date_order - %(window)s AND po.date_order + %(window)s
+                  GROUP BY po.id, sol.order_id
+                   ) ranked
+             WHERE rank <= %(limit)s
+        """, {
+            'po_ids': tuple(self.ids),
+            'max_lines': AUTOLINK_MAX_PRODUCT_SALE_LINES,
+            'window': timedelta(days=AUTOLINK_DATE_WINDOW),
+            'limit': AUTOLINK_PRODUCT_CANDIDATES,
+        })
+        for po_id, sale_id, common in self.env.cr.fetchall():
+            overlap[po_id, sale_id] = common
+            sales_by_po.setdefault(po_id, []).append(sale_id)
+        
+        candidates = {}
+        for po in self:
+            sales = SaleOrder.browse(sales_by_po.get(po.id, []))
+            for name in origin_names[po.id]:
+                sales |= sales_by_name.get(name, SaleOrder)
+            sales |= sales_by_placa.get(po.x_placa_key, SaleOrder)
+            sales |= sales_by_vin.get(po.x_vin_key, SaleOrder)
+            candidates[po] = sales
+        
+        # Proporción de productos para los candidatos que no vinieron por producto
+        pairs = [(po.id, sale.id) for po, sales in candidates.items() for sale in sales if (po.id, sale.id) not in overlap]
+        if pairs:
+            self.env.cr.execute("""
+                SELECT p.po_id, p.so_id, COUNT(DISTINCT pol.product_id)
+                  FROM unnest(%s::int[], %s::int[]) AS p(po_id, so_id)
+                  JOIN purchase_order_line pol ON pol.order_id = p.po_id
+                  JOIN sale_order_line sol ON sol.order_id = p.so_id AND sol.product_id = pol.product_id
+              GROUP BY p.po_id, p.so_id
+            """, [[pair[0] for pair in pairs], [pair[1] for pair in pairs]])
+            for po_id, sale_id, common in self.env.cr.fetchall():
+                overlap[po_id, sale_id] = common
+        self.env.cr.execute("""
+            SELECT order_id, COUNT(DISTINCT product_id)
+              FROM purchase_order_line
+             WHERE order_id IN %s AND product_id IS NOT NULL
+          GROUP BY order_id
+        """, [tuple(self.ids)])
+        product_counts = dict(self.env.cr.fetchall())
+        
+        # 4. Puntaje
+        weights = AUTOLINK_WEIGHTS
+        result = {}
+        for po, sales in candidates.items():
+            scored = []
+            for sale in sales:
+                score = 0.0
+                reasons = []
+                if sale.name in origin_names[po.id]:
+                    score += weights['origin']
+                    reasons.append(_('Origen'))
+                if po.x_vin_key and po.x_vin_key == sale.x_vin_key:
+                    score += weights['vin']
+                    reasons.append(_('VIN'))
+                if po.x_placa_key and po.x_placa_key == sale.x_placa_key:
+                    score += weights['placa']
+                    reasons.append(_('Placa'))
+                common = overlap.get((po.id, sale.id), 0)
+                if common and product_counts.get(po.id):
+                    score += weights['products'] * common / product_counts[po.id]
+                    reasons.append(_('%s/%s productos', common, product_counts[po.id]))
+                if po.date_order and sale.date_order:
+                    days = abs((po.date_order - sale.date_order).days)
+                    if days <= AUTOLINK_DATE_WINDOW:
+                        score += weights['date'] * (1 - days / AUTOLINK_DATE_WINDOW)
+                        reasons.append(_('%s días', days))
+                scored.append((score, sale, reasons))
+            scored.sort(key=lambda item: (-item[0], -item[1].id))
+            result[po] = scored
+        return result
+
+    def _autolink_batch(self, threshold, review_threshold):
+        """
+        Vincula las compras del lote con un candidato claro y manda a la
+        cola de revisión las ambiguas. Devuelve (vinculadas, en revisión).
+        """
+        matches = self._match_sale_orders()
+        to_link = {}
+        review_vals = []
+        for po, scored in matches.items():
+            if not scored or scored[0][0] < review_threshold:
+                continue
+            best_score, best_sale, reasons = scored[0]
+            second_score = scored[1][0] if len(scored) > 1 else 0.0
+            if best_score >= threshold and best_score - second_score >= AUTOLINK_MARGIN:
+                to_link.setdefault(best_sale, self.browse())
+                to_link[best_sale] |= po
+                continue
+            for score, sale, reasons in scored[:3]:
+                if score >= review_threshold:
+                    review_vals.append({
+                        'purchase_id': po.id,
+                        'sale_order_id': sale.id,
+                        'score': score,
+                        'reasons': ', '.join(reasons),
+                    })
+        
+        for sale, purchases in to_link.items():
+            purchases.with_context(skip_sale_update=True).write({'x_sale_order_id': sale.id})
+            purchases._reconcile_sale_lines(sale)
+            sale.message_post(body=_(
+                '<p><strong>🤖 Órdenes de Compra Vinculadas Automáticamente</strong></p><ul>%s</ul>'
+            ) % ''.join(f'<li>{po.name} - {po.partner_id.name}</li>' for po in purchases))
+        reviews = self.env['purchase.sale.link.review']._create_pending(review_vals)
+        return sum(len(purchases) for purchases in to_link.values()), len(reviews.purchase_id)
+
+    @api.model
+    def _cron_autolink_sale_orders(self):
+        """
+        🎯 Recorre las compras sin venta por lotes (keyset por id) y las vincula
+
+        Commit por lote; el último id procesado se guarda en AUTOLINK_LAST_ID_PARAM
+        una sola vez al final de la ejecución (set_param limpia la caché del
+        registro en todos los workers). Si el cron se corta antes, se repiten
+        esos lotes sin efecto: las compras ya vinculadas dejan de ser huérfanas
+        y la cola de revisión no duplica candidatos. Al llegar al final el
+        cursor vuelve a 0, así una compra revisada antes de que se confirmara
+        su venta se vuelve a evaluar en la siguiente vuelta.
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        batch_size = max(self._get_autolink_param(AUTOLINK_BATCH_SIZE_PARAM), 1)
+        max_batches = max(self._get_autolink_param(AUTOLINK_BATCHES_PER_RUN_PARAM), 1)
+        threshold = self._get_autolink_param(AUTOLINK_THRESHOLD_PARAM)
+        review_threshold = self._get_autolink_param(AUTOLINK_REVIEW_THRESHOLD_PARAM)
+        last_id = self._get_autolink_param(AUTOLINK_LAST_ID_PARAM)
+        
+        for _batch in range(max_batches):
+            purchases = self.search(self._get_orphan_domain() + [
+                ('id', '>', last_id),
+                ('state', '!=', 'cancel'),
+            ], order='id', limit=batch_size)
+            if not purchases:
+                # Fin del recorrido: la siguiente ejecución empieza otra vuelta
+                last_id = 0
+                break
+            linked, reviewed = purchases._autolink_batch(threshold, review_threshold)
+            last_id = purchases[-1].id if len(purchases) == batch_size else 0
+            _logger.info(
+                'Vinculación automática: %s compras revisadas hasta id %s, %s vinculadas, %s a revisión',
+                len(purchases), purchases[-1].id, linked, reviewed
+            )
+            self.env.flush_all()
+            if not self.env.registry.in_test_mode():
+                self.env.cr.commit()
+            self.env.invalidate_all()
+            if not last_id:
+                break
+        params.set_param(AUTOLINK_LAST_ID_PARAM, last_id)
+
 
 class PurchaseOrderLine(models.Model):
     _inherit = 'purchase.order.line'
@@ -193,7 +660,8 @@ class PurchaseOrderLine(models.Model):
         string='Línea de Venta Asociada',
         copy=False,
         help='Línea de venta que originó esta línea de compra',
-        ondelete='set null'
+        ondelete='set null',
+        index='btree_not_null'
     )
     
     x_sale_order_id = fields.Many2one(
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+
+class PurchaseSaleLinkReview(models.Model):
+    _name = 'purchase.sale.link.review'
+    _description = 'Revisión de Vínculos Compra-Venta'
+    _order = 'purchase_id, score desc, id'
+
+    purchase_id = fields.Many2one('purchase.order', string='Orden de Compra', required=True, ondelete='cascade', index=True)
+    sale_order_id = fields.Many2one('sale.order', string='Venta Sugerida', required=True, ondelete='cascade')
+    partner_id = fields.Many2one(related='purchase_id.partner_id', string='Proveedor')
+    purchase_date = fields.Datetime(related='purchase_id.date_order', string='Fecha Compra')
+    sale_date = fields.Datetime(related='sale_order_id.date_order', string='Fecha Venta')
+    score = fields.Float(string='Puntaje', digits=(16, 1), readonly=True)
+    reasons = fields.Char(string='Coincidencias', readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('accepted', 'Aceptada'),
+        ('rejected', 'Rechazada'),
+    ], string='Estado', default='pending', required=True, index=True)
+
+    _sql_constraints = [
+        ('purchase_sale_uniq', 'unique(purchase_id, sale_order_id)',
+         'Ya existe una revisión para esta compra y venta.'),
+    ]
+
+    @api.model
+    def _create_pending(self, vals_list):
+        """Crea las revisiones que aún no existen (reprocesar un lote no duplica)"""
+        if not vals_list:
+            return self.browse()
+        existing = self.search([('purchase_id', 'in', [vals['purchase_id'] for vals in vals_list])])
+        seen = {(review.purchase_id.id, review.sale_order_id.id) for review in existing}
+        new_vals = []
+        for vals in vals_list:
+            key = (vals['purchase_id'], vals['sale_order_id'])
+            if key not in seen:
+                seen.add(key)
+                new_vals.append(vals)
+        return self.create(new_vals)
+
+    def action_accept(self):
+        """Vincula la compra a la venta sugerida y descarta las otras sugerencias"""
+        for review in self:
+            if review.state != 'pending':
+                continue
+            if review.purchase_id.x_sale_order_id:
+                raise UserError(_('La compra %s ya está vinculada a %s.',
+                                  review.purchase_id.name, review.purchase_id.x_sale_order_id.name))
+            review.purchase_id.write({'x_sale_order_id': review.sale_order_id.id})
+            review.purchase_id._reconcile_sale_lines(review.sale_order_id)
+            others = self.search([
+                ('purchase_id', '=', review.purchase_id.id),
+                ('id', '!=', review.id),
+                ('state', '=', 'pending'),
+            ])
+            others.state = 'rejected'
+            review.state = 'accepted'
+
+    def action_reject(self):
+        self.filtered(lambda review: review.state == 'pending').state = 'rejected'
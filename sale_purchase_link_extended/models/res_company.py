@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import models, fields, tools
+
+_logger = logging.getLogger(__name__)
+
+GENERIC_VENDOR_NAME = 'PROVEEDOR GENERICO'
+
+
+class ResCompany(models.Model):
+    _inherit = 'res.company'
+
+    x_generic_vendor_id = fields.Many2one(
+        'res.partner',
+        string='Proveedor Genérico',
+        help='Proveedor asignado a los productos sin proveedor configurado al crear compras desde ventas. '
+             'Si está vacío se crea (o se adopta el existente) la primera vez que se necesita.'
+    )
+
+    # ========== 🆕 PROVEEDOR GENÉRICO POR COMPAÑÍA ==========
+    def _get_generic_vendor(self):
+        """
+        🎯 Proveedor genérico de la compañía, sin búsquedas por nombre
+
+        El id queda en la caché del registro; solo la primera llamada (o
+        después de cambiar el campo, o de archivar/eliminar el proveedor, ver
+        res.partner) consulta la base de datos.
+        """
+        self.ensure_one()
+        return self.env['res.partner'].browse(self._get_generic_vendor_id())
+
+    @tools.ormcache('self.id')
+    def _get_generic_vendor_id(self):
+        company = self.sudo()
+        # Un proveedor archivado se reemplaza igual que uno eliminado
+        if not company.x_generic_vendor_id.active:
+            company._create_generic_vendor()
+        return company.x_generic_vendor_id.id
+
+    def _create_generic_vendor(self):
+        """
+        Asigna el proveedor genérico bajo bloqueo de la fila de la compañía
+
+        Dos transacciones simultáneas no pueden crear dos proveedores: la
+        segunda espera el bloqueo y, al ver el campo ya asignado por la
+        primera, PostgreSQL la hace reintentar con los datos nuevos.
+        Se adopta el partner 'PROVEEDOR GENERICO' existente si lo hay.
+        """
+        self.ensure_one()
+        self.flush_recordset(['x_generic_vendor_id'])
+        self.env.cr.execute('SELECT id FROM res_company WHERE id = %s FOR UPDATE', [self.id])
+        self.invalidate_recordset(['x_generic_vendor_id'])
+        if self.x_generic_vendor_id.active:
+            return
+
+        vendor = self.env['res.partner'].search([
+            ('name', '=', GENERIC_VENDOR_NAME),
+            ('supplier_rank', '>', 0),
+            ('company_id', 'in', [False, self.id]),
+        ], order='id', limit=1)
+        if not vendor:
+            vendor = self.env['res.partner'].create({
+                'name': GENERIC_VENDOR_NAME,
+                'supplier_rank': 1,
+                'company_type': 'company',
+                'email': 'generico@proveedor.com',
+                'phone': '0000-0000',
+                'comment': 'Proveedor genérico creado automáticamente para productos sin proveedor asignado',
+            })
+            _logger.info('Proveedor genérico creado: ID %s', vendor.id)
+        self.x_generic_vendor_id = vendor
+        # Si esta transacción se revierte, el id en caché ya no sería válido
+        self.env.cr.postrollback.add(self.env.registry.clear_cache)
+
+    def write(self, vals):
+        result = super().write(vals)
+        if 'x_generic_vendor_id' in vals:
+            self.env.registry.clear_cache()
+        return result
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+import bisect
+import weakref
+
+from odoo import models, fields, api
+from odoo.tools.lru import LRU
+
+# Parámetro de sistema con el tamaño máximo de la caché de tipos de cambio
+RATE_CACHE_SIZE_PARAM = 'sale_purchase_link_extended.rate_cache_size'
+DEFAULT_RATE_CACHE_SIZE = 2048
+
+# Una caché por cursor (transacción). Se libera sola al cerrar el cursor.
+_rate_caches = weakref.WeakKeyDictionary()
+
+# Tasas precargadas por cursor:
+# {(currency_id, root_company_id): (date_from, date_to, fechas_compañía, tasas_compañía, fechas_globales, tasas_globales)}
+_rate_tables = weakref.WeakKeyDictionary()
+
+
+class ResCurrency(models.Model):
+    _inherit = 'res.currency'
+
+    # ========== 🆕 CACHÉ DE TIPOS DE CAMBIO PARA LIQUIDACIÓN ==========
+    def _get_liquidation_rate_cache(self):
+        """
+        🎯 Devuelve la caché LRU de tipos de cambio de la transacción actual
+
+        Es compartida por todos los cálculos de liquidación del mismo request
+        y se descarta en commit/rollback o cuando cambia algún res.currency.rate.
+        """
+        cr = self.env.cr
+        cache = _rate_caches.get(cr)
+        if cache is None:
+            size = self.env['ir.config_parameter'].sudo().get_param(
+                RATE_CACHE_SIZE_PARAM, DEFAULT_RATE_CACHE_SIZE
+            )
+            try:
+                size = max(int(size), 1)
+            except (TypeError, ValueError):
+                size = DEFAULT_RATE_CACHE_SIZE
+            cache = _rate_caches[cr] = LRU(size)
+            self._register_liquidation_rate_cleanup()
+        return cache
+
+    def _register_liquidation_rate_cleanup(self):
+        """Descarta la caché y las tasas precargadas al terminar la transacción (commit o rollback)"""
+        cr = self.env.cr
+        cr.postcommit.add(self._clear_liquidation_rate_cache)
+        cr.postrollback.add(self._clear_liquidation_rate_cache)
+
+    def _clear_liquidation_rate_cache(self):
+        """Descarta la caché y las tasas precargadas de la transacción actual"""
+        _rate_caches.pop(self.env.cr, None)
+        _rate_tables.pop(self.env.cr, None)
+
+    @api.model
+    def _get_liquidation_rate_stamps(self, currencies):
+        """
+        Marca por moneda de sus tasas: {currency_id: (última write_date, cantidad)}
+
+        Una consulta solo sobre las monedas dadas; cambia si se crea,
+        modifica o elimina alguna de sus tasas.
+        """
+        if not currencies:
+            return {}
+        self.env['res.currency.rate'].flush_model(['currency_id', 'write_date'])
+        self.env.cr.execute("""
+            SELECT currency_id, MAX(write_date), COUNT(*)
+              FROM res_currency_rate
+             WHERE currency_id IN %s
+          GROUP BY currency_id
+        """, [tuple(currencies.ids)])
+        return {currency_id: (write_date, count) for currency_id, write_date, count in self.env.cr.fetchall()}
+
+    # ========== 🆕 PRECARGA MASIVA DE TIPOS DE CAMBIO ==========
+    @api.model
+    def _preload_liquidation_rates(self, currencies, companies, date_from, date_to):
+        """
+        🎯 Trae en UNA consulta todas las tasas necesarias para convertir
+        documentos de `currencies` entre date_from y date_to
+
+        Para cada (moneda, compañía raíz) guarda listas ordenadas por fecha;
+        luego "tasa a la fecha" se resuelve con búsqueda binaria, sin SQL.
+        Incluye la última tasa anterior a date_from y la primera tasa
+        registrada, para replicar exactamente res.currency._get_rates.
+        """
+        date_from = fields.Date.to_date(date_from)
+        date_to = fields.Date.to_date(date_to)
+        roots = companies.root_id
+        currencies |= roots.currency_id
+        if not currencies or not roots or not date_from or not date_to:
+            return
+
+        self.env['res.currency.rate'].flush_model(['currency_id', 'company_id', 'name', 'rate'])
+        scope = """currency_id IN %(currencies)s
+                   AND (company_id IS NULL OR company_id IN %(companies)s)"""
+        self.env.cr.execute(f"""
+            (SELECT currency_id, company_id, name, rate
+               FROM res_currency_rate
+              WHERE {scope} AND name BETWEEN %(date_from)s AND %(date_to)s)
+            UNION
+            (SELECT DISTINCT ON (currency_id, company_id) currency_id, company_id, name, rate
+               FROM res_currency_rate
+              WHERE {scope} AND name < %(date_from)s
+           ORDER BY currency_id, company_id, name DESC)
+            UNION
+            (SELECT DISTINCT ON (currency_id, company_id) currency_id, company_id, name, rate
+               FROM res_currency_rate
+              WHERE {scope}
+           ORDER BY currency_id, company_id, name ASC)
+           ORDER BY 1, 2, 3
+        """, {
+            'currencies': tuple(currencies.ids),
+            'companies': tuple(roots.ids),
+            'date_from': date_from,
+            'date_to': date_to,
+        })
+        by_company = {}
+        for currency_id, company_id, rate_date, rate in self.env.cr.fetchall():
+            dates, rates = by_company.setdefault((currency_id, company_id), ([], []))
+            dates.append(rate_date)
+            rates.append(rate)
+
+        tables = _rate_tables.get(self.env.cr)
+        if tables is None:
+            tables = _rate_tables[self.env.cr] = {}
+            self._register_liquidation_rate_cleanup()
+        for currency in currencies:
+            global_dates, global_rates = by_company.get((currency.id, None), ([], []))
+            for root in roots:
+                company_dates, company_rates = by_company.get((currency.id, root.id), ([], []))
+                tables[(currency.id, root.id)] = (
+                    date_from, date_to,
+                    company_dates, company_rates,
+                    global_dates, global_rates,
+                )
+
+    @api.model
+    def _get_preloaded_rate(self, currency, root_company, rate_date):
+        """
+        Tasa cruda (res.currency.rate.rate) precargada de `currency` a la fecha,
+        o None si no fue precargada para ese rango
+        """
+        table = _rate_tables.get(self.env.cr, {}).get((currency.id, root_company.id))
+        if not table or not table[0] <= rate_date <= table[1]:
+            return None
+        date_from, date_to, company_dates, company_rates, global_dates, global_rates = table
+        # Misma prioridad que _get_rates: tasa de la compañía, luego la global,
+        # y si no hay ninguna anterior a la fecha, la primera registrada
+        index = bisect.bisect_right(company_dates, rate_date) - 1
+        if index >= 0:
+            return company_rates[index]
+        index = bisect.bisect_right(global_dates, rate_date) - 1
+        if index >= 0:
+            return global_rates[index]
+        if company_rates:
+            return company_rates[0]
+        if global_rates:
+            return global_rates[0]
+        return 1.0
+
+    @api.model
+    def _get_preloaded_conversion_rate(self, from_currency, to_currency, company, rate_date):
+        """
+        Replica _get_conversion_rate (inverse_rate origen * rate destino, ambas
+        relativas a la moneda de la compañía raíz) usando solo tasas precargadas
+        """
+        root = company.root_id
+        raw_from = self._get_preloaded_rate(from_currency, root, rate_date)
+        raw_to = self._get_preloaded_rate(to_currency, root, rate_date)
+        raw_company = self._get_preloaded_rate(root.currency_id, root, rate_date)
+        if raw_from is None or raw_to is None or raw_company is None:
+            return None
+        inverse_rate_from = 1 / ((raw_from or 1.0) / raw_company)
+        rate_to = (raw_to or 1.0) / raw_company
+        return inverse_rate_from * rate_to
+
+    @api.model
+    def _get_liquidation_conversion_rate(self, from_currency, to_currency, company, conversion_date):
+        """
+        🎯 Igual que _get_conversion_rate, pero memorizado por
+        (moneda origen, moneda destino, compañía, fecha)
+        """
+        if from_currency == to_currency:
+            return 1
+        company = company or self.env.company
+        conversion_date = fields.Date.to_date(conversion_date) or fields.Date.context_today(self)
+        key = (from_currency.id, to_currency.id, company.id, conversion_date)
+
+        cache = self._get_liquidation_rate_cache()
+        rate = cache.get(key)
+        if rate is None:
+            rate = self._get_preloaded_conversion_rate(
+                from_currency, to_currency, company, conversion_date
+            )
+            if rate is None:
+                rate = self._get_conversion_rate(
+                    from_currency, to_currency, company, conversion_date
+                )
+            cache[key] = rate
+        return rate
+
+
+class ResCurrencyRate(models.Model):
+    _inherit = 'res.currency.rate'
+
+    # ========== INVALIDACIÓN DE LA CACHÉ DE LIQUIDACIÓN ==========
+    @api.model_create_multi
+    def create(self, vals_list):
+        rates = super().create(vals_list)
+        self.env['res.currency']._clear_liquidation_rate_cache()
+        return rates
+
+    def write(self, vals):
+        result = super().write(vals)
+        self.env['res.currency']._clear_liquidation_rate_cache()
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self.env['res.currency']._clear_liquidation_rate_cache()
+        return result
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+
+
+class ResPartner(models.Model):
+    _inherit = 'res.partner'
+
+    # ========== 🆕 INVALIDACIÓN DEL PROVEEDOR GENÉRICO EN CACHÉ ==========
+    def _is_generic_vendor(self):
+        """True si alguno de estos partners es el proveedor genérico de alguna compañía"""
+        return bool(self.ids) and bool(self.env['res.company'].sudo().with_context(active_test=False).search_count(
+            [('x_generic_vendor_id', 'in', self.ids)], limit=1
+        ))
+
+    def write(self, vals):
+        clear_cache = 'active' in vals and self._is_generic_vendor()
+        result = super().write(vals)
+        if clear_cache:
+            # res.company._get_generic_vendor_id tiene el id en caché
+            self.env.registry.clear_cache()
+        return result
+
+    def unlink(self):
+        # El FK pone x_generic_vendor_id en NULL sin pasar por res.company.write
+        clear_cache = self._is_generic_vendor()
+        result = super().unlink()
+        if clear_cache:
+            self.env.registry.clear_cache()
+        return result
@@ -1,6 +1,43 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
+from odoo.tools import float_compare, float_round
+from odoo.tools.lru import LRU
+from datetime import timedelta
+import logging
+
+from .purchase_order import normalize_vehicle_key
+
+_logger = logging.getLogger(__name__)
+
+# Caché LRU (por proceso) de los resúmenes HTML de liquidación.
+# Las claves incluyen write_date de compras y líneas, así que un cambio
+# en los documentos produce una clave nueva y la entrada vieja se descarta sola.
+_summary_cache = LRU(512)
+
+# Sugerencias de compras a vincular: ventana de fechas (días) y pesos del puntaje
+SUGGESTION_DATE_WINDOW = 60
+SUGGESTION_CANDIDATES_PER_SIGNAL = 50
+SUGGESTION_WEIGHTS = {
+    'vin': 50.0,
+    'placa': 40.0,
+    'products': 30.0,
+    'vendor': 10.0,
+    'date': 10.0,
+}
+
+# Backfill por lotes de montos congelados en moneda de venta: {modelo: (último id, id tope)}
+SALE_CURRENCY_BACKFILL_PARAMS = {
+    'purchase.order': (
+        'sale_purchase_link_extended.po_sale_currency_backfill_last_id',
+        'sale_purchase_link_extended.po_sale_currency_backfill_until_id',
+    ),
+    'account.move': (
+        'sale_purchase_link_extended.move_sale_currency_backfill_last_id',
+        'sale_purchase_link_extended.move_sale_currency_backfill_until_id',
+    ),
+}
+SALE_CURRENCY_BACKFILL_BATCHES_PER_RUN = 20
 
 
 class SaleOrder(models.Model):
@@ -46,6 +83,21 @@ class SaleOrder(models.Model):
         tracking=True
     )
 
+    # 🆕 Claves normalizadas e indexadas (vinculación automática de compras)
+    x_placa_key = fields.Char(
+        string='Placa (Clave)',
+        compute='_compute_vehicle_keys',
+        store=True,
+        index='btree_not_null'
+    )
+    
+    x_vin_key = fields.Char(
+        string='VIN (Clave)',
+        compute='_compute_vehicle_keys',
+        store=True,
+        index='btree_not_null'
+    )
+
     # ========== CAMPOS DE RELACIÓN CON COMPRAS ==========
     purchase_order_ids = fields.One2many(
         'purchase.order',
@@ -73,6 +125,7 @@ class SaleOrder(models.Model):
     pending_to_purchase = fields.Integer(
         string='Pendientes por Comprar',
         compute='_compute_purchase_statistics',
+        search='_search_pending_to_purchase',
         store=False,
         help='Número de líneas de venta sin línea de compra asociada'
     )
@@ -96,35 +149,35 @@ class SaleOrder(models.Model):
     total_invoiced_amount = fields.Monetary(
         string='Total Facturado (Bruto)',
         compute='_compute_liquidation_data',
-        store=False,
+        store=True,
         help='Total de las facturas (out_invoice) confirmadas relacionadas con esta OV (convertido a moneda de venta)'
     )
     
     total_credit_note_amount = fields.Monetary(
         string='Total Notas de Crédito',
         compute='_compute_liquidation_data',
-        store=False,
+        store=True,
         help='Total de las notas de crédito (out_refund) confirmadas (convertido a moneda de venta)'
     )
     
     total_net_invoiced_amount = fields.Monetary(
         string='Total Facturado (Neto)',
         compute='_compute_liquidation_data',
-        store=False,
+        store=True,
         help='Total facturado menos notas de crédito (Ingreso Real)'
     )
     
     total_purchase_amount = fields.Monetary(
         string='Total de Compras',
         compute='_compute_liquidation_data',
-        store=False,
+        store=True,
         help='Total de las compras confirmadas (convertido a moneda de venta)'
     )
     
     sale_completion_percentage = fields.Float(
         string='Porcentaje de Utilidad (Neto)',
         compute='_compute_liquidation_data',
-        store=False,
+        store=True,
         help='Porcentaje de ganancia neta sobre el ingreso neto.\n'
              'Fórmula: (Ganancia Neta / Ingreso Neto)'
     )
@@ -132,7 +185,8 @@ class SaleOrder(models.Model):
     profit_margin = fields.Monetary(
         string='Margen de Utilidad (Neto)',
         compute='_compute_liquidation_data',
-        store=False,
+        store=True,
+        index=True,
         help='Diferencia entre ventas facturadas netas y compras realizadas (en moneda de venta)'
     )
     
@@ -188,11 +242,40 @@ class SaleOrder(models.Model):
         return super().create(vals_list)
 
     # ========== CAMPOS COMPUTADOS BÁSICOS ==========
-    @api.depends('purchase_order_ids')
+    @api.depends('x_placa', 'x_vin')
+    def _compute_vehicle_keys(self):
+        for order in self:
+            order.x_placa_key = normalize_vehicle_key(order.x_placa)
+            order.x_vin_key = normalize_vehicle_key(order.x_vin)
+
+    @api.depends('purchase_order_ids', 'order_line.x_purchase_line_ids.order_id')
     def _compute_purchase_order_count(self):
-        """Calcula el número de órdenes de compra asociadas"""
+        """Calcula el número de órdenes de compra asociadas (incluye las consolidadas)"""
         for order in self:
-            order.purchase_order_count = len(order.purchase_order_ids)
+            order.purchase_order_count = len(order._get_related_purchase_orders())
+
+    # ========== 🆕 COMPRAS CONSOLIDADAS (VARIAS VENTAS EN UNA COMPRA) ==========
+    def _get_consolidated_purchase_amounts(self):
+        """
+        🎯 {compra: monto} de las compras consolidadas con líneas de esta venta
+
+        Una compra consolidada no tiene venta en cabecera (x_sale_order_id), así
+        que no está en purchase_order_ids; a esta venta le corresponde solo la
+        parte de sus líneas (price_total, en la moneda de la compra).
+        """
+        self.ensure_one()
+        amounts = {}
+        for po_line in self.order_line.x_purchase_line_ids:
+            po = po_line.order_id
+            if not po.x_sale_order_id:
+                amounts[po] = amounts.get(po, 0.0) + po_line.price_total
+        return amounts
+
+    def _get_related_purchase_orders(self):
+        """Compras vinculadas por cabecera más las consolidadas con líneas de esta venta"""
+        self.ensure_one()
+        consolidated = self.env['purchase.order'].union(*self._get_consolidated_purchase_amounts())
+        return self.purchase_order_ids | consolidated
 
     # ========== MEJORA #5: ESTADÍSTICAS DE PRODUCTOS ==========
     @api.depends('order_line.x_purchase_status')
@@ -225,8 +308,80 @@ class SaleOrder(models.Model):
             order.products_purchased_qty = total_qty_purchased
             order.products_pending_qty = total_qty_pending
 
+    def _search_pending_to_purchase(self, operator, value):
+        """
+        🎯 Búsqueda por número de líneas pendientes, resuelta en SQL
+        
+        Usa el campo almacenado (e indexado) x_purchase_status de las líneas,
+        sin cargar líneas en Python.
+        """
+        comparators = {
+            '=': lambda count: count == value,
+            '!=': lambda count: count != value,
+            '>': lambda count: count > value,
+            '>=': lambda count: count >= value,
+            '<': lambda count: count < value,
+            '<=': lambda count: count <= value,
+        }
+        if operator not in comparators or not isinstance(value, (int, float)):
+            raise UserError(_('Operación no soportada para "Pendientes por Comprar".'))
+        
+        # Mismo criterio que _compute_purchase_statistics (cantidad pendiente > 0)
+        pending_domain = [('x_purchase_status', '!=', 'purchased'), ('x_qty_pending_purchase', '>', 0)]
+        if (operator == '>' and 0 <= value < 1) or (operator == '>=' and 0 < value <= 1):
+            # Caso típico (ej: > 0): órdenes con al menos una línea pendiente
+            return [('order_line', 'any', pending_domain)]
+        
+        groups = self.env['sale.order.line']._read_group(
+            pending_domain,
+            groupby=['order_id'],
+            aggregates=['__count'],
+            having=[('__count', operator, value)],
+        )
+        order_ids = [order.id for order, _count in groups]
+        domain = [('id', 'in', order_ids)]
+        if comparators[operator](0):
+            # Las órdenes sin líneas pendientes (0) también cumplen la condición
+            domain = ['|', ('order_line', 'not any', pending_domain)] + domain
+        return domain
+
     # ========== 🆕 MEJORA #1: CONVERSIÓN AUTOMÁTICA DE MONEDA ==========
     
+    def _get_sale_currency_rate(self, from_currency, conversion_date):
+        """
+        🎯 Obtiene el factor de conversión de from_currency a la moneda de esta venta
+        
+        Es el mismo factor que aplica res.currency._convert, de modo que
+        importe * factor (redondeado) da exactamente el mismo resultado.
+        
+        Returns:
+            float: Factor de conversión, o None si no se pudo obtener
+        """
+        self.ensure_one()
+        try:
+            # Memorizado por transacción (ver res.currency._get_liquidation_conversion_rate)
+            return self.env['res.currency']._get_liquidation_conversion_rate(
+                from_currency,
+                self.currency_id,
+                self.company_id,
+                conversion_date or fields.Date.today()
+            )
+        except Exception as e:
+            _logger.warning(
+                f'Error obteniendo tipo de cambio de {from_currency.name} a {self.currency_id.name} '
+                f'en fecha {conversion_date}: {str(e)}. Usando monto original.'
+            )
+            return None
+    
+    def _apply_sale_currency_rate(self, amount, rate):
+        """Aplica un factor ya obtenido y redondea a la moneda de la venta (igual que _convert)"""
+        self.ensure_one()
+        if rate is None:
+            return amount
+        if not amount:
+            return 0.0
+        return self.currency_id.round(amount * rate)
+    
     def _convert_to_sale_currency(self, amount, from_currency, conversion_date):
         """
         🎯 MÉTODO HELPER: Convierte cualquier monto a la moneda de esta venta
@@ -255,68 +410,293 @@ class SaleOrder(models.Model):
         if from_currency == self.currency_id:
             return amount
         
-        try:
-            # Usar el método estándar de Odoo para conversión
-            # https://github.com/odoo/odoo/blob/18.0/odoo/addons/base/models/res_currency.py
-            converted = from_currency._convert(
-                amount,
-                self.currency_id,           # Moneda destino (la de la venta)
-                self.company_id,            # Compañía (para tasa de cambio)
-                conversion_date or fields.Date.today()  # Fecha de conversión
+        # Mismo cálculo que res.currency._convert, pero separando la obtención
+        # del factor para poder reutilizarlo en el cálculo por lotes.
+        # Si falla la conversión (ej: tipo de cambio no disponible) se
+        # retorna el monto original como fallback.
+        rate = self._get_sale_currency_rate(from_currency, conversion_date)
+        return self._apply_sale_currency_rate(amount, rate)
+    
+    # ========== 🆕 BACKFILL DE MONTOS CONGELADOS (CRON) ==========
+    @api.model
+    def _restart_sale_currency_backfill(self):
+        """
+        Congela los montos de las compras y facturas actuales: solo reinicia
+        los parámetros (hasta el último id de hoy) y dispara el cron
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        for model_name, (last_id_param, until_id_param) in SALE_CURRENCY_BACKFILL_PARAMS.items():
+            Model = self.env[model_name]
+            Model.flush_model()
+            self.env.cr.execute(f"SELECT COALESCE(MAX(id), 0) FROM {Model._table}")
+            params.set_param(until_id_param, self.env.cr.fetchone()[0])
+            params.set_param(last_id_param, 0)
+        self.env.ref('sale_purchase_link_extended.ir_cron_backfill_sale_currency_amounts').sudo()._trigger()
+
+    @api.model
+    def _cron_backfill_sale_currency_amounts(self):
+        """
+        Procesa unos cuantos lotes por modelo y ejecución; no hace nada cuando terminó
+
+        El avance se guarda una vez por modelo al final de la ejecución. Si se
+        corta antes, los lotes ya congelados no se repiten: la búsqueda solo
+        trae documentos sin monto congelado.
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        for model_name, (last_id_param, until_id_param) in SALE_CURRENCY_BACKFILL_PARAMS.items():
+            try:
+                last_id = int(params.get_param(last_id_param, 0))
+                until_id = int(params.get_param(until_id_param, 0))
+            except (TypeError, ValueError):
+                continue
+            if last_id >= until_id:
+                continue
+            new_last_id, _total = self.env[model_name]._backfill_sale_currency_amounts(
+                last_id, until_id, max_batches=SALE_CURRENCY_BACKFILL_BATCHES_PER_RUN
             )
-            return converted
-        except Exception as e:
-            # Si falla la conversión (ej: tipo de cambio no disponible)
-            # Loguear el error y retornar el monto original
-            import logging
-            _logger = logging.getLogger(__name__)
-            _logger.warning(
-                f'Error convirtiendo {amount} de {from_currency.name} a {self.currency_id.name} '
-                f'en fecha {conversion_date}: {str(e)}. Usando monto original.'
+            params.set_param(last_id_param, new_last_id)
+
+    # ========== 🆕 MOTOR DE LIQUIDACIÓN POR LOTES ==========
+    
+    def _get_liquidation_documents(self):
+        """
+        Agrupa los documentos de UNA orden usando el ORM.
+        
+        Solo se usa para registros aún no guardados (NewId, onchange), donde
+        no es posible consultar la base de datos.
+        
+        Returns:
+            dict: {'out_invoice'|'out_refund'|'purchase': {(moneda, fecha): [montos]}}
+            Los montos ya congelados en la moneda de la venta van con moneda vacía.
+        """
+        self.ensure_one()
+        groups = {'out_invoice': {}, 'out_refund': {}, 'purchase': {}}
+        
+        no_currency = self.env['res.currency']
+        for move in self.invoice_ids.filtered(lambda inv: inv.state == 'posted'):
+            if move.move_type not in ('out_invoice', 'out_refund'):
+                continue
+            if move.x_sale_currency_id and move.x_sale_currency_id == self.currency_id:
+                key, amount = (no_currency, None), move.x_amount_sale_currency
+            else:
+                key, amount = (move.currency_id, move.invoice_date or move.date), move.amount_total
+            groups[move.move_type].setdefault(key, []).append(amount)
+        
+        for po in self.purchase_order_ids.filtered(lambda p: p.state in ['purchase', 'done']):
+            if po.x_sale_currency_id and po.x_sale_currency_id == self.currency_id:
+                key, amount = (no_currency, None), po.x_amount_sale_currency
+            else:
+                key, amount = (po.currency_id, po.date_order), po.amount_total
+            groups['purchase'].setdefault(key, []).append(amount)
+        
+        # Compras consolidadas: solo la parte de las líneas de esta venta
+        for po, amount in self._get_consolidated_purchase_amounts().items():
+            if po.state in ['purchase', 'done']:
+                groups['purchase'].setdefault((po.currency_id, po.date_order), []).append(amount)
+        
+        return groups
+    
+    def _get_liquidation_documents_batch(self):
+        """
+        🎯 Agrupa los documentos de TODAS las órdenes del recordset con dos consultas
+        
+        Facturas y compras se agrupan por (orden, tipo, moneda, fecha), de modo
+        que el tipo de cambio se obtiene una sola vez por grupo y no por documento.
+        
+        Returns:
+            dict: {order_id: {'out_invoice'|'out_refund'|'purchase': {(moneda, fecha): [montos]}}}
+        """
+        result = {
+            order.id: {'out_invoice': {}, 'out_refund': {}, 'purchase': {}}
+            for order in self
+        }
+        if not self.ids:
+            return result
+        
+        self.flush_model(['currency_id'])
+        self.env['sale.order.line'].flush_model(['order_id', 'invoice_lines'])
+        self.env['account.move.line'].flush_model(['move_id'])
+        self.env['account.move'].flush_model([
+            'state', 'move_type', 'amount_total', 'currency_id', 'invoice_date', 'date',
+            'x_sale_currency_id', 'x_amount_sale_currency',
+        ])
+        self.env['purchase.order'].flush_model([
+            'x_sale_order_id', 'state', 'amount_total', 'currency_id', 'date_order',
+            'x_sale_currency_id', 'x_amount_sale_currency',
+        ])
+        
+        # Los documentos con monto ya congelado en la moneda de la venta
+        # (x_amount_sale_currency) forman un único grupo sin moneda ni fecha:
+        # se suman directamente, sin buscar tipos de cambio.
+        
+        # Facturas y notas de crédito: mismo vínculo que sale.order.invoice_ids
+        # (líneas de venta -> líneas de factura -> factura)
+        self.env.cr.execute("""
+            SELECT link.order_id, am.move_type,
+                   CASE WHEN frozen THEN NULL ELSE am.currency_id END,
+                   CASE WHEN frozen THEN NULL ELSE COALESCE(am.invoice_date, am.date) END,
+                   ARRAY_AGG((CASE WHEN frozen THEN am.x_amount_sale_currency
+                                   ELSE am.amount_total END)::float8 ORDER BY am.id)
+              FROM (
+                    SELECT DISTINCT sol.order_id, aml.move_id
+                      FROM sale_order_line sol
+                      JOIN sale_order_line_invoice_rel rel ON rel.order_line_id = sol.id
+                      JOIN account_move_line aml ON aml.id = rel.invoice_line_id
+                     WHERE sol.order_id IN %s
+                   ) link
+              JOIN sale_order so ON so.id = link.order_id
+              JOIN account_move am ON am.id = link.move_id,
+                   LATERAL (SELECT am.x_sale_currency_id IS NOT NULL
+                                   AND am.x_sale_currency_id = so.currency_id AS frozen) f
+             WHERE am.state = 'posted'
+               AND am.move_type IN ('out_invoice', 'out_refund')
+          GROUP BY 1, 2, 3, 4
+        """, [tuple(self.ids)])
+        for order_id, move_type, currency_id, doc_date, amounts in self.env.cr.fetchall():
+            currency = self.env['res.currency'].browse(currency_id or [])
+            result[order_id][move_type][(currency, doc_date)] = amounts
+        
+        # Compras confirmadas: _convert solo usa la parte de fecha de date_order
+        self.env.cr.execute("""
+            SELECT po.x_sale_order_id,
+                   CASE WHEN frozen THEN NULL ELSE po.currency_id END,
+                   CASE WHEN frozen THEN NULL ELSE po.date_order::date END,
+                   ARRAY_AGG((CASE WHEN frozen THEN po.x_amount_sale_currency
+                                   ELSE po.amount_total END)::float8 ORDER BY po.id)
+              FROM purchase_order po
+              JOIN sale_order so ON so.id = po.x_sale_order_id,
+                   LATERAL (SELECT po.x_sale_currency_id IS NOT NULL
+                                   AND po.x_sale_currency_id = so.currency_id AS frozen) f
+             WHERE po.x_sale_order_id IN %s
+               AND po.state IN ('purchase', 'done')
+          GROUP BY 1, 2, 3
+        """, [tuple(self.ids)])
+        for order_id, currency_id, doc_date, amounts in self.env.cr.fetchall():
+            currency = self.env['res.currency'].browse(currency_id or [])
+            result[order_id]['purchase'][(currency, doc_date)] = amounts
+        
+        # Compras consolidadas (sin venta en cabecera): a cada venta le toca la
+        # suma de sus líneas, en la moneda de la compra (nunca congelada)
+        self.env['purchase.order.line'].flush_model(['order_id', 'x_sale_order_id', 'price_total'])
+        self.env.cr.execute("""
+            SELECT part.order_id, part.currency_id, part.doc_date,
+                   ARRAY_AGG(part.amount ORDER BY part.po_id)
+              FROM (
+                    SELECT pol.x_sale_order_id AS order_id, po.id AS po_id,
+                           po.currency_id, po.date_order::date AS doc_date,
+                           SUM(pol.price_total)::float8 AS amount
+                      FROM purchase_order_line pol
+                      JOIN purchase_order po ON po.id = pol.order_id
+                     WHERE pol.x_sale_order_id IN %s
+                       AND po.x_sale_order_id IS NULL
+                       AND po.state IN ('purchase', 'done')
+                  GROUP BY 1, 2, 3, 4
+                   ) part
+          GROUP BY 1, 2, 3
+        """, [tuple(self.ids)])
+        for order_id, currency_id, doc_date, amounts in self.env.cr.fetchall():
+            key = (self.env['res.currency'].browse(currency_id), doc_date)
+            result[order_id]['purchase'].setdefault(key, []).extend(amounts)
+        
+        return result
+    
+    def _preload_liquidation_rates(self, batch=None):
+        """
+        🎯 Precarga en una sola consulta los tipos de cambio que usarán estas órdenes
+        
+        Args:
+            batch: resultado de _get_liquidation_documents_batch; si no se indica
+                   se usan las compras vinculadas (resumen HTML y reporte PDF)
+        """
+        if batch is None:
+            documents = [
+                (po.currency_id, po.date_order)
+                for order in self
+                for po in order._get_related_purchase_orders()
+            ]
+        else:
+            documents = [
+                key
+                for groups in batch.values()
+                for group in groups.values()
+                for key in group
+            ]
+        currency_ids = set(self.currency_id.ids)
+        dates = []
+        for currency, doc_date in documents:
+            if currency and doc_date:
+                currency_ids.add(currency.id)
+                dates.append(fields.Date.to_date(doc_date))
+        if dates:
+            self.env['res.currency']._preload_liquidation_rates(
+                self.env['res.currency'].browse(currency_ids),
+                self.company_id,
+                min(dates),
+                max(dates)
             )
-            # Retornar monto original como fallback
-            return amount
     
-    @api.depends('invoice_ids', 'invoice_ids.state', 'invoice_ids.move_type', 
-                 'invoice_ids.amount_total', 'invoice_ids.currency_id',
-                 'purchase_order_ids', 'purchase_order_ids.state', 
-                 'purchase_order_ids.amount_total', 'purchase_order_ids.currency_id',
-                 'amount_total')
+    def _sum_liquidation_group(self, documents):
+        """Suma documentos agrupados convirtiéndolos a la moneda de la venta (un tipo de cambio por grupo)"""
+        self.ensure_one()
+        total = 0.0
+        for (currency, doc_date), amounts in documents.items():
+            if not currency or currency == self.currency_id:
+                total += sum(amounts)
+                continue
+            rate = self._get_sale_currency_rate(currency, doc_date)
+            for amount in amounts:
+                total += self._apply_sale_currency_rate(amount, rate)
+        return total
+    
+    # Dependencias sobre campos almacenados: al publicar/reabrir una factura o al
+    # cambiar una compra vinculada solo se recalculan las órdenes afectadas
+    @api.depends('order_line.invoice_lines.move_id.state',
+                 'order_line.invoice_lines.move_id.move_type',
+                 'order_line.invoice_lines.move_id.amount_total',
+                 'order_line.invoice_lines.move_id.currency_id',
+                 'order_line.invoice_lines.move_id.invoice_date',
+                 'order_line.invoice_lines.move_id.date',
+                 'purchase_order_ids.state', 'purchase_order_ids.amount_total',
+                 'purchase_order_ids.currency_id', 'purchase_order_ids.date_order',
+                 'order_line.invoice_lines.move_id.x_amount_sale_currency',
+                 'purchase_order_ids.x_amount_sale_currency',
+                 'order_line.x_purchase_line_ids.price_total',
+                 'order_line.x_purchase_line_ids.order_id.state',
+                 'order_line.x_purchase_line_ids.order_id.x_sale_order_id',
+                 'order_line.x_purchase_line_ids.order_id.currency_id',
+                 'order_line.x_purchase_line_ids.order_id.date_order',
+                 'currency_id', 'company_id')
     def _compute_liquidation_data(self):
         """
         🎯 CÁLCULO DE LIQUIDACIÓN CON CONVERSIÓN DE MONEDA AUTOMÁTICA
         
         Convierte todos los montos (facturas y compras) a la moneda de la venta
         usando el tipo de cambio de la fecha del documento.
+        
+        Las órdenes guardadas se calculan por lotes (_get_liquidation_documents_batch);
+        las nuevas (onchange) se calculan registro por registro con el ORM.
+        
+        Los resultados se almacenan en BD, por lo que pueden buscarse, ordenarse
+        y agruparse (ej: órdenes con margen negativo).
         """
+        stored_orders = self.filtered(lambda o: isinstance(o.id, int))
+        batch = stored_orders._get_liquidation_documents_batch()
+        # Todas las tasas de todos los grupos en una sola consulta
+        stored_orders._preload_liquidation_rates(batch)
+        
         for order in self:
-            # ============ CÁLCULO DE FACTURAS (INGRESOS) ============
-            posted_moves = order.invoice_ids.filtered(lambda inv: inv.state == 'posted')
+            if isinstance(order.id, int):
+                documents = batch[order.id]
+            else:
+                documents = order._get_liquidation_documents()
             
+            # ============ CÁLCULO DE FACTURAS (INGRESOS) ============
             # Total facturado bruto (facturas de cliente)
-            invoiced_gross = 0.0
-            for invoice in posted_moves.filtered(lambda inv: inv.move_type == 'out_invoice'):
-                # 🔄 Conversión con tipo de cambio de la fecha de factura
-                amount_converted = order._convert_to_sale_currency(
-                    invoice.amount_total,
-                    invoice.currency_id,
-                    invoice.invoice_date or invoice.date
-                )
-                invoiced_gross += amount_converted
-            
+            invoiced_gross = order._sum_liquidation_group(documents['out_invoice'])
             order.total_invoiced_amount = invoiced_gross
             
             # Total notas de crédito
-            credit_notes_total = 0.0
-            for credit_note in posted_moves.filtered(lambda inv: inv.move_type == 'out_refund'):
-                # 🔄 Conversión con tipo de cambio de la fecha de nota de crédito
-                amount_converted = order._convert_to_sale_currency(
-                    credit_note.amount_total,
-                    credit_note.currency_id,
-                    credit_note.invoice_date or credit_note.date
-                )
-                credit_notes_total += amount_converted
-            
+            credit_notes_total = order._sum_liquidation_group(documents['out_refund'])
             order.total_credit_note_amount = credit_notes_total
             
             # Ingreso neto (facturas - notas de crédito)
@@ -324,16 +704,7 @@ class SaleOrder(models.Model):
             order.total_net_invoiced_amount = net_invoiced
             
             # ============ CÁLCULO DE COMPRAS (COSTOS) ============
-            purchased = 0.0
-            for po in order.purchase_order_ids.filtered(lambda p: p.state in ['purchase', 'done']):
-                # 🔄 Conversión con tipo de cambio de la fecha de la orden de compra
-                amount_converted = order._convert_to_sale_currency(
-                    po.amount_total,
-                    po.currency_id,
-                    po.date_order
-                )
-                purchased += amount_converted
-            
+            purchased = order._sum_liquidation_group(documents['purchase'])
             order.total_purchase_amount = purchased
             
             # ============ CÁLCULO DE UTILIDAD ============
@@ -347,7 +718,9 @@ class SaleOrder(models.Model):
                 order.sale_completion_percentage = 0.0
 
     @api.depends('purchase_order_ids', 'purchase_order_ids.state', 
-                 'purchase_order_ids.amount_total', 'purchase_order_ids.currency_id')
+                 'purchase_order_ids.amount_total', 'purchase_order_ids.currency_id',
+                 'order_line.x_purchase_line_ids.price_total',
+                 'order_line.x_purchase_line_ids.order_id.state')
     def _compute_purchase_orders_summary(self):
         """
         🎯 RESUMEN HTML CON CONVERSIÓN DE MONEDA
@@ -355,174 +728,377 @@ class SaleOrder(models.Model):
         Genera tabla HTML mostrando:
         - Monto en moneda original
         - Monto convertido a moneda de venta (si es diferente)
+        
+        El HTML se guarda en caché (ver _get_cached_summaries) y solo se
+        vuelve a generar si cambió alguna compra o algún tipo de cambio.
+        """
+        rate_stamps = self._get_currency_rate_stamps()
+        self._get_cached_summaries(
+            'purchase_orders_summary',
+            lambda order: order._get_purchase_orders_summary_key(rate_stamps),
+            lambda orders: orders._preload_liquidation_rates(),
+            lambda order: order._render_purchase_orders_summary(),
+        )
+
+    @api.depends('order_line.x_purchase_status')
+    def _compute_products_control_summary(self):
+        """
+        Genera resumen HTML de control de productos
+
+        Sin caché: la clave necesitaría las mismas líneas de venta, de compra y
+        nombres de producto que el render, así que no ahorraría nada.
         """
         for order in self:
-            if not order.purchase_order_ids:
-                order.purchase_orders_summary = '<p><em>No hay órdenes de compra relacionadas</em></p>'
+            order.products_control_summary = order._render_products_control_summary()
+
+    # ========== 🆕 CACHÉ DE RESÚMENES HTML ==========
+    def _get_cached_summaries(self, field_name, get_key, prepare, render):
+        """
+        🎯 Asigna field_name usando la caché LRU de resúmenes renderizados
+        
+        Args:
+            field_name: Campo HTML a asignar
+            get_key: función(order) -> clave que cambia si cambia el contenido
+            prepare: función(orders) a ejecutar una vez antes de renderizar los
+                     faltantes (ej: precargar tipos de cambio), o None
+            render: función(order) -> HTML
+        """
+        dbname = self.env.cr.dbname
+        lang = self.env.lang
+        missing = {}
+        for order in self:
+            if not isinstance(order.id, int):
+                # Registro nuevo (onchange): no se cachea
+                missing[order] = None
                 continue
+            key = (dbname, field_name, lang, order.id, get_key(order))
+            html = _summary_cache.get(key)
+            if html is None:
+                missing[order] = key
+            else:
+                order[field_name] = html
+        
+        if not missing:
+            return
+        if prepare:
+            prepare(self.filtered(lambda order: order in missing))
+        for order, key in missing.items():
+            html = render(order)
+            if key is not None:
+                _summary_cache[key] = html
+            order[field_name] = html
+
+    def _get_summary_currencies(self):
+        """Monedas cuyas tasas usa el resumen de compras: venta, compras y compañía raíz"""
+        return (
+            self.currency_id
+            | self.purchase_order_ids.currency_id
+            | self.order_line.x_purchase_line_ids.order_id.currency_id
+            | self.company_id.root_id.currency_id
+        )
+
+    def _get_currency_rate_stamps(self):
+        """Marcas de tasas de las monedas usadas por estas ventas (una consulta para todas)"""
+        return self.env['res.currency']._get_liquidation_rate_stamps(self._get_summary_currencies())
+
+    def _get_purchase_orders_summary_key(self, rate_stamps):
+        """Clave de caché del resumen de compras: compras, proveedores, moneda y tasas usadas"""
+        self.ensure_one()
+        return (
+            self.currency_id.id,
+            tuple(
+                (currency_id, rate_stamps.get(currency_id))
+                for currency_id in sorted(self._get_summary_currencies().ids)
+            ),
+            tuple(
+                (po.id, po.write_date, po.partner_id.write_date)
+                for po in self.purchase_order_ids
+            ),
+            tuple(
+                (po_line.id, po_line.write_date, po_line.order_id.write_date, po_line.order_id.partner_id.write_date)
+                for po_line in self.order_line.x_purchase_line_ids
+                if not po_line.order_id.x_sale_order_id
+            ),
+        )
+
+    def _render_purchase_orders_summary(self):
+        """Genera el HTML del resumen de compras (se arma en una lista y se une al final)"""
+        self.ensure_one()
+        # (compra, monto que corresponde a esta venta): las consolidadas solo aportan sus líneas
+        purchase_amounts = [(po, po.amount_total) for po in self.purchase_order_ids]
+        purchase_amounts += list(self._get_consolidated_purchase_amounts().items())
+        if not purchase_amounts:
+            return '<p><em>No hay órdenes de compra relacionadas</em></p>'
+        
+        # Determinar si hay múltiples monedas
+        currencies_used = self.env['res.currency'].union(*[po.currency_id for po, amount in purchase_amounts])
+        show_conversion = len(currencies_used) > 1 or self.currency_id not in currencies_used
+        
+        state_classes = {
+            'draft': 'secondary',
+            'sent': 'info',
+            'to approve': 'warning',
+            'purchase': 'success',
+            'done': 'primary',
+            'cancel': 'danger'
+        }
+        state_labels = dict(self.env['purchase.order']._fields['state']._description_selection(self.env))
+        
+        html = [
+            '<table class="table table-sm table-striped">',
+            '<thead><tr>',
+            '<th>Orden de Compra</th>',
+            '<th>Proveedor</th>',
+            '<th>Estado</th>',
+            '<th>Fecha</th>',
+            '<th class="text-end">Monto Original</th>',
+        ]
+        if show_conversion:
+            html.append(f'<th class="text-end">Equiv. en {self.currency_id.name}</th>')
+        html.append('</tr></thead><tbody>')
+        
+        total_original = {}  # {currency: amount}
+        total_converted = 0.0
+        
+        for po, amount in purchase_amounts:
+            state_class = state_classes.get(po.state, 'secondary')
+            state_label = state_labels.get(po.state, po.state)
+            consolidated = '' if po.x_sale_order_id else ' <small class="text-muted">(consolidada, parte de esta venta)</small>'
             
-            # Determinar si hay múltiples monedas
-            currencies_used = order.purchase_order_ids.mapped('currency_id')
-            show_conversion = len(currencies_used) > 1 or order.currency_id not in currencies_used
-            
-            html = '<table class="table table-sm table-striped">'
-            html += '<thead><tr>'
-            html += '<th>Orden de Compra</th>'
-            html += '<th>Proveedor</th>'
-            html += '<th>Estado</th>'
-            html += '<th>Fecha</th>'
-            html += '<th class="text-end">Monto Original</th>'
-            if show_conversion:
-                html += f'<th class="text-end">Equiv. en {order.currency_id.name}</th>'
-            html += '</tr></thead><tbody>'
+            html.append('<tr>')
+            html.append(f'<td><strong>{po.name}</strong>{consolidated}</td>')
+            html.append(f'<td>{po.partner_id.name}</td>')
+            html.append(f'<td><span class="badge badge-{state_class}">{state_label}</span></td>')
+            html.append(f'<td>{po.date_order.strftime("%d/%m/%Y") if po.date_order else "-"}</td>')
             
-            total_original = {}  # {currency: amount}
-            total_converted = 0.0
+            # Monto original
+            html.append(f'<td class="text-end"><strong>{po.currency_id.symbol} {amount:,.2f}</strong></td>')
             
-            for po in order.purchase_order_ids:
-                state_class = {
-                    'draft': 'secondary',
-                    'sent': 'info',
-                    'to approve': 'warning',
-                    'purchase': 'success',
-                    'done': 'primary',
-                    'cancel': 'danger'
-                }.get(po.state, 'secondary')
-                
-                state_label = dict(po._fields['state'].selection).get(po.state, po.state)
-                
-                html += '<tr>'
-                html += f'<td><strong>{po.name}</strong></td>'
-                html += f'<td>{po.partner_id.name}</td>'
-                html += f'<td><span class="badge badge-{state_class}">{state_label}</span></td>'
-                html += f'<td>{po.date_order.strftime("%d/%m/%Y") if po.date_order else "-"}</td>'
+            # Monto convertido (si es diferente)
+            if show_conversion:
+                converted_amount = self._convert_to_sale_currency(
+                    amount,
+                    po.currency_id,
+                    po.date_order
+                )
                 
-                # Monto original
-                html += f'<td class="text-end">'
-                html += f'<strong>{po.currency_id.symbol} {po.amount_total:,.2f}</strong>'
-                html += f'</td>'
+                # Resaltar si hay conversión
+                conversion_class = 'text-primary' if po.currency_id != self.currency_id else ''
+                html.append(f'<td class="text-end {conversion_class}">')
+                html.append(f'<strong>{self.currency_id.symbol} {converted_amount:,.2f}</strong>')
+                html.append('</td>')
                 
-                # Monto convertido (si es diferente)
-                if show_conversion:
-                    converted_amount = order._convert_to_sale_currency(
-                        po.amount_total,
-                        po.currency_id,
-                        po.date_order
-                    )
-                    
-                    # Resaltar si hay conversión
-                    conversion_class = 'text-primary' if po.currency_id != order.currency_id else ''
-                    html += f'<td class="text-end {conversion_class}">'
-                    html += f'<strong>{order.currency_id.symbol} {converted_amount:,.2f}</strong>'
-                    html += f'</td>'
-                    
-                    if po.state in ['purchase', 'done']:
-                        total_converted += converted_amount
-                else:
-                    if po.state in ['purchase', 'done']:
-                        total_converted += po.amount_total
-                
-                # Acumular por moneda
                 if po.state in ['purchase', 'done']:
-                    if po.currency_id not in total_original:
-                        total_original[po.currency_id] = 0.0
-                    total_original[po.currency_id] += po.amount_total
-                
-                html += '</tr>'
-            
-            # Fila de totales
-            html += '</tbody><tfoot>'
-            
-            # Si hay conversión, mostrar ambos totales
-            if show_conversion:
-                html += '<tr class="table-active">'
-                html += '<td colspan="4" class="text-end"><strong>Total por Moneda:</strong></td>'
-                html += '<td class="text-end">'
-                for curr, amt in total_original.items():
-                    html += f'<div><strong>{curr.symbol} {amt:,.2f}</strong></div>'
-                html += '</td>'
-                html += f'<td class="text-end text-primary">'
-                html += f'<strong>{order.currency_id.symbol} {total_converted:,.2f}</strong>'
-                html += f'<br/><small class="text-muted">(Total Convertido)</small>'
-                html += f'</td>'
-                html += '</tr>'
+                    total_converted += converted_amount
             else:
-                # Una sola moneda, total simple
-                html += '<tr class="table-active">'
-                html += '<td colspan="4" class="text-end"><strong>Total Compras Confirmadas:</strong></td>'
-                html += f'<td class="text-end"><strong>{order.currency_id.symbol} {total_converted:,.2f}</strong></td>'
-                html += '</tr>'
+                if po.state in ['purchase', 'done']:
+                    total_converted += amount
             
-            html += '</tfoot></table>'
+            # Acumular por moneda
+            if po.state in ['purchase', 'done']:
+                if po.currency_id not in total_original:
+                    total_original[po.currency_id] = 0.0
+                total_original[po.currency_id] += amount
             
-            # Nota explicativa si hay conversión
-            if show_conversion:
-                html += '<div class="alert alert-info mt-2" role="alert">'
-                html += '<small><strong>ℹ️ Nota:</strong> Los montos se han convertido automáticamente '
-                html += f'a <strong>{order.currency_id.name}</strong> usando el tipo de cambio '
-                html += 'de la fecha de cada orden de compra.</small>'
-                html += '</div>'
+            html.append('</tr>')
+        
+        # Fila de totales
+        html.append('</tbody><tfoot>')
+        
+        # Si hay conversión, mostrar ambos totales
+        if show_conversion:
+            html.append('<tr class="table-active">')
+            html.append('<td colspan="4" class="text-end"><strong>Total por Moneda:</strong></td>')
+            html.append('<td class="text-end">')
+            for curr, amt in total_original.items():
+                html.append(f'<div><strong>{curr.symbol} {amt:,.2f}</strong></div>')
+            html.append('</td>')
+            html.append('<td class="text-end text-primary">')
+            html.append(f'<strong>{self.currency_id.symbol} {total_converted:,.2f}</strong>')
+            html.append('<br/><small class="text-muted">(Total Convertido)</small>')
+            html.append('</td>')
+            html.append('</tr>')
+        else:
+            # Una sola moneda, total simple
+            html.append('<tr class="table-active">')
+            html.append('<td colspan="4" class="text-end"><strong>Total Compras Confirmadas:</strong></td>')
+            html.append(f'<td class="text-end"><strong>{self.currency_id.symbol} {total_converted:,.2f}</strong></td>')
+            html.append('</tr>')
+        
+        html.append('</tfoot></table>')
+        
+        # Nota explicativa si hay conversión
+        if show_conversion:
+            html.append('<div class="alert alert-info mt-2" role="alert">')
+            html.append('<small><strong>ℹ️ Nota:</strong> Los montos se han convertido automáticamente ')
+            html.append(f'a <strong>{self.currency_id.name}</strong> usando el tipo de cambio ')
+            html.append('de la fecha de cada orden de compra.</small>')
+            html.append('</div>')
+        
+        return ''.join(html)
+
+    def _render_products_control_summary(self):
+        """Genera el HTML de control de productos (se arma en una lista y se une al final)"""
+        self.ensure_one()
+        if not self.order_line:
+            return '<p><em>No hay líneas de venta</em></p>'
+        
+        html = [
+            '<table class="table table-sm table-bordered">',
+            '<thead class="table-light"><tr>',
+            '<th>Producto</th>',
+            '<th class="text-center">Cant. Vendida</th>',
+            '<th class="text-center">Cant. Comprada</th>',
+            '<th class="text-center">Cant. Pendiente</th>',
+            '<th class="text-center">Estado</th>',
+            '</tr></thead><tbody>',
+        ]
+        
+        for line in self.order_line:
+            qty_sold = line.product_uom_qty
+            qty_purchased = line.x_qty_purchased 
+            qty_pending = line.x_qty_pending_purchase
+            
+            if line.x_purchase_status == 'purchased':
+                status = '<span class="badge badge-success">✓ Completo</span>'
+                row_class = 'table-success'
+            elif line.x_purchase_status == 'partial':
+                status = '<span class="badge badge-warning">⚠ Parcial</span>'
+                row_class = 'table-warning'
+            else:
+                status = '<span class="badge badge-danger">✗ Sin Pedir</span>'
+                row_class = 'table-danger'
             
-            order.purchase_orders_summary = html
+            html.append(
+                f'<tr class="{row_class}">'
+                f'<td><strong>{line.product_id.display_name}</strong></td>'
+                f'<td class="text-center">{qty_sold:.2f}</td>'
+                f'<td class="text-center">{qty_purchased:.2f}</td>'
+                f'<td class="text-center">{max(0, qty_pending):.2f}</td>'
+                f'<td class="text-center">{status}</td>'
+                f'</tr>'
+            )
+        
+        html.append('</tbody></table>')
+        return ''.join(html)
 
-    @api.depends('order_line.x_purchase_status')
-    def _compute_products_control_summary(self):
-        """Genera resumen HTML de control de productos"""
-        for order in self:
-            if not order.order_line:
-                order.products_control_summary = '<p><em>No hay líneas de venta</em></p>'
-                continue
+    # ========== 🆕 DATOS DE LIQUIDACIÓN PARA EL WIDGET (JSON-RPC) ==========
+    @api.model
+    def get_liquidation_dataset(self, order_ids):
+        """
+        🎯 Devuelve los datos de liquidación de varias órdenes en una sola llamada
+        
+        Lo usa el widget de la pestaña "Liquidación de Caso", que solo lo pide
+        cuando la pestaña se muestra. Así el formulario no genera HTML que
+        nadie ve.
+        
+        Returns:
+            dict: {order_id: {'currency', 'totals', 'purchase_orders', 'products'}}
+        """
+        orders = self.browse(order_ids).exists()
+        orders.check_access('read')
+        orders._preload_liquidation_rates()
+        
+        po_states = dict(self.env['purchase.order']._fields['state']._description_selection(self.env))
+        line_states = dict(self.env['sale.order.line']._fields['x_purchase_status']._description_selection(self.env))
+        
+        result = {}
+        for order in orders:
+            currency = order.currency_id
             
-            html = '<table class="table table-sm table-bordered">'
-            html += '<thead class="table-light"><tr>'
-            html += '<th>Producto</th>'
-            html += '<th class="text-center">Cant. Vendida</th>'
-            html += '<th class="text-center">Cant. Comprada</th>'
-            html += '<th class="text-center">Cant. Pendiente</th>'
-            html += '<th class="text-center">Estado</th>'
-            html += '</tr></thead><tbody>'
+            purchase_orders = []
+            lines_in_process = 0
+            # Las consolidadas (sin venta en cabecera) solo aportan sus líneas de esta venta
+            consolidated_amounts = order._get_consolidated_purchase_amounts()
+            for po in order.purchase_order_ids | self.env['purchase.order'].union(*consolidated_amounts):
+                confirmed = po.state in ['purchase', 'done']
+                consolidated = po in consolidated_amounts
+                if confirmed:
+                    lines_in_process += len(po.order_line.filtered(
+                        lambda l: not consolidated or l.x_sale_order_id == order
+                    ))
+                amount = consolidated_amounts[po] if consolidated else po.amount_total
+                if not consolidated and po.x_sale_currency_id == currency:
+                    amount_converted = po.x_amount_sale_currency
+                else:
+                    amount_converted = order._convert_to_sale_currency(
+                        amount,
+                        po.currency_id,
+                        po.date_order
+                    )
+                purchase_orders.append({
+                    'id': po.id,
+                    'name': po.name,
+                    'partner': po.partner_id.display_name,
+                    'state': po.state,
+                    'state_label': po_states.get(po.state, po.state),
+                    'date_order': fields.Date.to_string(po.date_order) if po.date_order else False,
+                    'currency_id': po.currency_id.id,
+                    'currency_symbol': po.currency_id.symbol,
+                    'amount_total': amount,
+                    'amount_converted': amount_converted,
+                    'confirmed': confirmed,
+                    'consolidated': consolidated,
+                })
             
+            products = []
+            pending_lines = 0
+            qty_purchased_total = 0.0
+            qty_pending_total = 0.0
             for line in order.order_line:
-                qty_sold = line.product_uom_qty
-                qty_purchased = line.x_qty_purchased 
-                qty_pending = line.x_qty_pending_purchase
-                
-                if line.x_purchase_status == 'purchased':
-                    status = '<span class="badge badge-success">✓ Completo</span>'
-                    row_class = 'table-success'
-                elif line.x_purchase_status == 'partial':
-                    status = '<span class="badge badge-warning">⚠ Parcial</span>'
-                    row_class = 'table-warning'
-                else:
-                    status = '<span class="badge badge-danger">✗ Sin Pedir</span>'
-                    row_class = 'table-danger'
-                
-                html += f'<tr class="{row_class}">'
-                html += f'<td><strong>{line.product_id.display_name}</strong></td>'
-                html += f'<td class="text-center">{qty_sold:.2f}</td>'
-                html += f'<td class="text-center">{qty_purchased:.2f}</td>'
-                html += f'<td class="text-center">{max(0, qty_pending):.2f}</td>'
-                html += f'<td class="text-center">{status}</td>'
-                html += f'</tr>'
+                qty_purchased_total += line.x_qty_purchased
+                if line.x_qty_pending_purchase > 0:
+                    pending_lines += 1
+                    qty_pending_total += line.x_qty_pending_purchase
+                products.append({
+                    'id': line.id,
+                    'product': line.product_id.display_name,
+                    'qty_sold': line.product_uom_qty,
+                    'qty_purchased': line.x_qty_purchased,
+                    'qty_pending': max(0.0, line.x_qty_pending_purchase),
+                    'status': line.x_purchase_status,
+                    'status_label': line_states.get(line.x_purchase_status, ''),
+                })
             
-            html += '</tbody></table>'
-            order.products_control_summary = html
+            result[order.id] = {
+                'currency': {
+                    'id': currency.id,
+                    'name': currency.name,
+                    'symbol': currency.symbol,
+                },
+                'totals': {
+                    'purchase_lines_in_process': lines_in_process,
+                    'pending_to_purchase': pending_lines,
+                    'products_purchased_qty': qty_purchased_total,
+                    'products_pending_qty': qty_pending_total,
+                    'total_invoiced_amount': order.total_invoiced_amount,
+                    'total_credit_note_amount': order.total_credit_note_amount,
+                    'total_net_invoiced_amount': order.total_net_invoiced_amount,
+                    'total_purchase_amount': order.total_purchase_amount,
+                    'profit_margin': order.profit_margin,
+                    'sale_completion_percentage': order.sale_completion_percentage,
+                },
+                'purchase_orders': purchase_orders,
+                'products': products,
+            }
+        return result
 
     # ========== ACCIONES Y BOTONES ==========
     def action_view_purchase_orders(self):
         """Abre la vista de órdenes de compra relacionadas"""
         self.ensure_one()
         action = self.env.ref('purchase.purchase_form_action').read()[0]
+        purchase_orders = self._get_related_purchase_orders()
         
-        if len(self.purchase_order_ids) > 1:
-            action['domain'] = [('id', 'in', self.purchase_order_ids.ids)]
+        if len(purchase_orders) > 1:
+            action['domain'] = [('id', 'in', purchase_orders.ids)]
             action['view_mode'] = 'tree,form'
             if 'res_id' in action:
                 del action['res_id']
-        elif len(self.purchase_order_ids) == 1:
+        elif len(purchase_orders) == 1:
             form_view = self.env.ref('purchase.purchase_order_form').id
             action['views'] = [(form_view, 'form')]
-            action['res_id'] = self.purchase_order_ids.id
+            action['res_id'] = purchase_orders.id
             action['view_mode'] = 'form' 
         else:
             action = {'type': 'ir.actions.act_window_close'}
@@ -538,19 +1114,27 @@ class SaleOrder(models.Model):
         return action
 
     def action_create_purchase_orders(self):
-        """Abre el wizard para crear órdenes de compra"""
-        self.ensure_one()
+        """
+        Abre el wizard para crear órdenes de compra
+
+        Con varias ventas seleccionadas abre el modo multi-orden
+        (una compra consolidada por proveedor).
+        """
+        if not self:
+            raise UserError(_('Seleccione al menos una orden de venta.'))
         if not self.order_line:
             raise UserError(_('No hay líneas en la orden de venta para crear órdenes de compra.'))
+        if len(self) == 1:
+            context = {'default_sale_order_id': self.id}
+        else:
+            context = {'default_sale_order_ids': [(6, 0, self.ids)]}
         return {
             'name': _('Crear Órdenes de Compra'),
             'type': 'ir.actions.act_window',
             'res_model': 'create.purchase.wizard',
             'view_mode': 'form',
             'target': 'new',
-            'context': {
-                'default_sale_order_id': self.id,
-            }
+            'context': context,
         }
 
     # ========== 🆕 MEJORA #2: VINCULAR COMPRAS EXISTENTES ==========
@@ -575,6 +1159,110 @@ class SaleOrder(models.Model):
             }
         }
 
+    # ========== 🆕 SUGERENCIAS DE COMPRAS A VINCULAR ==========
+    def _get_purchase_link_candidates(self, limit=10):
+        """
+        🎯 Compras sin venta asociada ordenadas por probabilidad de pertenecer a esta venta
+
+        Los candidatos salen solo de búsquedas indexadas (nunca un recorrido
+        completo): misma placa/VIN (claves normalizadas), mismos productos y
+        proveedores habituales dentro de ±SUGGESTION_DATE_WINDOW días. Luego se
+        puntúan con placa/VIN, proporción de productos en común, historial del
+        proveedor y cercanía de fechas.
+        
+        Devuelve [{'purchase': compra, 'score': float, 'reasons': [str]}].
+        """
+        self.ensure_one()
+        PurchaseOrder = self.env['purchase.order']
+        base_domain = PurchaseOrder._get_orphan_domain() + [('state', '!=', 'cancel')]
+        sale_date = self.date_order or fields.Datetime.now()
+        window = timedelta(days=SUGGESTION_DATE_WINDOW)
+        date_domain = [('date_order', '>=', sale_date - window), ('date_order', '<=', sale_date + window)]
+        per_signal = SUGGESTION_CANDIDATES_PER_SIGNAL
+        
+        placa_key = normalize_vehicle_key(self.x_placa)
+        vin_key = normalize_vehicle_key(self.x_vin)
+        products = self.order_line.product_id
+        vendors = self.purchase_order_ids.partner_id | products.seller_ids.partner_id
+        
+        # 1. Candidatos por señal (índices: claves de vehículo, producto, proveedor + fecha)
+        candidates = PurchaseOrder
+        if placa_key:
+            candidates |= PurchaseOrder.search(base_domain + [('x_placa_key', '=', placa_key)], limit=per_signal)
+        if vin_key:
+            candidates |= PurchaseOrder.search(base_domain + [('x_vin_key', '=', vin_key)], limit=per_signal)
+        if vendors:
+            candidates |= PurchaseOrder.search(
+                base_domain + date_domain + [('partner_id', 'in', vendors.ids)],
+                order='date_order desc', limit=per_signal,
+            )
+        overlap = {}
+        if products:
+            self.env['purchase.order.line'].flush_model(['order_id', 'product_id'])
+            PurchaseOrder.flush_model(['x_sale_order_id', 'state', 'date_order'])
+            self.env['purchase.order.line'].flush_model(['x_sale_order_id'])
+            self.env.cr.execute("""
+                SELECT pol.order_id, COUNT(DISTINCT pol.product_id)
+                  FROM purchase_order_line pol
+                  JOIN purchase_order po ON po.id = pol.order_id
+                 WHERE pol.product_id IN %s
+                   AND po.x_sale_order_id IS NULL
+                   AND po.state != 'cancel'
+                   AND NOT EXISTS (
+                        SELECT 1 FROM purchase_order_line linked
+                         WHERE linked.order_id = po.id AND linked.x_sale_order_id IS NOT NULL
+                       )
+                   AND po.date_order BETWEEN %s AND %s
+              GROUP BY pol.order_id
+              ORDER BY 2 DESC, pol.order_id DESC
+                 LIMIT %s
+            """, [tuple(products.ids), sale_date - window, sale_date + window, per_signal])
+            overlap = dict(self.env.cr.fetchall())
+            candidates |= PurchaseOrder.browse(list(overlap))
+        candidates = candidates.filtered_domain(base_domain)
+        if not candidates:
+            return []
+        
+        # Productos en común de los candidatos que no vinieron por producto
+        missing = [po_id for po_id in candidates.ids if po_id not in overlap]
+        if products and missing:
+            self.env.cr.execute("""
+                SELECT order_id, COUNT(DISTINCT product_id)
+                  FROM purchase_order_line
+                 WHERE order_id IN %s AND product_id IN %s
+              GROUP BY order_id
+            """, [tuple(missing), tuple(products.ids)])
+            overlap.update(self.env.cr.fetchall())
+        
+        # 2. Puntaje
+        weights = SUGGESTION_WEIGHTS
+        results = []
+        for po in candidates:
+            score = 0.0
+            reasons = []
+            if vin_key and po.x_vin_key == vin_key:
+                score += weights['vin']
+                reasons.append(_('VIN'))
+            if placa_key and po.x_placa_key == placa_key:
+                score += weights['placa']
+                reasons.append(_('Placa'))
+            common = overlap.get(po.id, 0)
+            if common:
+                score += weights['products'] * common / len(products)
+                reasons.append(_('%s/%s productos', common, len(products)))
+            if po.partner_id in vendors:
+                score += weights['vendor']
+                reasons.append(_('Proveedor habitual'))
+            if po.date_order:
+                days = abs((po.date_order - sale_date).days)
+                if days <= SUGGESTION_DATE_WINDOW:
+                    score += weights['date'] * (1 - days / SUGGESTION_DATE_WINDOW)
+                    reasons.append(_('%s días', days))
+            results.append({'purchase': po, 'score': score, 'reasons': reasons})
+        
+        results.sort(key=lambda result: (-result['score'], -result['purchase'].id))
+        return results[:limit]
+
     def action_export_liquidation_excel(self):
         """Exporta la liquidación a Excel"""
         self.ensure_one()
@@ -601,17 +1289,19 @@ class SaleOrderLine(models.Model):
         help='Líneas de compra generadas desde esta línea de venta'
     )
     
+    # Almacenados: se recalculan solo cuando cambian las líneas de compra
+    # vinculadas, su estado o la cantidad vendida, y se pueden buscar en SQL
     x_qty_purchased = fields.Float(
         string='Cantidad Comprada',
         compute='_compute_qty_purchased',
-        store=False,
+        store=True,
         help='Cantidad total comprada para esta línea'
     )
     
     x_qty_pending_purchase = fields.Float(
         string='Cantidad Pendiente',
         compute='_compute_qty_purchased',
-        store=False,
+        store=True,
         help='Cantidad pendiente por comprar'
     )
     
@@ -619,23 +1309,96 @@ class SaleOrderLine(models.Model):
         ('not_purchased', 'Sin Pedir'),
         ('partial', 'Parcial'),
         ('purchased', 'Completo')
-    ], string='Estado de Compra', compute='_compute_qty_purchased', store=False)
+    ], string='Estado de Compra', compute='_compute_qty_purchased', store=True, index=True)
 
-    @api.depends('x_purchase_line_ids.product_qty', 'x_purchase_line_ids.order_id.state', 'product_uom_qty')
+    @api.depends('x_purchase_line_ids', 'x_purchase_line_ids.product_qty',
+                 'x_purchase_line_ids.product_uom', 'x_purchase_line_ids.order_id.state',
+                 'product_uom_qty', 'product_uom')
     def _compute_qty_purchased(self):
-        """Calcula la cantidad comprada y pendiente"""
+        """
+        Calcula la cantidad comprada y pendiente, en la UdM de la línea de venta
+        
+        Las compras pueden estar en la UdM de compra del producto (uom_po_id),
+        por eso cada cantidad se convierte antes de compararla con la vendida.
+        """
+        purchased_by_line = self._get_purchased_qty_batch()
         for line in self:
-            purchased_lines = line.x_purchase_line_ids.filtered(
-                lambda l: l.order_id.state != 'cancel'
-            )
-            qty_purchased = sum(purchased_lines.mapped('product_qty'))
+            if isinstance(line.id, int):
+                qty_purchased = purchased_by_line.get(line.id, 0.0)
+            else:
+                # Línea nueva (onchange): cálculo con el ORM
+                factors = self._get_uom_factor_table(
+                    line.x_purchase_line_ids.product_uom.ids + line.product_uom.ids
+                )
+                qty_purchased = sum(
+                    self._convert_uom_qty(factors, pl.product_qty, pl.product_uom.id, line.product_uom.id)
+                    for pl in line.x_purchase_line_ids
+                    if pl.order_id.state != 'cancel'
+                )
             
             line.x_qty_purchased = qty_purchased
             line.x_qty_pending_purchase = line.product_uom_qty - qty_purchased
             
-            if qty_purchased <= 0:
+            rounding = line.product_uom.rounding or 0.01
+            if float_compare(qty_purchased, 0.0, precision_rounding=rounding) <= 0:
                 line.x_purchase_status = 'not_purchased'
-            elif qty_purchased < line.product_uom_qty:
+            elif float_compare(qty_purchased, line.product_uom_qty, precision_rounding=rounding) < 0:
                 line.x_purchase_status = 'partial'
             else:
-                line.x_purchase_status = 'purchased'
\ No newline at end of file
+                line.x_purchase_status = 'purchased'
+
+    def _get_purchased_qty_batch(self):
+        """
+        🎯 Suma lo comprado para todas las líneas con UNA consulta agrupada
+        
+        Agrupa las líneas de compra no canceladas por (línea de venta, UdM)
+        y convierte cada grupo a la UdM de la línea de venta.
+        
+        Returns:
+            dict: {sale_line_id: cantidad comprada en la UdM de venta}
+        """
+        lines = self.filtered(lambda l: isinstance(l.id, int))
+        if not lines:
+            return {}
+        
+        groups = self.env['purchase.order.line']._read_group(
+            [('x_sale_line_id', 'in', lines.ids), ('order_id.state', '!=', 'cancel')],
+            groupby=['x_sale_line_id', 'product_uom'],
+            aggregates=['product_qty:sum'],
+        )
+        sale_uom_by_line = {line.id: line.product_uom.id for line in lines}
+        factors = self._get_uom_factor_table(
+            [uom.id for _line, uom, _qty in groups] + list(sale_uom_by_line.values())
+        )
+        
+        result = {}
+        for sale_line, uom, qty in groups:
+            result[sale_line.id] = result.get(sale_line.id, 0.0) + self._convert_uom_qty(
+                factors, qty, uom.id, sale_uom_by_line[sale_line.id]
+            )
+        return result
+
+    @api.model
+    def _get_uom_factor_table(self, uom_ids):
+        """Tabla {uom_id: (factor, categoría, redondeo)} leída una sola vez por cálculo"""
+        uoms = self.env['uom.uom'].browse(set(filter(None, uom_ids)))
+        return {uom.id: (uom.factor, uom.category_id.id, uom.rounding) for uom in uoms}
+
+    @api.model
+    def _convert_uom_qty(self, factors, qty, from_uom_id, to_uom_id):
+        """
+        Igual que uom.uom._compute_quantity (redondeo hacia arriba), usando la tabla de factores.
+        Si las UdM no son de la misma categoría se devuelve la cantidad sin convertir.
+        """
+        if not qty or not from_uom_id or not to_uom_id or from_uom_id == to_uom_id:
+            return qty
+        from_factor, from_category, _from_rounding = factors[from_uom_id]
+        to_factor, to_category, to_rounding = factors[to_uom_id]
+        if from_category != to_category:
+            _logger.warning(
+                'No se puede convertir entre las UdM %s y %s (categorías distintas)',
+                from_uom_id, to_uom_id
+            )
+            return qty
+        amount = qty / from_factor * to_factor
+        return float_round(amount, precision_rounding=to_rounding, rounding_method='UP')
@@ -1,2 +1,6 @@
 # -*- coding: utf-8 -*-
-# Este archivo es necesario para que Python reconozca el directorio
\ No newline at end of file
+# Este archivo es necesario para que Python reconozca el directorio
+
+from . import sale_liquidation_report
+from . import sale_case_profitability_report
+from . import purchase_backlog_report
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, tools
+
+
+class SalePurchaseBacklogReport(models.Model):
+    _name = 'sale.purchase.backlog.report'
+    _description = 'Pendientes de Compra por Proveedor'
+    _auto = False
+    _rec_name = 'product_id'
+    _order = 'date_order, order_id, id'
+
+    # ========== DIMENSIONES ==========
+    sale_line_id = fields.Many2one('sale.order.line', string='Línea de Venta', readonly=True)
+    order_id = fields.Many2one('sale.order', string='Orden de Venta', readonly=True)
+    date_order = fields.Datetime(string='Fecha de Venta', readonly=True)
+    partner_id = fields.Many2one('res.partner', string='Cliente', readonly=True)
+    user_id = fields.Many2one('res.users', string='Vendedor', readonly=True)
+    company_id = fields.Many2one('res.company', string='Compañía', readonly=True)
+    product_id = fields.Many2one('product.product', string='Producto', readonly=True)
+    product_uom = fields.Many2one('uom.uom', string='Unidad de Medida', readonly=True)
+    vendor_id = fields.Many2one('res.partner', string='Proveedor', readonly=True,
+                                help='Primer proveedor configurado en el producto (vacío = PROVEEDOR GENERICO)')
+    vendor_currency_id = fields.Many2one('res.currency', string='Moneda Proveedor', readonly=True)
+    vendor_price = fields.Monetary(string='Precio Proveedor', currency_field='vendor_currency_id', readonly=True)
+    x_placa = fields.Char(string='Placa', readonly=True)
+
+    # ========== CANTIDADES (UdM de la línea de venta) ==========
+    qty_sold = fields.Float(string='Cant. Vendida', readonly=True)
+    qty_purchased = fields.Float(string='Cant. Comprada', readonly=True)
+    qty_pending = fields.Float(string='Cant. Pendiente', readonly=True)
+
+    def _query(self):
+        """
+        🎯 Líneas de ventas confirmadas con cantidad pendiente de comprar
+
+        Misma lógica que sale.order.line.x_qty_pending_purchase, pero en SQL:
+        vendido - comprado (líneas de compra no canceladas convertidas a la UdM
+        de venta). El proveedor sale de product.supplierinfo con el mismo orden
+        que product.seller_ids (secuencia, cantidad mínima, precio).
+        """
+        return """
+            WITH purchased AS (
+                SELECT pol.x_sale_line_id AS sale_line_id,
+                       SUM(CASE
+                               WHEN pol.product_uom = sol.product_uom
+                                 OR po_uom.category_id != so_uom.category_id
+                               THEN pol.product_qty
+                               ELSE CEIL(ROUND((pol.product_qty / po_uom.factor * so_uom.factor
+                                                / so_uom.rounding)::numeric, 6)) * so_uom.rounding
+                           END) AS qty
+                  FROM purchase_order_line pol
+                  JOIN purchase_order po ON po.id = pol.order_id
+                  JOIN sale_order_line sol ON sol.id = pol.x_sale_line_id
+                  JOIN uom_uom po_uom ON po_uom.id = pol.product_uom
+                  JOIN uom_uom so_uom ON so_uom.id = sol.product_uom
+                 WHERE po.state != 'cancel'
+                   AND sol.x_purchase_status != 'purchased'
+              GROUP BY pol.x_sale_line_id
+            )
+            SELECT sol.id,
+                   sol.id AS sale_line_id,
+                   so.id AS order_id,
+                   so.date_order,
+                   so.partner_id,
+                   so.user_id,
+                   so.company_id,
+                   so.x_placa,
+                   sol.product_id,
+                   sol.product_uom,
+                   vendor.partner_id AS vendor_id,
+                   vendor.currency_id AS vendor_currency_id,
+                   vendor.price AS vendor_price,
+                   sol.product_uom_qty AS qty_sold,
+                   COALESCE(p.qty, 0) AS qty_purchased,
+                   sol.product_uom_qty - COALESCE(p.qty, 0) AS qty_pending
+              FROM sale_order_line sol
+              JOIN sale_order so ON so.id = sol.order_id
+              JOIN product_product pp ON pp.id = sol.product_id
+         LEFT JOIN purchased p ON p.sale_line_id = sol.id
+         LEFT JOIN LATERAL (
+                    SELECT si.partner_id, si.currency_id, si.price
+                      FROM product_supplierinfo si
+                     WHERE si.product_tmpl_id = pp.product_tmpl_id
+                       AND (si.product_id IS NULL OR si.product_id = pp.id)
+                       AND (si.company_id IS NULL OR si.company_id = so.company_id)
+                  ORDER BY si.sequence, si.min_qty DESC, si.price, si.id
+                     LIMIT 1
+                   ) vendor ON TRUE
+             WHERE so.state IN ('sale', 'done')
+               AND sol.display_type IS NULL
+               AND sol.x_purchase_status != 'purchased'
+               AND sol.product_uom_qty - COALESCE(p.qty, 0) > 0
+        """
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute(f'CREATE OR REPLACE VIEW {self._table} AS ({self._query()})')
+
+    # ========== ACCIONES ==========
+    def action_open_create_purchase_wizard(self):
+        """Abre el wizard de creación de compras para las ventas de las líneas seleccionadas"""
+        return self.order_id.action_create_purchase_orders()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+
+def _rate_sql(currency, company_root, date):
+    """
+    Subconsulta SQL con la tasa de `currency` a la fecha `date`.
+
+    Replica la regla de res.currency._get_rates: última tasa <= fecha
+    (priorizando la de la compañía sobre la global), si no existe la
+    primera tasa registrada, y si no hay ninguna 1.0.
+    """
+    return f"""COALESCE(
+        (SELECT r.rate FROM res_currency_rate r
+          WHERE r.currency_id = {currency} AND r.name <= {date}
+            AND (r.company_id IS NULL OR r.company_id = {company_root})
+       ORDER BY r.company_id, r.name DESC LIMIT 1),
+        (SELECT r.rate FROM res_currency_rate r
+          WHERE r.currency_id = {currency}
+            AND (r.company_id IS NULL OR r.company_id = {company_root})
+       ORDER BY r.company_id, r.name ASC LIMIT 1),
+        1.0)"""
+
+
+def _convert_sql(amount, currency, date):
+    """Convierte `amount` a la moneda de la compañía de la venta, redondeando como _convert"""
+    return f"""CASE WHEN {currency} = o.company_currency_id THEN {amount}
+        ELSE ROUND({amount} * {_rate_sql('o.company_currency_id', 'o.company_root_id', date)}
+                   / {_rate_sql(currency, 'o.company_root_id', date)}
+                   / o.currency_rounding) * o.currency_rounding
+        END"""
+
+
+class SaleCaseProfitabilityReport(models.Model):
+    _name = 'sale.case.profitability.report'
+    _description = 'Análisis de Rentabilidad por Caso'
+    _auto = False
+    _rec_name = 'sale_order_id'
+    _order = 'date_order desc'
+
+    # ========== DIMENSIONES ==========
+    sale_order_id = fields.Many2one('sale.order', string='Orden de Venta', readonly=True)
+    date_order = fields.Datetime(string='Fecha de Venta', readonly=True)
+    partner_id = fields.Many2one('res.partner', string='Cliente', readonly=True)
+    user_id = fields.Many2one('res.users', string='Vendedor', readonly=True)
+    team_id = fields.Many2one('crm.team', string='Equipo de Ventas', readonly=True)
+    company_id = fields.Many2one('res.company', string='Compañía', readonly=True)
+    currency_id = fields.Many2one('res.currency', string='Moneda', readonly=True)
+    state = fields.Selection([
+        ('draft', 'Cotización'),
+        ('sent', 'Cotización Enviada'),
+        ('sale', 'Orden de Venta'),
+        ('done', 'Bloqueada'),
+        ('cancel', 'Cancelada'),
+    ], string='Estado', readonly=True)
+    x_placa = fields.Char(string='Placa', readonly=True)
+    x_marca = fields.Char(string='Marca', readonly=True)
+
+    # ========== MEDIDAS (en moneda de la compañía) ==========
+    amount_untaxed = fields.Monetary(string='Venta (Sin Impuestos)', readonly=True)
+    invoiced_amount = fields.Monetary(string='Total Facturado (Bruto)', readonly=True)
+    credit_note_amount = fields.Monetary(string='Total Notas de Crédito', readonly=True)
+    net_invoiced_amount = fields.Monetary(string='Total Facturado (Neto)', readonly=True)
+    purchase_amount = fields.Monetary(string='Total de Compras', readonly=True)
+    profit_margin = fields.Monetary(string='Margen de Utilidad (Neto)', readonly=True)
+    purchase_count = fields.Integer(string='# Compras', readonly=True)
+    invoice_count = fields.Integer(string='# Facturas', readonly=True)
+
+    def _query(self):
+        """
+        🎯 Una fila por orden de venta con sus montos ya convertidos
+
+        - Compras confirmadas vinculadas por purchase_order.x_sale_order_id; de
+          las consolidadas (sin venta en cabecera) solo la parte de sus líneas
+          (purchase_order_line.x_sale_order_id)
+        - Facturas publicadas vinculadas por account_move.x_sale_order_id
+          o por las líneas de venta facturadas (sale.order.invoice_ids)
+        """
+        po_amount = _convert_sql('pl.amount', 'po.currency_id', 'po.date_order::date')
+        move_amount = _convert_sql('am.amount_total', 'am.currency_id', 'COALESCE(am.invoice_date, am.date)')
+        return f"""
+            WITH orders AS (
+                SELECT so.id, so.company_id, so.currency_id AS sale_currency_id,
+                       rc.currency_id AS company_currency_id,
+                       split_part(rc.parent_path, '/', 1)::int AS company_root_id,
+                       cur.rounding AS currency_rounding
+                  FROM sale_order so
+                  JOIN res_company rc ON rc.id = so.company_id
+                  JOIN res_currency cur ON cur.id = rc.currency_id
+            ),
+            move_links AS (
+                SELECT sol.order_id, aml.move_id
+                  FROM sale_order_line sol
+                  JOIN sale_order_line_invoice_rel rel ON rel.order_line_id = sol.id
+                  JOIN account_move_line aml ON aml.id = rel.invoice_line_id
+                 UNION
+                SELECT am.x_sale_order_id, am.id
+                  FROM account_move am
+                 WHERE am.x_sale_order_id IS NOT NULL
+            ),
+            moves AS (
+                SELECT ml.order_id,
+                       SUM(CASE WHEN am.move_type = 'out_invoice' THEN {move_amount} ELSE 0 END) AS invoiced_amount,
+                       SUM(CASE WHEN am.move_type = 'out_refund' THEN {move_amount} ELSE 0 END) AS credit_note_amount,
+                       COUNT(*) AS invoice_count
+                  FROM move_links ml
+                  JOIN orders o ON o.id = ml.order_id
+                  JOIN account_move am ON am.id = ml.move_id
+                 WHERE am.state = 'posted'
+                   AND am.move_type IN ('out_invoice', 'out_refund')
+              GROUP BY ml.order_id
+            ),
+            purchase_links AS (
+                SELECT po.x_sale_order_id AS order_id, po.id AS po_id, po.amount_total AS amount
+                  FROM purchase_order po
+                 WHERE po.x_sale_order_id IS NOT NULL
+                   AND po.state IN ('purchase', 'done')
+                 UNION ALL
+                SELECT pol.x_sale_order_id, po.id, SUM(pol.price_total)
+                  FROM purchase_order_line pol
+                  JOIN purchase_order po ON po.id = pol.order_id
+                 WHERE po.x_sale_order_id IS NULL
+                   AND pol.x_sale_order_id IS NOT NULL
+                   AND po.state IN ('purchase', 'done')
+              GROUP BY pol.x_sale_order_id, po.id
+            ),
+            purchases AS (
+                SELECT pl.order_id,
+                       SUM({po_amount}) AS purchase_amount,
+                       COUNT(*) AS purchase_count
+                  FROM purchase_links pl
+                  JOIN orders o ON o.id = pl.order_id
+                  JOIN purchase_order po ON po.id = pl.po_id
+              GROUP BY pl.order_id
+            )
+            SELECT so.id,
+                   so.id AS sale_order_id,
+                   so.date_order,
+                   so.partner_id,
+                   so.user_id,
+                   so.team_id,
+                   so.company_id,
+                   o.company_currency_id AS currency_id,
+                   so.state,
+                   so.x_placa,
+                   so.x_marca,
+                   {_convert_sql('so.amount_untaxed', 'so.currency_id', 'so.date_order::date')} AS amount_untaxed,
+                   COALESCE(m.invoiced_amount, 0) AS invoiced_amount,
+                   COALESCE(m.credit_note_amount, 0) AS credit_note_amount,
+                   COALESCE(m.invoiced_amount, 0) - COALESCE(m.credit_note_amount, 0) AS net_invoiced_amount,
+                   COALESCE(p.purchase_amount, 0) AS purchase_amount,
+                   COALESCE(m.invoiced_amount, 0) - COALESCE(m.credit_note_amount, 0)
+                       - COALESCE(p.purchase_amount, 0) AS profit_margin,
+                   COALESCE(p.purchase_count, 0) AS purchase_count,
+                   COALESCE(m.invoice_count, 0) AS invoice_count
+              FROM sale_order so
+              JOIN orders o ON o.id = so.id
+         LEFT JOIN moves m ON m.order_id = so.id
+         LEFT JOIN purchases p ON p.order_id = so.id
+        """
+
+    def init(self):
+        """
+        Crea la vista materializada (con índice único para poder refrescarla
+        con CONCURRENTLY sin bloquear las lecturas)
+        """
+        cr = self.env.cr
+        cr.execute("SELECT relkind FROM pg_class WHERE relname = %s", [self._table])
+        row = cr.fetchone()
+        if row and row[0] == 'm':
+            cr.execute(f'DROP MATERIALIZED VIEW {self._table}')
+        elif row and row[0] == 'v':
+            cr.execute(f'DROP VIEW {self._table}')
+        cr.execute(f'CREATE MATERIALIZED VIEW {self._table} AS ({self._query()})')
+        cr.execute(f'CREATE UNIQUE INDEX {self._table}_id_uniq ON {self._table} (id)')
+        cr.execute(f'CREATE INDEX {self._table}_date_order_idx ON {self._table} (date_order)')
+
+    @api.model
+    def _cron_refresh(self):
+        """Refresca la vista materializada sin bloquear las consultas en curso"""
+        self.env.flush_all()
+        self.env.cr.execute(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {self._table}')
+        self.env.invalidate_all()
+        _logger.info('Vista %s refrescada', self._table)
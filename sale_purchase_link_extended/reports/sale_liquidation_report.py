@@ -4,7 +4,7 @@ from odoo import models, api
 
 
 class SaleLiquidationReport(models.AbstractModel):
-    _name = 'report.sale_purchase_link_extended.report_sale_liquidation'
+    _name = 'report.sale_purchase_link_extended.report_sale_liquidation_template'
     _description = 'Reporte de Liquidación de Ventas'
 
     @api.model
@@ -12,6 +12,9 @@ class SaleLiquidationReport(models.AbstractModel):
         """Prepara los valores para el reporte de liquidación"""
         docs = self.env['sale.order'].browse(docids)
         
+        # Una sola consulta de tipos de cambio para todas las órdenes del reporte
+        docs._preload_liquidation_rates()
+        
         return {
             'doc_ids': docids,
             'doc_model': 'sale.order',
@@ -0,0 +1,97 @@
+/** @odoo-module **/
+
+import { Component, onWillStart, onWillUpdateProps, useState } from "@odoo/owl";
+import { registry } from "@web/core/registry";
+import { useService } from "@web/core/utils/hooks";
+import { formatFloat } from "@web/core/utils/numbers";
+import { standardWidgetProps } from "@web/views/widgets/standard_widget_props";
+
+/**
+ * Agrupa en una sola llamada JSON-RPC las órdenes pedidas en el mismo ciclo
+ * (ej: varios paneles montados a la vez).
+ */
+const pendingRequests = new Map();
+let flushScheduled = false;
+
+function fetchLiquidation(orm, orderId) {
+    return new Promise((resolve, reject) => {
+        pendingRequests.set(orderId, [...(pendingRequests.get(orderId) || []), { resolve, reject }]);
+        if (flushScheduled) {
+            return;
+        }
+        flushScheduled = true;
+        Promise.resolve().then(async () => {
+            const requests = new Map(pendingRequests);
+            pendingRequests.clear();
+            flushScheduled = false;
+            try {
+                const data = await orm.call("sale.order", "get_liquidation_dataset", [
+                    [...requests.keys()],
+                ]);
+                for (const [id, callbacks] of requests) {
+                    callbacks.forEach(({ resolve }) => resolve(data[id]));
+                }
+            } catch (error) {
+                for (const callbacks of requests.values()) {
+                    callbacks.forEach(({ reject }) => reject(error));
+                }
+            }
+        });
+    });
+}
+
+/**
+ * Panel de la pestaña "Liquidación de Caso".
+ *
+ * El notebook solo monta la página activa, así que los datos se piden
+ * únicamente cuando el usuario abre la pestaña.
+ */
+export class LiquidationPanel extends Component {
+    static template = "sale_purchase_link_extended.LiquidationPanel";
+    static props = { ...standardWidgetProps };
+
+    setup() {
+        this.orm = useService("orm");
+        this.state = useState({ loading: true, data: null });
+        onWillStart(() => this.load(this.props.record.resId));
+        onWillUpdateProps((nextProps) => {
+            if (nextProps.record.resId !== this.props.record.resId) {
+                return this.load(nextProps.record.resId);
+            }
+        });
+    }
+
+    async load(resId) {
+        if (!resId) {
+            this.state.loading = false;
+            this.state.data = null;
+            return;
+        }
+        this.state.loading = true;
+        this.state.data = (await fetchLiquidation(this.orm, resId)) || null;
+        this.state.loading = false;
+    }
+
+    onRefresh() {
+        return this.load(this.props.record.resId);
+    }
+
+    formatAmount(amount, symbol) {
+        return `${symbol || ""} ${formatFloat(amount, { digits: [16, 2] })}`;
+    }
+
+    formatQty(qty) {
+        return formatFloat(qty, { digits: [16, 2] });
+    }
+
+    get showConversion() {
+        const data = this.state.data;
+        return data.purchase_orders.some((po) => po.currency_id !== data.currency.id);
+    }
+}
+
+export const liquidationPanel = {
+    component: LiquidationPanel,
+};
+
+registry.category("view_widgets").add("spl_liquidation_panel", liquidationPanel);
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+from . import test_allocate_sale_lines
+from . import test_autolink
+from . import test_liquidation_batch
+from . import test_move_source_orders
+from . import test_purchase_creation_job
+from . import test_purchased_qty
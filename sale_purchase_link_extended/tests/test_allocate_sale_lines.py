@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestAllocateSaleLines(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.uom_unit = cls.env.ref('uom.product_uom_unit')
+        cls.uom_dozen = cls.env.ref('uom.product_uom_dozen')
+        cls.customer = cls.env['res.partner'].create({'name': 'Cliente Prueba'})
+        cls.vendor = cls.env['res.partner'].create({'name': 'Proveedor Prueba'})
+        cls.product = cls.env['product.product'].create({'name': 'Filtro', 'type': 'consu'})
+        cls.other_product = cls.env['product.product'].create({'name': 'Sin Venta', 'type': 'consu'})
+        cls.sale = cls.env['sale.order'].create({
+            'partner_id': cls.customer.id,
+            'order_line': [
+                (0, 0, {'product_id': cls.product.id, 'product_uom_qty': 5.0, 'product_uom': cls.uom_unit.id}),
+                (0, 0, {'product_id': cls.product.id, 'product_uom_qty': 2.0, 'product_uom': cls.uom_dozen.id}),
+            ],
+        })
+        cls.line_units, cls.line_dozens = cls.sale.order_line
+
+    def _po_line(self, qty, uom, product=None):
+        return (0, 0, {
+            'product_id': (product or self.product).id,
+            'product_qty': qty,
+            'product_uom': uom.id,
+            'price_unit': 1.0,
+        })
+
+    def test_greedy_allocation_with_uom_conversion(self):
+        purchase = self.env['purchase.order'].create({
+            'partner_id': self.vendor.id,
+            'order_line': [
+                self._po_line(4.0, self.uom_unit),
+                self._po_line(3.0, self.uom_unit),
+                self._po_line(1.0, self.uom_dozen),
+                self._po_line(6.0, self.uom_unit),
+                self._po_line(1.0, self.uom_unit, product=self.other_product),
+            ],
+        })
+        po_lines = purchase.order_line.sorted('id')
+
+        allocations = purchase._allocate_sale_lines(self.sale)
+        self.assertEqual(
+            [(po_line, sale_line) for po_line, sale_line, qty in allocations],
+            [
+                # Misma UdM primero; mientras quede pendiente se sigue llenando
+                (po_lines[0], self.line_units),
+                (po_lines[1], self.line_units),
+                (po_lines[2], self.line_dozens),
+                # Las unidades ya están cubiertas: pasa a la línea en docenas
+                (po_lines[3], self.line_dozens),
+            ],
+        )
+        self.assertEqual([qty for po_line, sale_line, qty in allocations], [4.0, 3.0, 1.0, 0.5])
+
+        purchase._reconcile_sale_lines(self.sale)
+        self.assertEqual(self.line_units.x_purchase_line_ids, po_lines[:2])
+        self.assertEqual(self.line_dozens.x_purchase_line_ids, po_lines[2:4])
+        self.assertFalse(po_lines[4].x_sale_line_id)
+        # Las líneas ya conciliadas no se vuelven a asignar
+        self.assertFalse(purchase._allocate_sale_lines(self.sale))
+
+    def test_review_accept_reconciles_lines(self):
+        purchase = self.env['purchase.order'].create({
+            'partner_id': self.vendor.id,
+            'order_line': [self._po_line(5.0, self.uom_unit)],
+        })
+        review = self.env['purchase.sale.link.review'].create({
+            'purchase_id': purchase.id,
+            'sale_order_id': self.sale.id,
+            'score': 50.0,
+        })
+        review.action_accept()
+        self.assertEqual(purchase.x_sale_order_id, self.sale)
+        self.assertEqual(purchase.order_line.x_sale_line_id, self.line_units)
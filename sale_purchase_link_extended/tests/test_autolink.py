@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.sale_purchase_link_extended.models.purchase_order import (
+    AUTOLINK_BATCH_SIZE_PARAM,
+    AUTOLINK_LAST_ID_PARAM,
+)
+
+
+@tagged('post_install', '-at_install')
+class TestAutolink(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.customer = cls.env['res.partner'].create({'name': 'Cliente Prueba'})
+        cls.vendor = cls.env['res.partner'].create({'name': 'Proveedor Prueba'})
+        cls.product = cls.env['product.product'].create({'name': 'Repuesto Prueba', 'type': 'consu'})
+        cls.other_product = cls.env['product.product'].create({'name': 'Otro Repuesto', 'type': 'consu'})
+        cls.env['ir.config_parameter'].sudo().set_param(AUTOLINK_LAST_ID_PARAM, 0)
+
+    def _create_sale(self, confirm=True, **vals):
+        sale = self.env['sale.order'].create({
+            'partner_id': self.customer.id,
+            'order_line': [(0, 0, {'product_id': self.product.id, 'product_uom_qty': 1.0})],
+            **vals,
+        })
+        if confirm:
+            sale.action_confirm()
+        return sale
+
+    def _create_purchase(self, product=None, **vals):
+        return self.env['purchase.order'].create({
+            'partner_id': self.vendor.id,
+            'order_line': [(0, 0, {
+                'product_id': (product or self.product).id,
+                'product_qty': 1.0,
+                'price_unit': 10.0,
+            })],
+            **vals,
+        })
+
+    def test_clear_match_is_linked(self):
+        """Origen + placa dan un puntaje sobre el umbral y con margen sobre el segundo"""
+        sale = self._create_sale(x_placa='ABC-123')
+        self._create_sale(x_placa='ABC-123')
+        purchase = self._create_purchase(origin=sale.name, x_placa='abc 123')
+
+        scored = purchase._match_sale_orders()[purchase]
+        self.assertEqual(scored[0][1], sale)
+        self.assertGreaterEqual(scored[0][0] - scored[1][0], 15.0)
+
+        purchase._autolink_batch(80, 40)
+        self.assertEqual(purchase.x_sale_order_id, sale)
+        # También concilia las líneas, así la venta las cuenta como compradas
+        self.assertEqual(purchase.order_line.x_sale_line_id, sale.order_line)
+        self.assertEqual(sale.order_line.x_purchase_status, 'purchased')
+
+    def test_ambiguous_match_goes_to_review(self):
+        """Dos ventas con el mismo puntaje: no se vincula, ambas van a revisión"""
+        sale_a = self._create_sale(x_placa='XYZ-987')
+        sale_b = self._create_sale(x_placa='XYZ-987')
+        purchase = self._create_purchase(product=self.other_product, x_placa='XYZ987')
+
+        linked, reviewed = purchase._autolink_batch(40, 40)
+        self.assertEqual(linked, 0)
+        self.assertEqual(reviewed, 1)
+        self.assertFalse(purchase.x_sale_order_id)
+        reviews = self.env['purchase.sale.link.review'].search([('purchase_id', '=', purchase.id)])
+        self.assertEqual(reviews.sale_order_id, sale_a | sale_b)
+
+    def test_below_review_threshold_is_ignored(self):
+        """Solo placa (sin origen ni productos): bajo el umbral de revisión no se hace nada"""
+        self._create_sale(x_placa='LMN-555')
+        purchase = self._create_purchase(product=self.other_product, x_placa='LMN555')
+
+        linked, reviewed = purchase._autolink_batch(80, 70)
+        self.assertEqual((linked, reviewed), (0, 0))
+        self.assertFalse(purchase.x_sale_order_id)
+
+    def test_origin_quotation_is_not_a_candidate(self):
+        """Una cotización (sin confirmar) citada en el origen no suma puntaje ni se vincula"""
+        quotation = self._create_sale(confirm=False)
+        purchase = self._create_purchase(product=self.other_product, origin=quotation.name)
+
+        self.assertFalse(purchase._match_sale_orders()[purchase])
+        purchase._autolink_batch(80, 40)
+        self.assertFalse(purchase.x_sale_order_id)
+
+    def test_consolidated_purchase_is_not_an_orphan(self):
+        """Una compra con líneas de dos ventas no se vincula a ninguna de ellas"""
+        sale_a = self._create_sale()
+        sale_b = self._create_sale()
+        purchase = self.env['purchase.order'].create({
+            'partner_id': self.vendor.id,
+            'origin': '%s, %s' % (sale_a.name, sale_b.name),
+            'order_line': [
+                (0, 0, {'product_id': self.product.id, 'product_qty': 1.0, 'price_unit': 10.0,
+                        'x_sale_line_id': sale.order_line.id})
+                for sale in (sale_a, sale_b)
+            ],
+        })
+        self.assertFalse(self.env['purchase.order'].search(
+            self.env['purchase.order']._get_orphan_domain() + [('id', '=', purchase.id)]
+        ))
+
+        self.env['purchase.order']._cron_autolink_sale_orders()
+        self.assertFalse(purchase.x_sale_order_id)
+        self.assertFalse(self.env['purchase.sale.link.review'].search([('purchase_id', '=', purchase.id)]))
+
+    def test_cursor_wraps_around(self):
+        """Una compra revisada antes de confirmar la venta se vincula en la vuelta siguiente"""
+        params = self.env['ir.config_parameter'].sudo()
+        params.set_param(AUTOLINK_BATCH_SIZE_PARAM, 100000)
+        sale = self._create_sale(confirm=False, x_placa='QRS-321', x_vin='VIN0001')
+        purchase = self._create_purchase(x_placa='QRS321', x_vin='vin-0001')
+
+        self.env['purchase.order']._cron_autolink_sale_orders()
+        self.assertFalse(purchase.x_sale_order_id)
+        self.assertEqual(params.get_param(AUTOLINK_LAST_ID_PARAM), '0')
+
+        sale.action_confirm()
+        self.env['purchase.order']._cron_autolink_sale_orders()
+        self.assertEqual(purchase.x_sale_order_id, sale)
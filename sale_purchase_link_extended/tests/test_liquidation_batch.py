@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from odoo import fields
+from odoo.tests import tagged
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+
+@tagged('post_install', '-at_install')
+class TestLiquidationBatch(AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.other_currency = cls.setup_other_currency('EUR')
+        cls.product = cls.env['product.product'].create({
+            'name': 'Repuesto Prueba',
+            'type': 'consu',
+            'invoice_policy': 'order',
+            'list_price': 100.0,
+        })
+        cls.sale = cls.env['sale.order'].create({
+            'partner_id': cls.partner_a.id,
+            'order_line': [(0, 0, {'product_id': cls.product.id, 'product_uom_qty': 4.0, 'price_unit': 100.0})],
+        })
+        cls.sale.action_confirm()
+        cls.other_sale = cls.env['sale.order'].create({
+            'partner_id': cls.partner_a.id,
+            'order_line': [(0, 0, {'product_id': cls.product.id, 'product_uom_qty': 1.0, 'price_unit': 100.0})],
+        })
+        cls.other_sale.action_confirm()
+
+    def _create_move(self, move_type, currency, price_unit, invoice_date='2024-03-01'):
+        move = self.env['account.move'].create({
+            'move_type': move_type,
+            'partner_id': self.partner_a.id,
+            'currency_id': currency.id,
+            'invoice_date': invoice_date,
+            'invoice_line_ids': [(0, 0, {
+                'product_id': self.product.id,
+                'quantity': 1.0,
+                'price_unit': price_unit,
+                'tax_ids': [(6, 0, [])],
+                'sale_line_ids': [(6, 0, self.sale.order_line.ids)],
+            })],
+        })
+        move.action_post()
+        return move
+
+    def _create_purchase(self, currency, sale_lines, header_sale=None):
+        purchase = self.env['purchase.order'].create({
+            'partner_id': self.partner_b.id,
+            'currency_id': currency.id,
+            'date_order': '2024-03-02 10:00:00',
+            'x_sale_order_id': header_sale.id if header_sale else False,
+            'order_line': [
+                (0, 0, {
+                    'product_id': self.product.id,
+                    'product_qty': 1.0,
+                    'price_unit': 30.0,
+                    'taxes_id': [(6, 0, [])],
+                    'x_sale_line_id': sale_line.id,
+                })
+                for sale_line in sale_lines
+            ],
+        })
+        purchase.button_confirm()
+        return purchase
+
+    def _normalize(self, documents):
+        """{tipo: {(moneda, fecha): [montos]}} comparable entre ambos caminos"""
+        result = {}
+        for doc_type, groups in documents.items():
+            normalized = {}
+            for (currency, doc_date), amounts in groups.items():
+                key = (currency.id or False, fields.Date.to_date(doc_date) if doc_date else None)
+                normalized.setdefault(key, []).extend(round(amount, 2) for amount in amounts)
+            result[doc_type] = {key: sorted(amounts) for key, amounts in normalized.items()}
+        return result
+
+    def test_batch_matches_orm(self):
+        """El cálculo por lotes (SQL) devuelve los mismos grupos que el del ORM"""
+        company_currency = self.sale.currency_id
+        # Factura y nota de crédito en otra moneda, factura en la moneda de la venta
+        self._create_move('out_invoice', self.other_currency, 200.0)
+        self._create_move('out_invoice', company_currency, 150.0, invoice_date='2024-03-05')
+        refund = self._create_move('out_refund', self.other_currency, 40.0)
+        # Documentos aún sin monto congelado (pendientes del backfill): se convierten al vuelo
+        unfrozen = self._create_move('out_invoice', company_currency, 25.0, invoice_date='2024-03-06')
+        (refund | unfrozen).write({'x_sale_currency_id': False, 'x_amount_sale_currency': 0.0})
+        # Compra vinculada (congelada) y compra consolidada con otra venta, en otra moneda
+        self._create_purchase(self.other_currency, self.sale.order_line, header_sale=self.sale)
+        self._create_purchase(self.other_currency, self.sale.order_line | self.other_sale.order_line)
+        self.env.flush_all()
+
+        batch = self.sale._get_liquidation_documents_batch()[self.sale.id]
+        orm = self.sale._get_liquidation_documents()
+        self.assertEqual(self._normalize(batch), self._normalize(orm))
+        self.assertIn((self.other_currency.id, fields.Date.to_date('2024-03-01')), self._normalize(batch)['out_refund'])
+        self.assertTrue(any(not currency for currency, _date in batch['out_invoice']))
+
+        for doc_type in ('out_invoice', 'out_refund', 'purchase'):
+            self.assertAlmostEqual(
+                self.sale._sum_liquidation_group(batch[doc_type]),
+                self.sale._sum_liquidation_group(orm[doc_type]),
+                places=2,
+            )
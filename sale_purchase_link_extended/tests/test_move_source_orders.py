@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import tagged
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+
+@tagged('post_install', '-at_install')
+class TestMoveSourceOrders(AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.sale_a = cls.env['sale.order'].create({'partner_id': cls.partner_a.id})
+        cls.sale_b = cls.env['sale.order'].create({'partner_id': cls.partner_a.id})
+        cls.purchase = cls.env['purchase.order'].create({'partner_id': cls.partner_b.id})
+
+    def _legacy_source_orders(self, move):
+        """Resultado del cálculo anterior, registro por registro (origen exacto)"""
+        sale_order = self.env['sale.order']
+        purchase_order = self.env['purchase.order']
+        if move.invoice_origin:
+            sale_order = self.env['sale.order'].search([('name', '=', move.invoice_origin)], limit=1)
+            purchase_order = self.env['purchase.order'].search([('name', '=', move.invoice_origin)], limit=1)
+        return sale_order, purchase_order
+
+    def test_batch_invoice_origin(self):
+        """Orígenes con comas y espacios se resuelven en lote; los exactos igual que antes"""
+        sale_a, sale_b, purchase = self.sale_a.name, self.sale_b.name, self.purchase.name
+        cases = [
+            (sale_a, self.sale_a, False),
+            (purchase, False, self.purchase),
+            (f'  {sale_a} ', self.sale_a, False),
+            (f'{sale_a}, {sale_b}', self.sale_a, False),
+            (f'NO-EXISTE,{sale_b}', self.sale_b, False),
+            (f' {sale_b} ,  {purchase} ', self.sale_b, self.purchase),
+            ('NO-EXISTE', False, False),
+        ]
+        moves = self.env['account.move'].create([
+            {'move_type': 'out_invoice', 'partner_id': self.partner_a.id, 'invoice_origin': origin}
+            for origin, _sale, _purchase in cases
+        ])
+
+        for move, (origin, sale, purchase) in zip(moves, cases):
+            self.assertEqual(move.x_sale_order_id, sale or self.env['sale.order'], origin)
+            self.assertEqual(move.x_purchase_order_id, purchase or self.env['purchase.order'], origin)
+            # Donde el cálculo anterior encontraba la orden, el resultado no cambia
+            legacy_sale, legacy_purchase = self._legacy_source_orders(move)
+            if legacy_sale:
+                self.assertEqual(move.x_sale_order_id, legacy_sale, origin)
+            if legacy_purchase:
+                self.assertEqual(move.x_purchase_order_id, legacy_purchase, origin)
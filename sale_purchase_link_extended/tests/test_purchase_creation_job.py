@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+
+from odoo.exceptions import UserError
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.sale_purchase_link_extended.models.purchase_creation_job import SalePurchaseCreationJob
+
+
+@tagged('post_install', '-at_install')
+class TestPurchaseCreationJob(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.customer = cls.env['res.partner'].create({'name': 'Cliente Prueba'})
+        cls.vendor = cls.env['res.partner'].create({'name': 'Proveedor Prueba'})
+        cls.product = cls.env['product.product'].create({
+            'name': 'Repuesto Prueba',
+            'type': 'consu',
+            'seller_ids': [(0, 0, {'partner_id': cls.vendor.id, 'price': 10.0})],
+        })
+
+    def _create_job(self):
+        sale_order = self.env['sale.order'].create({
+            'partner_id': self.customer.id,
+            'order_line': [(0, 0, {'product_id': self.product.id, 'product_uom_qty': 2.0})],
+        })
+        return self.env['sale.purchase.creation.job'].create({
+            'sale_order_ids': [(6, 0, sale_order.ids)],
+            'group_by_vendor': True,
+        })
+
+    def test_failed_planning_does_not_block_queue(self):
+        """Un trabajo que falla al planificar queda 'failed' y los siguientes se procesan"""
+        broken_job = self._create_job()
+        next_job = self._create_job()
+        plan_chunks = SalePurchaseCreationJob._plan_chunks
+
+        def fake_plan_chunks(job):
+            if job == broken_job:
+                raise UserError('Error de planificación')
+            return plan_chunks(job)
+
+        with patch.object(SalePurchaseCreationJob, '_plan_chunks', autospec=True, side_effect=fake_plan_chunks):
+            self.env['sale.purchase.creation.job']._cron_process_jobs()
+
+        self.assertEqual(broken_job.state, 'failed')
+        self.assertIn('Error de planificación', broken_job.error)
+        self.assertFalse(broken_job.chunk_ids)
+        self.assertEqual(next_job.state, 'done')
+        self.assertEqual(next_job.purchase_order_ids.partner_id, self.vendor)
+
+        # Al reintentar se vuelve a planificar desde cero
+        broken_job.action_retry()
+        self.assertEqual(broken_job.state, 'pending')
+        self.assertFalse(broken_job.error)
+
+    def test_job_wizard_skips_preview(self):
+        """El wizard del trabajo no genera la vista previa (agrupa por bloque)"""
+        job = self._create_job()
+        self.assertFalse(job._get_wizard().line_ids)
+        job._process()
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.purchase_order_ids.order_line.product_qty, 2.0)
+
+    def test_generic_vendor_message_once_per_sale(self):
+        """Una venta repartida en varios bloques recibe un solo aviso del proveedor genérico"""
+        product_no_vendor = self.env['product.product'].create({'name': 'Sin Proveedor', 'type': 'consu'})
+        other_no_vendor = self.env['product.product'].create({'name': 'Sin Proveedor 2', 'type': 'consu'})
+        sale_order = self.env['sale.order'].create({
+            'partner_id': self.customer.id,
+            'order_line': [
+                (0, 0, {'product_id': product_no_vendor.id, 'product_uom_qty': 1.0}),
+                (0, 0, {'product_id': other_no_vendor.id, 'product_uom_qty': 1.0}),
+            ],
+        })
+        generic_vendor = self.env.company._get_generic_vendor()
+        job = self.env['sale.purchase.creation.job'].create({
+            'sale_order_ids': [(6, 0, sale_order.ids)],
+            'group_by_vendor': True,
+            'state': 'running',
+            'chunk_ids': [
+                (0, 0, {'vendor_id': generic_vendor.id, 'sale_line_ids': [(6, 0, line.ids)]})
+                for line in sale_order.order_line
+            ],
+        })
+        job._process()
+
+        self.assertEqual(job.state, 'done')
+        messages = sale_order.message_ids.filtered(lambda m: 'PROVEEDOR GENERICO' in (m.body or ''))
+        self.assertEqual(len(messages), 1)
+        self.assertIn('2 productos', messages.body)
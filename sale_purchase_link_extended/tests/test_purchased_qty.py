@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestPurchasedQty(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.uom_unit = cls.env.ref('uom.product_uom_unit')
+        cls.uom_dozen = cls.env.ref('uom.product_uom_dozen')
+        cls.customer = cls.env['res.partner'].create({'name': 'Cliente Prueba'})
+        cls.vendor = cls.env['res.partner'].create({'name': 'Proveedor Prueba'})
+        cls.product = cls.env['product.product'].create({'name': 'Bujía', 'type': 'consu'})
+        cls.sale = cls.env['sale.order'].create({
+            'partner_id': cls.customer.id,
+            'order_line': [
+                (0, 0, {'product_id': cls.product.id, 'product_uom_qty': 30.0, 'product_uom': cls.uom_unit.id}),
+                (0, 0, {'product_id': cls.product.id, 'product_uom_qty': 2.0, 'product_uom': cls.uom_dozen.id}),
+            ],
+        })
+        cls.line_units, cls.line_dozens = cls.sale.order_line
+
+    def _create_purchase(self, sale_line, qty, uom):
+        return self.env['purchase.order'].create({
+            'partner_id': self.vendor.id,
+            'order_line': [(0, 0, {
+                'product_id': self.product.id,
+                'product_qty': qty,
+                'product_uom': uom.id,
+                'price_unit': 1.0,
+                'x_sale_line_id': sale_line.id,
+            })],
+        })
+
+    def test_purchase_lines_in_other_uom(self):
+        """Compras en otra UdM se convierten a la UdM de la línea de venta; las canceladas no cuentan"""
+        self._create_purchase(self.line_units, 1.0, self.uom_dozen).button_confirm()
+        self._create_purchase(self.line_units, 6.0, self.uom_unit)
+        self._create_purchase(self.line_units, 1.0, self.uom_dozen).button_cancel()
+        self._create_purchase(self.line_dozens, 18.0, self.uom_unit).button_confirm()
+
+        self.assertEqual(self.line_units.x_qty_purchased, 18.0)
+        self.assertEqual(self.line_units.x_qty_pending_purchase, 12.0)
+        self.assertEqual(self.line_units.x_purchase_status, 'partial')
+        self.assertEqual(self.line_dozens.x_qty_purchased, 1.5)
+        self.assertEqual(self.line_dozens.x_purchase_status, 'partial')
+
+        # Mismo resultado que sumar línea por línea con _compute_quantity
+        batch = self.sale.order_line._get_purchased_qty_batch()
+        for line in self.sale.order_line:
+            expected = sum(
+                purchase_line.product_uom._compute_quantity(purchase_line.product_qty, line.product_uom)
+                for purchase_line in line.x_purchase_line_ids
+                if purchase_line.order_id.state != 'cancel'
+            )
+            self.assertAlmostEqual(batch[line.id], expected)
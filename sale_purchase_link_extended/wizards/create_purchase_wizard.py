@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
+from odoo.tools import float_compare, float_round
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# Primer entero de pg_try_advisory_xact_lock(int, int) para las reservas por
+# venta de este módulo (el segundo es el id de la venta)
+PURCHASE_LOCK_NAMESPACE = 52011
+
 
 class CreatePurchaseWizard(models.TransientModel):
     _name = 'create.purchase.wizard'
@@ -12,8 +17,14 @@ class CreatePurchaseWizard(models.TransientModel):
 
     sale_order_id = fields.Many2one(
         'sale.order', 
-        string='Orden de Venta',
-        required=True
+        string='Orden de Venta'
+    )
+    
+    # 🆕 Modo multi-orden: una compra consolidada por proveedor
+    sale_order_ids = fields.Many2many(
+        'sale.order',
+        string='Órdenes de Venta',
+        help='Ventas a consolidar. Se crea una sola orden de compra por proveedor para todas ellas.'
     )
     
     group_by_vendor = fields.Boolean(
@@ -29,6 +40,21 @@ class CreatePurchaseWizard(models.TransientModel):
              'Si se desmarca, se crearán líneas por el total de la venta, ignorando compras previas.'
     )
     
+    x_merge_into_draft = fields.Boolean(
+        string='Agregar a borradores existentes',
+        default=False,
+        help='Si se marca, las líneas se agregan a la solicitud de presupuesto en borrador '
+             'del mismo proveedor y venta (sumando cantidades si la línea ya existe) '
+             'en lugar de crear una orden de compra nueva.'
+    )
+    
+    x_run_in_background = fields.Boolean(
+        string='Procesar en segundo plano',
+        default=False,
+        help='Para ventas muy grandes: la creación se encola y la procesa una acción '
+             'planificada, un proveedor a la vez. El avance se ve en el trabajo creado.'
+    )
+    
     x_has_purchased_lines = fields.Boolean(
         string='Tiene líneas ya compradas',
         compute='_compute_vendor_info'
@@ -55,21 +81,66 @@ class CreatePurchaseWizard(models.TransientModel):
         compute='_compute_vendor_info'
     )
     
-    @api.depends('sale_order_id')
+    # 🆕 Vista previa editable de las líneas de compra propuestas
+    line_ids = fields.One2many(
+        'create.purchase.wizard.line',
+        'wizard_id',
+        string='Líneas Propuestas',
+        compute='_compute_line_ids',
+        store=True,
+        readonly=False
+    )
+    
+    @api.depends('sale_order_id', 'sale_order_ids', 'x_purchase_only_missing')
+    def _compute_line_ids(self):
+        """
+        🎯 Propuesta de compra en UNA pasada: proveedor, precio y cantidad
+        por línea de venta (el usuario puede editarla antes de confirmar)
+
+        Con el contexto `skip_purchase_preview` (trabajos en segundo plano,
+        que agrupan por su cuenta) no se genera la vista previa.
+        """
+        if self.env.context.get('skip_purchase_preview'):
+            self.line_ids = [(5, 0, 0)]
+            return
+        for wizard in self:
+            lines = wizard._get_sale_orders().order_line.filtered('product_id')
+            wizard.line_ids = [(5, 0, 0)] + [
+                (0, 0, vals) for vals in wizard._prepare_preview_line_vals(lines)
+            ]
+    
+    def _prepare_preview_line_vals(self, lines):
+        """Valores de la vista previa para las líneas de venta dadas"""
+        self._prefetch_sellers(lines)
+        memo = {}
+        date = fields.Date.context_today(self)
+        vals_list = []
+        for line in lines:
+            qty_to_purchase = self._get_qty_to_purchase(line)
+            seller = self._resolve_seller(line, qty_to_purchase or line.product_uom_qty, date, memo)
+            # Cantidad y precio en la UdM de compra, como quedarán en la compra
+            purchase_uom = self._get_purchase_uom(line)
+            vals_list.append({
+                'sale_line_id': line.id,
+                'vendor_id': seller.partner_id.id,
+                'price_unit': seller.price if seller else line.price_unit,
+                'product_uom': purchase_uom.id,
+                'product_qty': line.product_uom._compute_quantity(qty_to_purchase, purchase_uom),
+                'to_purchase': qty_to_purchase > 0,
+            })
+        return vals_list
+    
+    @api.depends('line_ids.vendor_id', 'line_ids.to_purchase', 'line_ids.sale_line_id')
     def _compute_vendor_info(self):
-        """Calcula información sobre productos sin proveedor y productos ya comprados"""
+        """Calcula información sobre productos sin proveedor y productos ya comprados (desde la vista previa)"""
         for wizard in self:
-            products_no_vendor = []
-            has_purchased = False
-            if wizard.sale_order_id:
-                # Usamos los campos computados de la OV que ya existen
-                for line in wizard.sale_order_id.order_line:
-                    if not line.product_id.seller_ids:
-                        products_no_vendor.append(line.product_id.name)
-                    
-                    # Verificamos el campo computado 'x_qty_purchased' de la línea de venta
-                    if line.x_qty_purchased > 0:
-                        has_purchased = True
+            products_no_vendor = [
+                preview.product_id.name
+                for preview in wizard.line_ids
+                if preview.to_purchase and not preview.vendor_id
+            ]
+            # Verificamos el campo computado 'x_qty_purchased' de la línea de venta
+            has_purchased = any(preview.sale_line_id.x_qty_purchased > 0 for preview in wizard.line_ids)
             
             wizard.has_products_without_vendor = bool(products_no_vendor)
             wizard.products_without_vendor_count = len(products_no_vendor)
@@ -77,48 +148,107 @@ class CreatePurchaseWizard(models.TransientModel):
             wizard.x_has_purchased_lines = has_purchased
     
     def _get_or_create_generic_vendor(self):
-        """Obtiene o crea el proveedor genérico"""
-        # (Sin cambios en este método)
-        generic_vendor = self.env['res.partner'].search([
-            ('name', '=', 'PROVEEDOR GENERICO'),
-            ('supplier_rank', '>', 0)
-        ], limit=1)
-        
-        if not generic_vendor:
-            generic_vendor = self.env['res.partner'].create({
-                'name': 'PROVEEDOR GENERICO',
-                'supplier_rank': 1,
-                'company_type': 'company',
-                'email': 'generico@proveedor.com',
-                'phone': '0000-0000',
-                'comment': 'Proveedor genérico creado automáticamente para productos sin proveedor asignado',
-            })
-            _logger.info('Proveedor genérico creado: ID %s', generic_vendor.id)
-        
-        return generic_vendor
+        """Obtiene el proveedor genérico de la compañía (referencia almacenada y cacheada)"""
+        return self.env.company._get_generic_vendor()
     
-    def action_create_purchase_orders(self):
-        """Crea las órdenes de compra con la lógica de "solo faltantes"""
-        self.ensure_one()
-        
-        sale_order = self.sale_order_id
-        if not sale_order.order_line:
-            raise UserError(_('La orden de venta no tiene líneas.'))
-        
-        generic_vendor = self._get_or_create_generic_vendor()
-        
-        purchase_orders = self.env['purchase.order']
-        lines_by_vendor = {}
+    def _get_sale_orders(self):
+        """Órdenes de venta a procesar (modo individual o multi-orden)"""
+        return self.sale_order_ids | self.sale_order_id
+
+    # ========== 🆕 RESOLUCIÓN DE PROVEEDOR Y PRECIO ==========
+    def _get_purchase_uom(self, line):
+        """UdM de compra del producto de la línea de venta (la de la línea si no tiene)"""
+        return line.product_id.uom_po_id or line.product_uom
+
+    def _prefetch_sellers(self, lines):
+        """Precarga en una consulta (por compañía) los product.supplierinfo de todos los productos"""
+        for company in lines.company_id:
+            products = lines.filtered(lambda l: l.company_id == company).product_id
+            products.with_company(company).seller_ids.partner_id.mapped('active')
+
+    def _get_seller_quantity_bucket(self, product, quantity, uom):
+        """
+        Tramo de cantidad: los proveedores cuya cantidad mínima se alcanza.
+        Igual que _select_seller, la cantidad (en `uom`) se convierte a la UdM
+        de cada proveedor antes de comparar; dos cantidades del mismo tramo
+        siempre eligen el mismo proveedor.
+        """
+        precision = self.env['decimal.precision'].precision_get('Product Unit of Measure')
+        reached = []
+        for seller in product.seller_ids:
+            seller_qty = quantity
+            if quantity and uom and seller.product_uom and uom != seller.product_uom:
+                seller_qty = uom._compute_quantity(quantity, seller.product_uom)
+            if float_compare(seller_qty, seller.min_qty, precision_digits=precision) >= 0:
+                reached.append(seller.id)
+        return tuple(reached)
+
+    def _resolve_seller(self, line, quantity, date, memo):
+        """
+        🎯 Proveedor de la línea según las reglas de Odoo (_select_seller)
+
+        Respeta compañía, vigencia, cantidad mínima y secuencia. Se memoriza
+        en `memo` por (producto, tramo de cantidad, compañía, fecha). Si
+        ningún tramo aplica se usa el primer proveedor vigente.
+        """
+        company = line.company_id
+        product = line.product_id.with_company(company)
+        purchase_uom = self._get_purchase_uom(line)
+        if line.product_uom and purchase_uom != line.product_uom:
+            quantity = line.product_uom._compute_quantity(quantity, purchase_uom)
         
-        # (Toda la lógica de agrupación de líneas no cambia)
-        for line in sale_order.order_line:
-            qty_sold = line.product_uom_qty
-            qty_to_purchase = qty_sold
+        key = (product.id, self._get_seller_quantity_bucket(product, quantity, purchase_uom), company.id, date)
+        if key not in memo:
+            seller = product._select_seller(quantity=quantity, date=date, uom_id=purchase_uom)
+            if not seller:
+                seller = product._select_seller(quantity=None, date=date, uom_id=purchase_uom)
+            memo[key] = seller
+        return memo[key]
 
-            if self.x_purchase_only_missing:
-                qty_to_purchase = line.x_qty_pending_purchase
-                if qty_to_purchase < 0:
-                    qty_to_purchase = 0.0
+    def _get_vendor_and_price(self, line, quantity, generic_vendor, date, memo):
+        """Proveedor y precio de compra para una línea de venta"""
+        seller = self._resolve_seller(line, quantity, date, memo)
+        if seller:
+            return seller.partner_id, seller.price
+        return generic_vendor, line.price_unit
+
+    def _get_qty_to_purchase(self, line):
+        """Cantidad a comprar (UdM de venta) según la opción de solo faltantes"""
+        qty_to_purchase = line.product_uom_qty
+        if self.x_purchase_only_missing:
+            qty_to_purchase = max(line.x_qty_pending_purchase, 0.0)
+        return qty_to_purchase
+
+    def _append_line_data(self, lines_by_vendor, line, vendor, price, qty, generic_vendor, purchase_qty=None):
+        """
+        Agrega una línea a comprar al grupo de su proveedor
+
+        `qty` va en la UdM de venta; `purchase_qty`, si se indica, es la misma
+        cantidad ya en la UdM de compra (vista previa) y se usa tal cual.
+        """
+        vendor_key = vendor if self.group_by_vendor else 'all'
+        lines_by_vendor.setdefault(vendor_key, []).append({
+            'line': line,
+            'price': price,
+            'vendor': vendor,
+            'qty_to_purchase': qty,
+            'purchase_qty': purchase_qty,
+            'generic': vendor == generic_vendor,
+        })
+
+    def _group_lines_by_vendor(self, lines, generic_vendor):
+        """
+        🎯 Agrupa las líneas de venta a comprar por proveedor
+
+        Devuelve {proveedor (o 'all'): [datos de línea]}; con varias ventas
+        las líneas de un mismo proveedor terminan en una sola compra.
+        """
+        lines_by_vendor = {}
+        self._prefetch_sellers(lines.filtered('product_id'))
+        memo = {}
+        date = fields.Date.context_today(self)
+        for line in lines:
+            qty_to_purchase = self._get_qty_to_purchase(line)
             
             if qty_to_purchase <= 0:
                 _logger.info(
@@ -127,81 +257,193 @@ class CreatePurchaseWizard(models.TransientModel):
                 )
                 continue 
             
-            vendor = False
-            price = line.price_unit
-            
-            if line.product_id.seller_ids:
-                vendor = line.product_id.seller_ids[0].partner_id
-                price = line.product_id.seller_ids[0].price
-            else:
-                vendor = generic_vendor
-            
-            if self.group_by_vendor:
-                if vendor not in lines_by_vendor:
-                    lines_by_vendor[vendor] = []
-                lines_by_vendor[vendor].append({
-                    'line': line, 
-                    'price': price,
-                    'qty_to_purchase': qty_to_purchase
-                })
-            else:
-                if 'all' not in lines_by_vendor:
-                    lines_by_vendor['all'] = []
-                lines_by_vendor['all'].append({
-                    'line': line,
-                    'price': price,
-                    'vendor': vendor,
-                    'qty_to_purchase': qty_to_purchase
-                })
+            vendor, price = self._get_vendor_and_price(line, qty_to_purchase, generic_vendor, date, memo)
+            self._append_line_data(lines_by_vendor, line, vendor, price, qty_to_purchase, generic_vendor)
+        return lines_by_vendor
+
+    def _group_preview_by_vendor(self, generic_vendor):
+        """
+        🎯 Agrupa por proveedor la vista previa (con las ediciones del usuario)
+
+        Con "solo faltantes" la cantidad se limita a la pendiente leída dentro
+        de la reserva, por si otro comprador avanzó desde que se abrió el wizard.
+        La vista previa está en la UdM de compra; la comparación se hace en esa UdM.
+        """
+        lines_by_vendor = {}
+        for preview in self.line_ids:
+            line = preview.sale_line_id
+            purchase_uom = preview.product_uom or self._get_purchase_uom(line)
+            purchase_qty = preview.product_qty
+            if self.x_purchase_only_missing:
+                pending = line.product_uom._compute_quantity(
+                    max(line.x_qty_pending_purchase, 0.0), purchase_uom, round=False
+                )
+                if float_compare(purchase_qty, pending, precision_rounding=purchase_uom.rounding or 0.01) > 0:
+                    _logger.info(
+                        'Línea %s: cantidad propuesta %s limitada a la pendiente %s',
+                        line.product_id.name, purchase_qty, pending
+                    )
+                    # Redondeo hacia arriba, como _compute_quantity: así la línea
+                    # de venta no queda 'parcial' por un residuo de redondeo
+                    purchase_qty = float_round(
+                        pending, precision_rounding=purchase_uom.rounding or 0.01, rounding_method='UP'
+                    )
+            if not preview.to_purchase or purchase_qty <= 0:
+                continue
+            qty = purchase_uom._compute_quantity(purchase_qty, line.product_uom, round=False)
+            vendor = preview.vendor_id or generic_vendor
+            self._append_line_data(
+                lines_by_vendor, line, vendor, preview.price_unit, qty, generic_vendor,
+                purchase_qty=purchase_qty if purchase_uom == self._get_purchase_uom(line) else None,
+            )
+        return lines_by_vendor
+
+    def _prepare_purchase_line_vals(self, line_data, date_planned):
+        """Valores de la línea de compra (en la UdM de compra del producto)"""
+        line = line_data['line']
+        qty = line_data['qty_to_purchase']
         
-        if not lines_by_vendor:
-            raise UserError(_(
-                'No se crearon órdenes de compra. Todos los productos'
-                ' ya están comprados o las cantidades a comprar son cero.'
-            ))
-            
-        # (Toda la lógica de creación de POs no cambia)
-        for vendor_key, lines_data in lines_by_vendor.items():
-            if vendor_key == 'all':
-                vendor = lines_data[0]['vendor']
+        # La cantidad pendiente está en la UdM de venta; la línea de
+        # compra se crea en la UdM de compra del producto
+        purchase_uom = self._get_purchase_uom(line)
+        if line_data.get('purchase_qty') is not None:
+            qty = line_data['purchase_qty']
+        elif line.product_uom and purchase_uom != line.product_uom:
+            qty = line.product_uom._compute_quantity(qty, purchase_uom)
+        
+        return {
+            'product_id': line.product_id.id,
+            'name': line.product_id.name,
+            'product_qty': qty,
+            'price_unit': line_data['price'],
+            'product_uom': purchase_uom.id,
+            'date_planned': date_planned,
+            'x_sale_line_id': line.id,
+        }
+
+    def _prepare_purchase_order_vals(self, vendor, lines_data, date_planned):
+        """
+        🎯 Valores de una orden de compra (posiblemente consolidada)
+
+        Solo se vincula la cabecera (x_sale_order_id y datos del vehículo)
+        cuando todas las líneas vienen de la misma venta; cada línea conserva
+        siempre su x_sale_line_id, y con ella la liquidación de cada venta
+        suma su parte de la compra consolidada.
+        """
+        sale_orders = self.env['sale.order.line'].browse(
+            [line_data['line'].id for line_data in lines_data]
+        ).order_id
+        po_vals = {
+            'partner_id': vendor.id,
+            'origin': ', '.join(sale_orders.mapped('name')),
+            'order_line': [
+                (0, 0, self._prepare_purchase_line_vals(line_data, date_planned))
+                for line_data in lines_data
+            ],
+        }
+        if len(sale_orders) == 1:
+            po_vals.update({
+                'x_sale_order_id': sale_orders.id,
+                'x_placa': sale_orders.x_placa,
+                'x_marca': sale_orders.x_marca,
+                'x_anio': sale_orders.x_anio,
+                'x_vin': sale_orders.x_vin,
+            })
+        return po_vals
+
+    # ========== 🆕 REUTILIZAR BORRADORES EXISTENTES ==========
+    def _get_draft_key(self, vendor, lines_data):
+        """Clave (proveedor, venta) de un grupo; venta vacía si el grupo es consolidado"""
+        sale_orders = self.env['sale.order.line'].browse(
+            [line_data['line'].id for line_data in lines_data]
+        ).order_id
+        return (vendor.id, sale_orders.id if len(sale_orders) == 1 else False)
+
+    def _find_draft_purchase_orders(self, lines_by_vendor):
+        """
+        🎯 Busca en UNA consulta las solicitudes en borrador reutilizables
+
+        Devuelve {(proveedor, venta): compra}: borradores vinculados a la venta
+        o, para grupos consolidados, borradores sin venta en cabecera con
+        líneas de alguna de las ventas. Si hay varios se usa el más antiguo.
+        """
+        vendor_ids = {line_data['vendor'].id for lines in lines_by_vendor.values() for line_data in lines}
+        sale_order_ids = self._get_sale_orders().ids
+        drafts = self.env['purchase.order'].search([
+            ('state', '=', 'draft'),
+            ('partner_id', 'in', list(vendor_ids)),
+            '|',
+            ('x_sale_order_id', 'in', sale_order_ids),
+            '&',
+            ('x_sale_order_id', '=', False),
+            ('order_line.x_sale_order_id', 'in', sale_order_ids),
+        ], order='id')
+        result = {}
+        for draft in drafts:
+            result.setdefault((draft.partner_id.id, draft.x_sale_order_id.id or False), draft)
+        return result
+
+    def _merge_into_draft(self, purchase_order, lines_data, date_planned):
+        """
+        🎯 Agrega las líneas a una compra en borrador existente
+
+        Si ya hay una línea para la misma línea de venta se suma la cantidad
+        (en su UdM); las líneas duplicadas de una misma línea de venta se
+        colapsan en la primera. Todo en un solo write.
+        """
+        commands = []
+        existing = {}
+        for po_line in purchase_order.order_line.filtered('x_sale_line_id'):
+            current = existing.get(po_line.x_sale_line_id)
+            if current is None:
+                existing[po_line.x_sale_line_id] = [po_line, po_line.product_qty]
             else:
-                vendor = vendor_key
-            
-            po_vals = {
-                'partner_id': vendor.id,
-                'x_sale_order_id': sale_order.id,
-                'x_placa': sale_order.x_placa,
-                'x_marca': sale_order.x_marca,
-                'x_anio': sale_order.x_anio,
-                'x_vin': sale_order.x_vin,
-                'order_line': [],
-            }
-            
-            for line_data in lines_data:
-                line = line_data['line']
-                price = line_data['price']
-                qty = line_data['qty_to_purchase']
-                
-                po_line_vals = {
-                    'product_id': line.product_id.id,
-                    'name': line.product_id.name,
-                    'product_qty': qty,
-                    'price_unit': price,
-                    'product_uom': line.product_id.uom_po_id.id,
-                    'date_planned': fields.Datetime.now(),
-                    'x_sale_line_id': line.id,
-                }
-                po_vals['order_line'].append((0, 0, po_line_vals))
-            
-            purchase_order = self.env['purchase.order'].create(po_vals)
-            purchase_orders |= purchase_order
+                current[1] += po_line.product_uom._compute_quantity(
+                    po_line.product_qty, current[0].product_uom
+                )
+                commands.append((2, po_line.id))
+        
+        for line_data in lines_data:
+            line_vals = self._prepare_purchase_line_vals(line_data, date_planned)
+            current = existing.get(line_data['line'])
+            if current is None:
+                commands.append((0, 0, line_vals))
+                continue
+            po_line = current[0]
+            current[1] += self.env['uom.uom'].browse(line_vals['product_uom'])._compute_quantity(
+                line_vals['product_qty'], po_line.product_uom
+            )
         
-        # (La lógica de message_post no cambia)
-        generic_lines = sum(1 for v, lines in lines_by_vendor.items() 
-                          for ld in lines 
-                          if not ld['line'].product_id.seller_ids)
+        for po_line, qty in existing.values():
+            if float_compare(qty, po_line.product_qty, precision_rounding=po_line.product_uom.rounding):
+                commands.append((1, po_line.id, {'product_qty': qty}))
         
-        if generic_lines > 0:
+        vals = {}
+        if commands:
+            vals['order_line'] = commands
+        origins = [origin.strip() for origin in (purchase_order.origin or '').split(',') if origin.strip()]
+        for line_data in lines_data:
+            name = line_data['line'].order_id.name
+            if name not in origins:
+                origins.append(name)
+        if ', '.join(origins) != (purchase_order.origin or ''):
+            vals['origin'] = ', '.join(origins)
+        if vals:
+            purchase_order.write(vals)
+
+    def _post_generic_vendor_message(self, lines_by_vendor):
+        """Avisa en cada venta cuántos productos quedaron con el PROVEEDOR GENERICO"""
+        generic_count = {}
+        for lines_data in lines_by_vendor.values():
+            for line_data in lines_data:
+                if line_data['generic']:
+                    order = line_data['line'].order_id
+                    generic_count[order] = generic_count.get(order, 0) + 1
+        self._post_generic_vendor_count(generic_count)
+
+    def _post_generic_vendor_count(self, generic_count):
+        """Publica el aviso del PROVEEDOR GENERICO: {venta: cantidad de productos}"""
+        for sale_order, generic_lines in generic_count.items():
             sale_order.message_post(
                 body=_(
                     '<p><strong>ℹ️ Órdenes de Compra Creadas</strong></p>'
@@ -210,8 +452,120 @@ class CreatePurchaseWizard(models.TransientModel):
                     '<p><em>Puede cambiar el proveedor editando las órdenes de compra creadas.</em></p>'
                 ) % generic_lines
             )
+
+    def action_create_purchase_orders(self):
+        """
+        Crea las órdenes de compra con la lógica de "solo faltantes"
+
+        Con varias ventas seleccionadas genera UNA compra por proveedor para
+        todas ellas, creadas en un solo create().
+        """
+        self.ensure_one()
+        
+        sale_orders = self._get_sale_orders()
+        if not sale_orders:
+            raise UserError(_('Seleccione al menos una orden de venta.'))
+        if not sale_orders.order_line:
+            raise UserError(_('La orden de venta no tiene líneas.'))
         
+        if self.x_run_in_background:
+            return self._enqueue_creation_job(sale_orders)
         
+        self._reserve_sale_orders(sale_orders)
+        generic_vendor = self._get_or_create_generic_vendor()
+        lines_by_vendor = self._group_preview_by_vendor(generic_vendor)
+        
+        if not lines_by_vendor:
+            raise UserError(_(
+                'No se crearon órdenes de compra. Todos los productos'
+                ' ya están comprados o las cantidades a comprar son cero.'
+            ))
+        
+        purchase_orders = self._create_purchase_orders(lines_by_vendor)
+        self._post_generic_vendor_message(lines_by_vendor)
+        
+        return self._get_purchase_orders_action(purchase_orders)
+
+    # ========== 🆕 RESERVA CONCURRENTE DE VENTAS ==========
+    def _reserve_sale_orders(self, sale_orders):
+        """
+        🎯 Reserva las ventas antes de calcular las cantidades pendientes
+
+        1. Un advisory lock de transacción por venta: dos compradores sobre
+           la misma venta no pueden crear compras a la vez (el segundo recibe
+           un aviso), y ventas distintas nunca se bloquean entre sí.
+        2. SELECT ... FOR UPDATE NOWAIT sobre sus líneas: si otra transacción
+           ya compró y actualizó x_qty_purchased después de que empezó esta,
+           PostgreSQL lanza un error de concurrencia y Odoo reintenta la
+           petición con datos frescos, en vez de comprar dos veces.
+        """
+        if not sale_orders:
+            return
+        cr = self.env.cr
+        for sale_order in sale_orders.sorted('id'):
+            cr.execute('SELECT pg_try_advisory_xact_lock(%s, %s)', [PURCHASE_LOCK_NAMESPACE, sale_order.id])
+            if not cr.fetchone()[0]:
+                raise UserError(_(
+                    'Otro usuario está creando compras para la venta %s en este momento. '
+                    'Intente de nuevo en unos segundos.', sale_order.name
+                ))
+        
+        SaleOrderLine = self.env['sale.order.line']
+        SaleOrderLine.flush_model()
+        cr.execute(
+            'SELECT id FROM sale_order_line WHERE order_id IN %s FOR UPDATE NOWAIT',
+            [tuple(sale_orders.ids)]
+        )
+        # Las cantidades pendientes se leen de nuevo, ya dentro de la reserva
+        SaleOrderLine.invalidate_model(['x_qty_purchased', 'x_qty_pending_purchase', 'x_purchase_status'])
+
+    def _create_purchase_orders(self, lines_by_vendor):
+        """
+        Crea (o completa borradores de) las compras de cada grupo de proveedor;
+        las nuevas se crean en un solo create()
+        """
+        date_planned = fields.Datetime.now()
+        drafts = self._find_draft_purchase_orders(lines_by_vendor) if self.x_merge_into_draft else {}
+        purchase_orders = self.env['purchase.order']
+        vals_list = []
+        for vendor_key, lines_data in lines_by_vendor.items():
+            vendor = lines_data[0]['vendor'] if vendor_key == 'all' else vendor_key
+            draft = drafts.get(self._get_draft_key(vendor, lines_data))
+            if draft:
+                self._merge_into_draft(draft, lines_data, date_planned)
+                purchase_orders |= draft
+            else:
+                vals_list.append(self._prepare_purchase_order_vals(vendor, lines_data, date_planned))
+        if vals_list:
+            purchase_orders |= self.env['purchase.order'].create(vals_list)
+        return purchase_orders
+
+    # ========== 🆕 MODO EN SEGUNDO PLANO ==========
+    def _enqueue_creation_job(self, sale_orders):
+        """
+        🎯 Encola la creación en un trabajo procesado por ir.cron
+
+        La petición HTTP solo registra el trabajo; la agrupación y la
+        creación de compras se hacen en el cron, por proveedor y con commit.
+        """
+        job = self.env['sale.purchase.creation.job'].create({
+            'sale_order_ids': [(6, 0, sale_orders.ids)],
+            'group_by_vendor': self.group_by_vendor,
+            'x_purchase_only_missing': self.x_purchase_only_missing,
+            'x_merge_into_draft': self.x_merge_into_draft,
+        })
+        job._trigger_processing()
+        return {
+            'name': _('Creación de Compras en Segundo Plano'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'sale.purchase.creation.job',
+            'res_id': job.id,
+            'view_mode': 'form',
+            'target': 'current',
+        }
+
+    def _get_purchase_orders_action(self, purchase_orders):
+        """Acción para mostrar las compras creadas"""
         # --- INICIO DE LA SOLUCIÓN AL ERROR ---
         # Corrección para el Error #4: Estructura de acción incorrecta 
         # Leemos la acción base para obtener un dict completo y consistente.
@@ -236,4 +590,56 @@ class CreatePurchaseWizard(models.TransientModel):
         
         # 3. Retornar la acción COMPLETA y CONSISTENTE
         return action
-        # --- FIN DE LA SOLUCIÓN ---
\ No newline at end of file
+        # --- FIN DE LA SOLUCIÓN ---
+
+
+class CreatePurchaseWizardLine(models.TransientModel):
+    _name = 'create.purchase.wizard.line'
+    _description = 'Línea Propuesta del Wizard de Compras'
+
+    wizard_id = fields.Many2one('create.purchase.wizard', required=True, ondelete='cascade')
+    sale_line_id = fields.Many2one('sale.order.line', string='Línea de Venta', required=True, readonly=True)
+    sale_order_id = fields.Many2one(related='sale_line_id.order_id', string='Orden de Venta')
+    product_id = fields.Many2one(related='sale_line_id.product_id', string='Producto')
+    product_uom = fields.Many2one('uom.uom', string='UdM de Compra', readonly=True)
+    qty_pending = fields.Float(
+        string='Pendiente',
+        compute='_compute_qty_pending',
+        digits='Product Unit of Measure',
+        help='Cantidad pendiente de la línea de venta, en la UdM de compra'
+    )
+    to_purchase = fields.Boolean(string='Comprar', default=True)
+    product_qty = fields.Float(string='Cantidad', digits='Product Unit of Measure', help='En la UdM de compra')
+    vendor_id = fields.Many2one(
+        'res.partner',
+        string='Proveedor',
+        help='Vacío = PROVEEDOR GENERICO'
+    )
+    price_unit = fields.Float(string='Precio', digits='Product Price', help='Por UdM de compra')
+
+    @api.depends('sale_line_id.x_qty_pending_purchase', 'product_uom')
+    def _compute_qty_pending(self):
+        for preview in self:
+            sale_line = preview.sale_line_id
+            preview.qty_pending = sale_line.product_uom._compute_quantity(
+                max(sale_line.x_qty_pending_purchase, 0.0), preview.product_uom or sale_line.product_uom
+            )
+
+    @api.onchange('vendor_id', 'product_qty')
+    def _onchange_vendor_id_price(self):
+        """Recalcula el precio con la tarifa del proveedor elegido (_select_seller)"""
+        sale_line = self.sale_line_id
+        if not sale_line.product_id:
+            return
+        if not self.vendor_id:
+            # PROVEEDOR GENERICO: mismo precio que al crear la compra sin proveedor
+            self.price_unit = sale_line.price_unit
+            return
+        seller = sale_line.product_id.with_company(sale_line.company_id)._select_seller(
+            partner_id=self.vendor_id,
+            quantity=self.product_qty,
+            date=fields.Date.context_today(self),
+            uom_id=self.product_uom,
+        )
+        if seller:
+            self.price_unit = seller.price
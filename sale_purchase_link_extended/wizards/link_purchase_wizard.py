@@ -70,6 +70,44 @@ class LinkPurchaseWizard(models.TransientModel):
         compute='_compute_available_purchases'
     )
     
+    # ========== 🆕 PAGINACIÓN ==========
+    page = fields.Integer(string='Página', default=1)
+    
+    page_size = fields.Integer(
+        string='Resultados por Página',
+        default=80,
+        help='Cantidad máxima de compras que se muestran a la vez'
+    )
+    
+    page_count = fields.Integer(
+        string='Páginas',
+        compute='_compute_available_purchases'
+    )
+    
+    # ========== 🆕 SUGERENCIAS ==========
+    suggestion_ids = fields.One2many(
+        'link.purchase.suggestion',
+        'wizard_id',
+        string='Sugerencias',
+        compute='_compute_suggestion_ids',
+        store=True,
+        help='Compras sin venta con mayor probabilidad de pertenecer a esta venta'
+    )
+    
+    # ========== 🆕 CONCILIACIÓN POR LÍNEA ==========
+    x_reconcile_lines = fields.Boolean(
+        string='Conciliar líneas con la venta',
+        default=True,
+        help='Si se marca, cada línea de compra se asocia a la línea de venta del mismo producto, '
+             'para que cuente como comprada en el control de productos.'
+    )
+    
+    allocation_ids = fields.One2many(
+        'link.purchase.allocation',
+        'wizard_id',
+        string='Conciliación Propuesta'
+    )
+    
     x_copy_vehicle_data = fields.Boolean(
         string='Copiar datos de vehículo a las compras',
         default=True,
@@ -112,45 +150,81 @@ class LinkPurchaseWizard(models.TransientModel):
             html += '</div>'
             wizard.sale_vehicle_info = html
     
-    @api.depends('partner_id', 'date_from', 'date_to', 'origin_filter', 'state_filter')
+    @api.depends('sale_order_id')
+    def _compute_suggestion_ids(self):
+        """Mejores candidatos según placa/VIN, productos, proveedor y fecha"""
+        for wizard in self:
+            commands = [(5, 0, 0)]
+            if wizard.sale_order_id:
+                commands += [
+                    (0, 0, {
+                        'purchase_id': candidate['purchase'].id,
+                        'score': candidate['score'],
+                        'reasons': ', '.join(candidate['reasons']),
+                    })
+                    for candidate in wizard.sale_order_id._get_purchase_link_candidates()
+                ]
+            wizard.suggestion_ids = commands
+    
+    def _get_available_purchases_domain(self):
+        """Dominio de compras disponibles según los filtros"""
+        self.ensure_one()
+        # Solo compras sin venta asociada (ni por cabecera ni consolidadas por línea)
+        domain = self.env['purchase.order']._get_orphan_domain()
+        
+        # Aplicar filtros
+        if self.partner_id:
+            domain.append(('partner_id', '=', self.partner_id.id))
+        
+        if self.date_from:
+            domain.append(('date_order', '>=', self.date_from))
+        
+        if self.date_to:
+            domain.append(('date_order', '<=', self.date_to))
+        
+        if self.origin_filter:
+            domain.extend([
+                '|', 
+                ('name', 'ilike', self.origin_filter),
+                ('partner_ref', 'ilike', self.origin_filter),
+            ])
+        
+        if self.state_filter:
+            domain.append(('state', '=', self.state_filter))
+        return domain
+    
+    @api.depends('partner_id', 'date_from', 'date_to', 'origin_filter', 'state_filter', 'page', 'page_size')
     def _compute_available_purchases(self):
         """
-        🎯 Busca compras disponibles según los filtros
+        🎯 Busca compras disponibles según los filtros, una página a la vez
         
         Excluye:
         - Compras ya vinculadas a esta venta
         - Compras canceladas (opcional según state_filter)
+        
+        El total sale de un search_count aparte; solo se cargan page_size
+        compras (índices parciales sobre x_sale_order_id IS NULL y trigram
+        sobre name/partner_ref en purchase.order).
         """
+        PurchaseOrder = self.env['purchase.order']
         for wizard in self:
-            domain = [
-                ('x_sale_order_id', '=', False),  # Solo compras sin venta asociada
-            ]
-            
-            # Aplicar filtros
-            if wizard.partner_id:
-                domain.append(('partner_id', '=', wizard.partner_id.id))
-            
-            if wizard.date_from:
-                domain.append(('date_order', '>=', wizard.date_from))
-            
-            if wizard.date_to:
-                domain.append(('date_order', '<=', wizard.date_to))
-            
-            if wizard.origin_filter:
-                domain.append(
-                    '|', 
-                    ('name', 'ilike', wizard.origin_filter),
-                    ('partner_ref', 'ilike', wizard.origin_filter)
-                )
-            
-            if wizard.state_filter:
-                domain.append(('state', '=', wizard.state_filter))
+            domain = wizard._get_available_purchases_domain()
+            page_size = max(wizard.page_size, 1)
+            count = PurchaseOrder.search_count(domain)
+            page_count = max((count + page_size - 1) // page_size, 1)
+            page = min(max(wizard.page, 1), page_count)
             
             # Buscar compras
-            purchases = self.env['purchase.order'].search(domain, order='date_order desc')
-            
-            wizard.available_purchase_ids = purchases
-            wizard.available_count = len(purchases)
+            wizard.available_purchase_ids = PurchaseOrder.search(
+                domain, order='date_order desc, id desc', limit=page_size, offset=(page - 1) * page_size
+            )
+            wizard.available_count = count
+            wizard.page_count = page_count
+    
+    @api.onchange('partner_id', 'date_from', 'date_to', 'origin_filter', 'state_filter', 'page_size')
+    def _onchange_filters_reset_page(self):
+        """Al cambiar un filtro se vuelve a la primera página"""
+        self.page = 1
     
     # ========== ACCIONES ==========
     
@@ -162,8 +236,31 @@ class LinkPurchaseWizard(models.TransientModel):
             'type': 'ir.actions.do_nothing',
         }
     
+    def _reopen(self):
+        """Mantiene abierto el wizard tras un botón"""
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+            'name': _('Vincular Órdenes de Compra Existentes'),
+        }
+    
+    def action_next_page(self):
+        """Muestra la página siguiente de resultados"""
+        self.ensure_one()
+        self.page = min(self.page + 1, self.page_count)
+        return self._reopen()
+    
+    def action_previous_page(self):
+        """Muestra la página anterior de resultados"""
+        self.ensure_one()
+        self.page = max(self.page - 1, 1)
+        return self._reopen()
+    
     def action_select_all(self):
-        """Selecciona todas las compras disponibles"""
+        """Selecciona todas las compras disponibles de la página actual"""
         self.ensure_one()
         self.selected_purchase_ids = [(6, 0, self.available_purchase_ids.ids)]
         return {
@@ -178,45 +275,88 @@ class LinkPurchaseWizard(models.TransientModel):
             'type': 'ir.actions.do_nothing',
         }
     
-    def action_link_purchases(self):
-        """
-        🎯 Vincula las compras seleccionadas a la venta
+    def _prepare_link_vals(self, po):
+        """Valores para vincular una compra (solo los campos que cambian)"""
+        sale = self.sale_order_id
+        vals = {
+            'x_sale_order_id': sale.id,
+        }
         
-        Proceso:
-        1. Actualiza x_sale_order_id en cada compra
-        2. Opcionalmente copia datos de vehículo
-        3. Agrega mensaje en chatter de la venta
-        4. Recalcula campos computados
-        """
+        # Copiar datos de vehículo si está marcado
+        if self.x_copy_vehicle_data:
+            for field_name in ('x_placa', 'x_marca', 'x_anio', 'x_vin'):
+                value = sale[field_name]
+                if value and po[field_name] != value.upper():
+                    vals[field_name] = value
+        return vals
+    
+    def _prepare_allocation_vals(self, purchases):
+        """Propuesta de conciliación por línea para las compras dadas"""
+        return [
+            {
+                'purchase_line_id': po_line.id,
+                'sale_line_id': sale_line.id,
+                'qty': qty,
+            }
+            for po_line, sale_line, qty in purchases._allocate_sale_lines(self.sale_order_id)
+        ]
+    
+    def action_preview_allocation(self):
+        """Calcula la conciliación por línea para revisarla antes de vincular"""
         self.ensure_one()
-        
         if not self.selected_purchase_ids:
             raise UserError(_('Debe seleccionar al menos una orden de compra para vincular.'))
+        self.allocation_ids = [(5, 0, 0)] + [
+            (0, 0, vals) for vals in self._prepare_allocation_vals(self.selected_purchase_ids)
+        ]
+        return self._reopen()
+    
+    def _reconcile_purchase_lines(self, purchases):
+        """
+        🎯 Asigna x_sale_line_id a todas las líneas conciliadas de una vez
         
-        sale = self.sale_order_id
-        linked_count = 0
+        Para las compras que están en la vista previa usa solo las filas que
+        quedaron marcadas; para el resto (sin vista previa o agregadas después)
+        la calcula. Las escrituras se agrupan por línea de venta y se envían en
+        un único flush, así las cantidades compradas de la venta se recalculan
+        una sola vez.
+        """
+        previewed = self.allocation_ids.filtered(lambda a: a.purchase_line_id.order_id in purchases)
+        pairs = [
+            (allocation.purchase_line_id, allocation.sale_line_id)
+            for allocation in previewed
+            if allocation.selected and not allocation.purchase_line_id.x_sale_line_id
+        ]
+        pending_purchases = purchases - previewed.purchase_line_id.order_id
+        pairs += [
+            (po_line, sale_line)
+            for po_line, sale_line, qty in pending_purchases._allocate_sale_lines(self.sale_order_id)
+        ]
+        return self.env['purchase.order']._write_sale_line_allocations(pairs)
+    
+    def _link_purchase_orders(self, purchases):
+        """
+        🎯 Vincula las compras en bloque
         
-        for po in self.selected_purchase_ids:
-            # Preparar valores
-            vals = {
-                'x_sale_order_id': sale.id,
-            }
-            
-            # Copiar datos de vehículo si está marcado
-            if self.x_copy_vehicle_data:
-                if sale.x_placa:
-                    vals['x_placa'] = sale.x_placa
-                if sale.x_marca:
-                    vals['x_marca'] = sale.x_marca
-                if sale.x_anio:
-                    vals['x_anio'] = sale.x_anio
-                if sale.x_vin:
-                    vals['x_vin'] = sale.x_vin
-            
-            # Actualizar compra
-            po.write(vals)
-            linked_count += 1
+        Agrupa las compras con valores idénticos en un solo write y omite el
+        mensaje por compra de PurchaseOrder.write (skip_sale_update): la venta
+        recibe un único resumen. Los campos de la venta se recalculan una vez
+        por el ORM a partir de purchase_order_ids.
+        """
+        groups = {}
+        for po in purchases:
+            vals = self._prepare_link_vals(po)
+            key = tuple(sorted(vals.items()))
+            groups.setdefault(key, [vals, []])[1].append(po.id)
+        
+        PurchaseOrder = self.env['purchase.order'].with_context(skip_sale_update=True)
+        for vals, po_ids in groups.values():
+            PurchaseOrder.browse(po_ids).write(vals)
+        
+        if self.x_reconcile_lines:
+            self._reconcile_purchase_lines(purchases)
         
+        sale = self.sale_order_id
         # Mensaje en chatter
         sale.message_post(
             body=_(
@@ -224,17 +364,31 @@ class LinkPurchaseWizard(models.TransientModel):
                 '<p>Se vincularon <strong>%s</strong> órdenes de compra existentes:</p>'
                 '<ul>%s</ul>'
             ) % (
-                linked_count,
-                ''.join([f'<li>{po.name} - {po.partner_id.name}</li>' for po in self.selected_purchase_ids])
+                len(purchases),
+                ''.join([f'<li>{po.name} - {po.partner_id.name}</li>' for po in purchases])
             )
         )
         
-        # Forzar recálculo de todos los campos relacionados
-        sale._compute_purchase_order_count()
-        sale._compute_liquidation_data()
-        sale._compute_purchase_statistics()
-        sale._compute_purchase_orders_summary()
-        sale._compute_products_control_summary()
+        # Un solo recálculo de los campos almacenados de la venta
+        self.env['sale.order'].flush_model()
+        return len(purchases)
+    
+    def action_link_purchases(self):
+        """
+        🎯 Vincula las compras seleccionadas a la venta
+        
+        Proceso:
+        1. Actualiza x_sale_order_id de todas las compras (en bloque)
+        2. Opcionalmente copia datos de vehículo
+        3. Agrega un único mensaje en chatter de la venta
+        """
+        self.ensure_one()
+        
+        if not self.selected_purchase_ids:
+            raise UserError(_('Debe seleccionar al menos una orden de compra para vincular.'))
+        
+        sale = self.sale_order_id
+        linked_count = self._link_purchase_orders(self.selected_purchase_ids)
         
         # Mostrar notificación
         return {
@@ -250,3 +404,40 @@ class LinkPurchaseWizard(models.TransientModel):
                 }
             }
         }
+
+
+class LinkPurchaseSuggestion(models.TransientModel):
+    _name = 'link.purchase.suggestion'
+    _description = 'Sugerencia de Compra a Vincular'
+    _order = 'score desc, id'
+
+    wizard_id = fields.Many2one('link.purchase.wizard', required=True, ondelete='cascade')
+    purchase_id = fields.Many2one('purchase.order', string='Orden de Compra', required=True, readonly=True)
+    partner_id = fields.Many2one(related='purchase_id.partner_id', string='Proveedor')
+    date_order = fields.Datetime(related='purchase_id.date_order', string='Fecha')
+    amount_total = fields.Monetary(related='purchase_id.amount_total', string='Total')
+    currency_id = fields.Many2one(related='purchase_id.currency_id')
+    x_placa = fields.Char(related='purchase_id.x_placa', string='Placa')
+    score = fields.Float(string='Puntaje', digits=(16, 1), readonly=True)
+    reasons = fields.Char(string='Coincidencias', readonly=True)
+
+    def action_link(self):
+        """🎯 Vincula esta compra a la venta con un clic"""
+        self.ensure_one()
+        wizard = self.wizard_id
+        wizard.selected_purchase_ids = [(6, 0, self.purchase_id.ids)]
+        return wizard.action_link_purchases()
+
+
+class LinkPurchaseAllocation(models.TransientModel):
+    _name = 'link.purchase.allocation'
+    _description = 'Conciliación Propuesta Línea de Compra - Línea de Venta'
+
+    wizard_id = fields.Many2one('link.purchase.wizard', required=True, ondelete='cascade')
+    selected = fields.Boolean(string='Conciliar', default=True)
+    purchase_line_id = fields.Many2one('purchase.order.line', string='Línea de Compra', required=True, readonly=True)
+    purchase_id = fields.Many2one(related='purchase_line_id.order_id', string='Orden de Compra')
+    product_id = fields.Many2one(related='purchase_line_id.product_id', string='Producto')
+    sale_line_id = fields.Many2one('sale.order.line', string='Línea de Venta', required=True, readonly=True)
+    qty = fields.Float(string='Cantidad (UdM Venta)', digits='Product Unit of Measure', readonly=True)
+    product_uom = fields.Many2one(related='sale_line_id.product_uom', string='UdM')